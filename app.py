@@ -9,30 +9,66 @@ from flask import (
     flash,
     session,
     jsonify,
-    send_from_directory,
+    send_file,
+    abort,
+    Response,
 )
 from flask_socketio import SocketIO, emit, join_room
-import os, json
+import os, json, io, base64
 from datetime import datetime
 import requests
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
+from werkzeug.exceptions import ClientDisconnected, RequestEntityTooLarge
 import yt_dlp
 import logging
 import platform
 import uuid
 from PIL import Image
-import img2pdf
-from pdf2image import convert_from_path
 import tempfile
 import shutil
+from collections import Counter, deque
+import subprocess
 import zipfile
 import time
-from PyPDF2 import PdfMerger  # 用于合并PDF
+import hashlib
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    ProcessPoolExecutor,
+    as_completed,
+    wait,
+    FIRST_COMPLETED,
+)
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import queue
+import atexit
+import sqlite3
+import threading
+import psutil
+from contextlib import contextmanager
+import mimetypes
+import gzip
+import brotli
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode, quote
 
 from config.config import Config
 import config.config as cfg
 from config.config import logger
 from config.const import *
+from converter import (
+    IMAGE_EXTENSIONS,
+    convert_file,
+    estimate_conversion_pixels,
+    get_pdf_page_count,
+    get_raster_options,
+    get_resize_box,
+    images_to_pdf,
+    init_worker,
+    is_supported_conversion,
+    open_image_for_box,
+    render_pdf_preview,
+)
 try:
     from config.personal import PersonalConfig as PC
 except ImportError:
@@ -43,6 +79,7 @@ except ImportError:
 app = Flask(__name__)
 app.secret_key = Config.SECRET_KEY
 app.config["UPLOAD_FOLDER"] = "uploads"
+app.config["MAX_CONTENT_LENGTH"] = Const.MAX_CONTENT_LENGTH
 app.config["ALLOWED_EXTENSIONS"] = {
     "txt",
     "pdf",
@@ -61,7 +98,8 @@ app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 
 # 创建SocketIO
-socketio = SocketIO(app)
+# 多 worker 部署时可配置消息队列（如 redis://），使任意 worker 发出的事件都能送达客户端
+socketio = SocketIO(app, message_queue=Const.SOCKETIO_MESSAGE_QUEUE)
 
 # 默认用户信息（由于删除了登录功能，使用默认用户）
 DEFAULT_USER_INFO = {
@@ -71,6 +109,246 @@ DEFAULT_USER_INFO = {
     "login_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 }
 
+# ================ 共享状态存储（SQLite） ================
+# gunicorn 的多个 worker 进程之间需要共享的数据统一放在这个 SQLite 文件里
+
+STATE_DB_SCHEMA = [
+    # 缓存命中统计
+    """
+    CREATE TABLE IF NOT EXISTS cache_stats (
+        name TEXT PRIMARY KEY,
+        hits INTEGER NOT NULL DEFAULT 0,
+        misses INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    # 视频解析结果缓存
+    """
+    CREATE TABLE IF NOT EXISTS parse_cache (
+        key TEXT PRIMARY KEY,
+        payload TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        last_access REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_parse_cache_access ON parse_cache (last_access)",
+    # 视频下载任务
+    """
+    CREATE TABLE IF NOT EXISTS download_jobs (
+        job_id TEXT PRIMARY KEY,
+        url TEXT NOT NULL,
+        format_id TEXT NOT NULL,
+        merge_audio INTEGER NOT NULL,
+        state TEXT NOT NULL,
+        percent REAL NOT NULL DEFAULT 0,
+        speed TEXT,
+        eta TEXT,
+        filename TEXT,
+        error TEXT,
+        worker_pid INTEGER,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        cancel_requested_at REAL,
+        finished_at REAL,
+        dedup_key TEXT,
+        subscribers INTEGER NOT NULL DEFAULT 1,
+        merge_strategy TEXT,
+        merge_seconds REAL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_download_jobs_state ON download_jobs (state, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_download_jobs_dedup ON download_jobs (dedup_key, state)",
+    # 已下载完成的视频文件索引：(链接, 格式, 是否合并音频) -> 文件
+    """
+    CREATE TABLE IF NOT EXISTS video_files (
+        dedup_key TEXT PRIMARY KEY,
+        filename TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        last_access REAL NOT NULL
+    )
+    """,
+    # 产物索引：uploads/ 下生成的文件（路径相对 uploads/）
+    """
+    CREATE TABLE IF NOT EXISTS artifacts (
+        path TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        last_access REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_artifacts_access ON artifacts (last_access)",
+    # 视频缩略图的原始地址，解析时记录，供缩略图代理拉取
+    """
+    CREATE TABLE IF NOT EXISTS thumbnails (
+        key TEXT PRIMARY KEY,
+        source_url TEXT NOT NULL,
+        referer TEXT,
+        updated_at REAL NOT NULL,
+        failed_at REAL
+    )
+    """,
+    # 文件转换任务，files 为各文件状态，result 为结果文件（路径相对转换目录）
+    """
+    CREATE TABLE IF NOT EXISTS conversion_jobs (
+        job_id TEXT PRIMARY KEY,
+        task_id TEXT,
+        state TEXT NOT NULL,
+        percent REAL NOT NULL DEFAULT 0,
+        message TEXT,
+        eta TEXT,
+        files TEXT NOT NULL,
+        result TEXT,
+        error TEXT,
+        output_dir TEXT NOT NULL,
+        options TEXT,
+        worker_pid INTEGER,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_conversion_jobs_state ON conversion_jobs (state, finished_at)",
+    # 分块上传中的文件，sha256 在上传完成后写入
+    """
+    CREATE TABLE IF NOT EXISTS staged_uploads (
+        upload_id TEXT PRIMARY KEY,
+        filename TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        upload_offset INTEGER NOT NULL,
+        sha256 TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        busy_until REAL
+    )
+    """,
+    # 正在下载的任务，用于在所有 worker 间分配下载带宽
+    """
+    CREATE TABLE IF NOT EXISTS bandwidth_shares (
+        job_id TEXT PRIMARY KEY,
+        pid INTEGER NOT NULL,
+        registered_at REAL NOT NULL
+    )
+    """,
+    # 转换任务占用的像素预算，pid 所属进程退出后失效
+    """
+    CREATE TABLE IF NOT EXISTS pixel_reservations (
+        reservation_id TEXT PRIMARY KEY,
+        pid INTEGER NOT NULL,
+        pixels INTEGER NOT NULL,
+        created_at REAL NOT NULL
+    )
+    """,
+    # 转换结果缓存：outputs 为 [(文件名后缀, 缓存目录中的文件名)]
+    """
+    CREATE TABLE IF NOT EXISTS conversion_cache (
+        key TEXT PRIMARY KEY,
+        outputs TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        created_at REAL NOT NULL
+    )
+    """,
+    # 存储清理记录
+    """
+    CREATE TABLE IF NOT EXISTS storage_sweeps (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        finished_at REAL NOT NULL,
+        seconds REAL NOT NULL,
+        files INTEGER NOT NULL,
+        bytes INTEGER NOT NULL
+    )
+    """,
+    # 多 worker 间的后台任务租约，保证同一时间只有一个进程执行
+    """
+    CREATE TABLE IF NOT EXISTS service_leases (
+        name TEXT PRIMARY KEY,
+        owner_pid INTEGER NOT NULL,
+        expires_at REAL NOT NULL
+    )
+    """,
+]
+
+@contextmanager
+def state_db(transaction=False):
+    """
+    打开共享状态数据库
+    transaction=True 时整个 with 块在一个写事务（BEGIN IMMEDIATE）中执行
+    """
+    conn = sqlite3.connect(
+        Const.STATE_DB_PATH, timeout=Const.STATE_DB_TIMEOUT, isolation_level=None
+    )
+    conn.row_factory = sqlite3.Row
+    try:
+        if transaction:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        else:
+            yield conn
+    finally:
+        conn.close()
+
+def init_state_db():
+    os.makedirs(os.path.dirname(Const.STATE_DB_PATH) or ".", exist_ok=True)
+    with state_db() as db:
+        # WAL 模式下读写互不阻塞，适合多进程并发访问
+        db.execute("PRAGMA journal_mode=WAL")
+        for statement in STATE_DB_SCHEMA:
+            db.execute(statement)
+
+def record_cache_stat(name, hit):
+    try:
+        column = "hits" if hit else "misses"
+        with state_db() as db:
+            db.execute(
+                f"INSERT INTO cache_stats (name, {column}) VALUES (?, 1) "
+                f"ON CONFLICT(name) DO UPDATE SET {column} = {column} + 1",
+                (name,),
+            )
+    except sqlite3.Error as e:
+        logger.warning(f"记录缓存统计失败: {str(e)}")
+
+def get_cache_stats(name):
+    with state_db() as db:
+        row = db.execute(
+            "SELECT hits, misses FROM cache_stats WHERE name = ?", (name,)
+        ).fetchone()
+    hits, misses = (row["hits"], row["misses"]) if row else (0, 0)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / total, 4) if total else 0.0,
+    }
+
+def acquire_lease(name, ttl):
+    """尝试获取名为 name 的租约，有效期 ttl 秒；其他存活进程持有未过期的租约时返回 False"""
+    now = time.time()
+    pid = os.getpid()
+    with state_db(transaction=True) as db:
+        row = db.execute(
+            "SELECT owner_pid, expires_at FROM service_leases WHERE name = ?", (name,)
+        ).fetchone()
+        if (
+            row is not None
+            and row["owner_pid"] != pid
+            and row["expires_at"] > now
+            and psutil.pid_exists(row["owner_pid"])
+        ):
+            return False
+        db.execute(
+            "INSERT OR REPLACE INTO service_leases (name, owner_pid, expires_at) "
+            "VALUES (?, ?, ?)",
+            (name, pid, now + ttl),
+        )
+        return True
+
+
 
 def initialize():
     cfg.init()
@@ -83,6 +361,11 @@ def initialize():
 
     logger.info(f"当前系统：{platform.system()} {platform.release()}")
 
+    try:
+        init_state_db()
+    except sqlite3.Error as e:
+        logger.error(f"初始化共享状态数据库失败: {str(e)}")
+
     Const.FFMPEG_PATH, Const.FFPROBE_PATH = cfg.configure_ffmpeg(auto_install)
     if not Const.FFMPEG_PATH:
         if platform.system() == "Windows":
@@ -142,6 +425,11 @@ def initialize():
 
         pdf2image.poppler_path = poppler_path
         logger.info(f"已设置 Poppler 路径: {poppler_path}")
+    precompress_static_files()
+    start_storage_janitor()
+    # 每个 worker 启动时都运行下载执行器，其他 worker 退出后留在队列中的任务也能被领取
+    ensure_download_executors()
+
     if isCheck:
         logger.info("FFmpeg 和 Poppler 均已正确配置！")
         logger.info("请使用以下代码启动应用：\n\t\tgunicorn -w 4 -b 0.0.0.0:PORT --worker-class eventlet app:app")
@@ -192,6 +480,482 @@ def allowed_file(filename):
         and filename.rsplit(".", 1)[1].lower() in app.config["ALLOWED_EXTENSIONS"]
     )
 
+# ================ 文件发送 ================
+# direct: 由 Flask 发送（支持 Range/206 断点续传和条件请求）
+# x-accel: 返回 X-Accel-Redirect，由 nginx 从 uploads/ 直接发送文件
+# x-sendfile: 返回 X-Sendfile，由 Apache/lighttpd 发送文件
+app.config["USE_X_SENDFILE"] = Const.FILE_SERVE_MODE == "x-sendfile"
+
+def file_etag(stat):
+    """由 inode、大小和纳秒级修改时间生成强 ETag，多个 worker 生成的结果一致"""
+    raw = f"{stat.st_ino}-{stat.st_size}-{stat.st_mtime_ns}"
+    return hashlib.sha1(raw.encode("ascii")).hexdigest()
+
+def attachment_disposition(filename):
+    try:
+        filename.encode("ascii")
+        return f'attachment; filename="{filename}"'
+    except UnicodeEncodeError:
+        return f"attachment; filename*=UTF-8''{quote(filename)}"
+
+def send_upload_file(directory, filename):
+    """发送 uploads/ 下的文件，按 FILE_SERVE_MODE 选择由 Flask 还是前端服务器发送"""
+    path = safe_join(os.path.abspath(directory), filename)
+    if path is None:
+        abort(404)
+    # 先记录访问再检查文件，刷新后的产物在保护期内不会被清理任务删除
+    touch_artifact(path)
+    if not os.path.isfile(path):
+        abort(404)
+
+    if Const.FILE_SERVE_MODE == "x-accel":
+        relative_path = os.path.relpath(path, os.path.abspath(app.config["UPLOAD_FOLDER"]))
+        response = Response(
+            mimetype=mimetypes.guess_type(path)[0] or "application/octet-stream"
+        )
+        response.headers["X-Accel-Redirect"] = Const.X_ACCEL_PREFIX + quote(
+            relative_path.replace(os.sep, "/")
+        )
+        response.headers["Content-Disposition"] = attachment_disposition(
+            os.path.basename(path)
+        )
+        return response
+
+    stat = os.stat(path)
+    response = send_file(
+        path, as_attachment=True, conditional=True, etag=file_etag(stat)
+    )
+    response.headers["Accept-Ranges"] = "bytes"
+    return response
+
+# ================ 响应压缩 ================
+# 动态的 JSON/HTML 响应按客户端的 Accept-Encoding 用 br 或 gzip 压缩；
+# static/ 下的文本文件在启动时预先压缩成同目录的 .br/.gz，请求时直接发送压缩文件
+COMPRESSED_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+def negotiate_encoding():
+    """根据 Accept-Encoding 选择 br 或 gzip，都不接受时返回 None"""
+    accept = request.accept_encodings
+    for encoding in ("br", "gzip"):
+        if accept[encoding] > 0:
+            return encoding
+    return None
+
+def compress_bytes(data, encoding, static=False):
+    # 预压缩的静态文件只压缩一次，使用最高压缩等级
+    if encoding == "br":
+        quality = 11 if static else Const.COMPRESS_BROTLI_QUALITY
+        return brotli.compress(data, quality=quality)
+    level = 9 if static else Const.COMPRESS_GZIP_LEVEL
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+def add_vary_accept_encoding(response):
+    if "accept-encoding" not in {value.lower() for value in response.vary}:
+        response.vary.add("Accept-Encoding")
+
+@app.after_request
+def compress_response(response):
+    # 文件和流式响应（下载、边下边传、NDJSON）不在这里压缩
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or response.status_code < 200
+        or response.status_code in (204, 206, 304)
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in Const.COMPRESS_MIMETYPES
+    ):
+        return response
+
+    add_vary_accept_encoding(response)
+    data = response.get_data()
+    if len(data) < Const.COMPRESS_MIN_SIZE:
+        return response
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+
+    response.set_data(compress_bytes(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    # 压缩后的内容与原内容不同，强 ETag 需要区分
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f"{etag}-{encoding}")
+    return response
+
+def precompress_static_files():
+    """为 static/ 下的文本文件生成 .br/.gz，已是最新的跳过，压缩后不更小的不生成"""
+    t_start = time.perf_counter()
+    written = 0
+    for dirpath, _, filenames in os.walk(app.static_folder):
+        for name in filenames:
+            if not name.endswith(Const.STATIC_PRECOMPRESS_EXTENSIONS):
+                continue
+            path = os.path.join(dirpath, name)
+            try:
+                stat = os.stat(path)
+                if stat.st_size < Const.COMPRESS_MIN_SIZE:
+                    continue
+                data = None
+                for encoding, suffix in COMPRESSED_SUFFIXES.items():
+                    target = path + suffix
+                    if os.path.exists(target) and os.path.getmtime(target) >= stat.st_mtime:
+                        continue
+                    if data is None:
+                        with open(path, "rb") as f:
+                            data = f.read()
+                    compressed = compress_bytes(data, encoding, static=True)
+                    if len(compressed) >= len(data):
+                        if os.path.exists(target):
+                            os.remove(target)
+                        continue
+                    # 多个 worker 可能同时启动，先写临时文件再替换
+                    temp_path = f"{target}.{os.getpid()}.tmp"
+                    with open(temp_path, "wb") as f:
+                        f.write(compressed)
+                    os.replace(temp_path, target)
+                    written += 1
+            except OSError as e:
+                logger.warning(f"预压缩静态文件失败 {path}: {str(e)}")
+    if written:
+        logger.info(
+            f"已预压缩 {written} 个静态文件，耗时 {time.perf_counter() - t_start:.2f}s"
+        )
+
+def serve_static(filename):
+    """替代 Flask 默认的静态文件视图，客户端支持时发送预压缩的文件"""
+    encoding = negotiate_encoding()
+    if encoding:
+        path = safe_join(app.static_folder, filename + COMPRESSED_SUFFIXES[encoding])
+        # 原文件更新后、重新预压缩前不使用旧的压缩文件
+        original = safe_join(app.static_folder, filename)
+        if (
+            path is not None
+            and os.path.isfile(path)
+            and os.path.isfile(original)
+            and os.path.getmtime(path) >= os.path.getmtime(original)
+        ):
+            response = send_file(
+                path,
+                mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+                conditional=True,
+                max_age=app.get_send_file_max_age(filename),
+            )
+            response.headers["Content-Encoding"] = encoding
+            add_vary_accept_encoding(response)
+            return response
+
+    response = app.send_static_file(filename)
+    if (mimetypes.guess_type(filename)[0] or "") in Const.COMPRESS_MIMETYPES:
+        add_vary_accept_encoding(response)
+    return response
+
+app.view_functions["static"] = serve_static
+
+# ================ 存储管理 ================
+# 下载的视频和转换结果都登记在 artifacts 表中，记录大小、生成时间和最近访问时间；
+# 后台清理任务删除超过最大保存时间的产物，并在总大小超出配额时按最近最少访问（LRU）淘汰。
+# 刚生成或刚被访问的产物在 STORAGE_ACCESS_GRACE 内受保护；正在发送的文件已被打开，
+# 删除后（POSIX）仍能发送完毕，Windows 上删除会失败而跳过
+STORAGE_ROOTS = {
+    "videos": "video",
+    "converted": "converted",
+    "thumbnails": "thumbnail",
+    "previews": "preview",
+    "convert_cache": "convert_cache",
+}  # uploads/ 下的目录 -> 产物类型
+STORAGE_SKIP_DIRS = {".jobs"}  # 运行中任务的临时目录，不参与登记和淘汰
+storage_janitor_started = False
+storage_janitor_lock = threading.Lock()
+
+def get_artifact_key(path):
+    """文件路径 -> 相对 uploads/ 的产物路径"""
+    upload_root = os.path.abspath(app.config["UPLOAD_FOLDER"])
+    return os.path.relpath(os.path.abspath(path), upload_root).replace(os.sep, "/")
+
+def register_artifact(path, kind):
+    """登记新生成的产物"""
+    try:
+        now = time.time()
+        with state_db() as db:
+            db.execute(
+                "INSERT INTO artifacts (path, kind, size, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT(path) DO UPDATE SET "
+                "size = excluded.size, last_access = excluded.last_access",
+                (get_artifact_key(path), kind, os.path.getsize(path), now, now),
+            )
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"登记产物失败 {path}: {str(e)}")
+
+def touch_artifact(path):
+    """记录一次访问，未登记的文件（如旧版本生成的）在这里补登"""
+    key = get_artifact_key(path)
+    kind = STORAGE_ROOTS.get(key.split("/", 1)[0])
+    if kind is None:
+        return
+    try:
+        with state_db() as db:
+            cursor = db.execute(
+                "UPDATE artifacts SET last_access = ? WHERE path = ?", (time.time(), key)
+            )
+        if cursor.rowcount == 0 and os.path.isfile(path):
+            register_artifact(path, kind)
+    except sqlite3.Error as e:
+        logger.warning(f"记录产物访问失败 {key}: {str(e)}")
+
+def walk_storage_files():
+    """遍历存储目录下的所有文件，返回 {产物路径: (类型, 绝对路径)}"""
+    upload_root = app.config["UPLOAD_FOLDER"]
+    files = {}
+    for root_name, kind in STORAGE_ROOTS.items():
+        root = os.path.join(upload_root, root_name)
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if d not in STORAGE_SKIP_DIRS]
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                files[get_artifact_key(path)] = (kind, path)
+    return files
+
+def reconcile_artifacts():
+    """让索引与磁盘一致：补登未登记的文件（以修改时间作为访问时间），删除已不存在的记录"""
+    files = walk_storage_files()
+    with state_db() as db:
+        indexed = {row["path"] for row in db.execute("SELECT path FROM artifacts")}
+
+    missing = [
+        key for key in indexed - files.keys()
+        if not os.path.exists(os.path.join(app.config["UPLOAD_FOLDER"], *key.split("/")))
+    ]
+    adopted = []
+    for key in files.keys() - indexed:
+        kind, path = files[key]
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        adopted.append((key, kind, stat.st_size, stat.st_mtime, stat.st_mtime))
+
+    with state_db(transaction=True) as db:
+        db.executemany("DELETE FROM artifacts WHERE path = ?", [(key,) for key in missing])
+        db.executemany(
+            "INSERT OR IGNORE INTO artifacts (path, kind, size, created_at, last_access) "
+            "VALUES (?, ?, ?, ?, ?)",
+            adopted,
+        )
+    if adopted:
+        logger.info(f"存储索引补登 {len(adopted)} 个文件")
+    return len(files)
+
+def prune_empty_dirs(path):
+    """删除文件后向上清理空目录（如转换请求的临时目录），不删除存储根目录"""
+    roots = {
+        os.path.abspath(os.path.join(app.config["UPLOAD_FOLDER"], name))
+        for name in STORAGE_ROOTS
+    }
+    directory = os.path.dirname(os.path.abspath(path))
+    while directory not in roots and os.path.dirname(directory) != directory:
+        try:
+            os.rmdir(directory)
+        except OSError:
+            break
+        directory = os.path.dirname(directory)
+
+def evict_artifact(key, protect_after):
+    """
+    删除一个产物，返回释放的字节数；文件在此期间被访问过或无法删除时返回 0
+    在写事务中重新检查访问时间，避免与复用下载结果、发送文件的请求冲突
+    """
+    path = os.path.join(app.config["UPLOAD_FOLDER"], *key.split("/"))
+    with state_db(transaction=True) as db:
+        row = db.execute(
+            "SELECT kind, size, last_access FROM artifacts WHERE path = ?", (key,)
+        ).fetchone()
+        if row is None or row["last_access"] >= protect_after:
+            return 0
+        # 进行中或仍在保留期内的转换任务的结果不淘汰
+        if row["kind"] == "converted" and db.execute(
+            "SELECT 1 FROM conversion_jobs WHERE "
+            "substr(?, 1, length(output_dir) + 1) = output_dir || '/' "
+            "AND (state = 'running' OR finished_at >= ?)",
+            (key, time.time() - Const.CONVERT_JOB_RETENTION),
+        ).fetchone():
+            return 0
+        try:
+            if os.path.getmtime(path) >= protect_after:
+                return 0
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"删除产物失败 {key}: {str(e)}")
+            return 0
+        db.execute("DELETE FROM artifacts WHERE path = ?", (key,))
+        if row["kind"] == "convert_cache":
+            # 条目缺少文件后不能再命中，其余文件随后按访问时间淘汰
+            db.execute("DELETE FROM conversion_cache WHERE key = ?", (key.split("/")[2],))
+        if row["kind"] == "video":
+            db.execute(
+                "DELETE FROM video_files WHERE filename = ?", (key.split("/", 1)[1],)
+            )
+    prune_empty_dirs(path)
+    return row["size"]
+
+def clean_stale_job_dirs(protect_after):
+    """清理已不在运行的下载任务遗留的临时目录（进程崩溃等情况）"""
+    jobs_root = os.path.join(app.config["UPLOAD_FOLDER"], "videos", ".jobs")
+    if not os.path.isdir(jobs_root):
+        return
+    for job_id in os.listdir(jobs_root):
+        job_dir = os.path.join(jobs_root, job_id)
+        try:
+            if os.path.getmtime(job_dir) >= protect_after:
+                continue
+        except OSError:
+            continue
+        job = get_download_job(job_id)
+        if job is None or job["state"] not in ("running", "cancelling"):
+            logger.info(f"清理遗留的下载任务目录: {job_id}")
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+def get_artifact_inodes(keys):
+    """返回 {产物路径: (设备号, inode)}，同一文件的多个硬链接对应同一个值；无法读取的文件以路径本身代替"""
+    inodes = {}
+    for key in keys:
+        try:
+            stat = os.stat(os.path.join(app.config["UPLOAD_FOLDER"], *key.split("/")))
+            inodes[key] = (stat.st_dev, stat.st_ino)
+        except OSError:
+            inodes[key] = key
+    return inodes
+
+def sweep_storage():
+    """执行一次存储清理，返回 (删除文件数, 释放字节数)"""
+    started = time.time()
+    file_count = reconcile_artifacts()
+    protect_after = started - Const.STORAGE_ACCESS_GRACE
+    expire_before = started - Const.STORAGE_MAX_AGE
+
+    # 转换结果与转换缓存通常是同一文件的硬链接，按文件去重统计占用；
+    # 只有同一文件的最后一个链接被淘汰时才真正释放空间
+    with state_db() as db:
+        keys = [row["path"] for row in db.execute("SELECT path FROM artifacts")]
+    inodes = get_artifact_inodes(keys)
+    disk_links = Counter(inodes.values())
+
+    evicted = 0
+    reclaimed = 0
+    # 先按各类型自己的配额淘汰，再按总配额淘汰
+    passes = [
+        ("thumbnail", Const.THUMBNAIL_CACHE_MAX_BYTES),
+        ("preview", Const.PDF_PREVIEW_CACHE_MAX_BYTES),
+        ("convert_cache", Const.CONVERT_CACHE_MAX_BYTES),
+        (None, Const.STORAGE_QUOTA_BYTES),
+    ]
+    for kind, quota in passes:
+        where = "WHERE kind = ?" if kind else ""
+        params = (kind,) if kind else ()
+        with state_db() as db:
+            members = db.execute(
+                f"SELECT path, size, last_access FROM artifacts {where}", params
+            ).fetchall()
+        links = Counter(inodes[row["path"]] for row in members)
+        total = sum({inodes[row["path"]]: row["size"] for row in members}.values())
+        candidates = sorted(
+            (row for row in members if row["last_access"] < protect_after),
+            key=lambda row: row["last_access"],
+        )
+
+        for row in candidates:
+            # 按访问时间从旧到新，既未过期又未超配额时后面的更不需要删除
+            if row["last_access"] >= expire_before and total <= quota:
+                break
+            size = evict_artifact(row["path"], protect_after)
+            if size:
+                evicted += 1
+                inode = inodes[row["path"]]
+                links[inode] -= 1
+                if links[inode] == 0:
+                    total -= size
+                disk_links[inode] -= 1
+                if disk_links[inode] == 0:
+                    reclaimed += size
+
+    clean_stale_job_dirs(protect_after)
+    clean_expired_uploads(started - Const.UPLOAD_STAGING_EXPIRE)
+    with state_db() as db:
+        db.execute("DELETE FROM thumbnails WHERE updated_at < ?", (expire_before,))
+
+    finished = time.time()
+    with state_db() as db:
+        db.execute(
+            "INSERT INTO storage_sweeps (finished_at, seconds, files, bytes) VALUES (?, ?, ?, ?)",
+            (finished, finished - started, evicted, reclaimed),
+        )
+    level = logging.WARNING if total > Const.STORAGE_QUOTA_BYTES else logging.INFO
+    logger.log(
+        level,
+        f"存储清理完成: 删除 {evicted} 个文件，释放 {reclaimed / 1024 / 1024:.1f}MB，"
+        f"剩余 {file_count - evicted} 个文件共 {total / 1024 / 1024:.1f}MB"
+        f"（配额 {Const.STORAGE_QUOTA_BYTES / 1024 / 1024:.0f}MB），耗时 {finished - started:.2f}s",
+    )
+    return evicted, reclaimed
+
+def storage_janitor():
+    while True:
+        try:
+            # 各 worker 都运行清理循环，租约保证每个周期只有一个进程执行
+            if acquire_lease("storage_janitor", Const.STORAGE_SWEEP_INTERVAL):
+                sweep_storage()
+        except Exception as e:
+            logger.error(f"存储清理出错: {str(e)}", exc_info=True)
+        socketio.sleep(Const.STORAGE_SWEEP_INTERVAL)
+
+def start_storage_janitor():
+    global storage_janitor_started
+    with storage_janitor_lock:
+        if storage_janitor_started:
+            return
+        socketio.start_background_task(storage_janitor)
+        storage_janitor_started = True
+
+@app.route("/storage_stats", methods=["GET"])
+def storage_stats():
+    try:
+        with state_db() as db:
+            by_kind = {
+                row["kind"]: {"files": row["files"], "bytes": row["bytes"]}
+                for row in db.execute(
+                    "SELECT kind, COUNT(*) AS files, SUM(size) AS bytes "
+                    "FROM artifacts GROUP BY kind"
+                )
+            }
+            last_sweep = db.execute(
+                "SELECT finished_at, seconds, files, bytes FROM storage_sweeps "
+                "ORDER BY id DESC LIMIT 1"
+            ).fetchone()
+            reclaimed = db.execute(
+                "SELECT COALESCE(SUM(files), 0), COALESCE(SUM(bytes), 0) FROM storage_sweeps"
+            ).fetchone()
+            rows = db.execute("SELECT path, size FROM artifacts").fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"读取存储统计失败: {str(e)}")
+        return jsonify({"success": False, "error": "读取存储统计失败"}), 500
+    # 各类型分别统计，总量中硬链接的同一文件只计一次
+    inodes = get_artifact_inodes(row["path"] for row in rows)
+    total_bytes = sum({inodes[row["path"]]: row["size"] for row in rows}.values())
+
+    return jsonify(
+        {
+            "success": True,
+            "total_bytes": total_bytes,
+            "quota_bytes": Const.STORAGE_QUOTA_BYTES,
+            "max_age": Const.STORAGE_MAX_AGE,
+            "by_kind": by_kind,
+            "last_sweep": dict(last_sweep) if last_sweep else None,
+            "reclaimed_files": reclaimed[0],
+            "reclaimed_bytes": reclaimed[1],
+        }
+    )
+
 ### 视频解析
 @app.route("/video_parse", methods=["GET"])
 def video_parse():
@@ -205,110 +969,382 @@ def video_parse():
         developer=Const.AUTHOR,
     )
 
+# 整理格式列表：按分辨率分组的视频格式 + 纯音频格式
+def group_video_formats(info):
+    available_formats = {}
+    audio_formats = []
+
+    for fmt in info.get("formats") or []:
+        if fmt.get("format_id"):
+            resolution = fmt.get("height") or 0
+            ext = fmt.get("ext") or "unknown"
+            filesize = fmt.get("filesize") or 0
+            vcodec = fmt.get("vcodec") or "none"
+            acodec = fmt.get("acodec") or "none"
+            format_note = fmt.get("format_note", "")
+
+            # 创建格式描述
+            format_desc = f"{ext.upper()}"
+            if resolution:
+                format_desc += f" {resolution}p"
+            if format_note:
+                format_desc += f" - {format_note}"
+            if filesize:
+                format_desc += f" ({filesize//1024//1024}MB)"
+
+            # 区分视频格式和音频格式
+            if vcodec != "none" and acodec != "none" and acodec != "none?":
+                # 视频+音频格式
+                format_desc += " (含音频)"
+            elif vcodec != "none" and vcodec != "none?":
+                # 纯视频格式
+                format_desc += " (仅视频)"
+            elif acodec != "none" and acodec != "none?":
+                # 纯音频格式
+                format_desc += " (仅音频)"
+                audio_formats.append(
+                    {"id": fmt["format_id"], "description": format_desc, "ext": ext}
+                )
+                continue
+            else:
+                # 未知格式
+                format_desc += " (未知)"
+
+            # 按分辨率分组
+            if resolution not in available_formats:
+                available_formats[resolution] = []
+            available_formats[resolution].append(
+                {
+                    "id": fmt["format_id"],
+                    "description": format_desc,
+                    "ext": ext,
+                    "has_audio": acodec != "none" and acodec != "none?",
+                }
+            )
+
+    return available_formats, audio_formats
+
+# 提取视频信息（单次提取同时得到格式列表和元数据）
+def extract_video_info(video_url):
+    t_start = time.perf_counter()
+    with yt_dlp.YoutubeDL(
+        {
+            "quiet": True,
+            "no_warnings": True,
+            "simulate": True,
+        }
+    ) as ydl:
+        info = ydl.extract_info(video_url, download=False)
+    t_extract = time.perf_counter()
+
+    available_formats, audio_formats = group_video_formats(info)
+
+    # 简化返回信息
+    video_info = {
+        "id": info.get("id"),
+        "title": info.get("title"),
+        "thumbnail": info.get("thumbnail"),
+        "thumbnail_source": info.get("thumbnail"),
+        "duration": info.get("duration"),
+        "uploader": info.get("uploader"),
+        "upload_date": info.get("upload_date"),
+        "view_count": info.get("view_count"),
+        "extractor": info.get("extractor"),
+        "webpage_url": info.get("webpage_url"),
+        "formats": available_formats,
+        "audio_formats": audio_formats,
+    }
+    # 缩略图改为经由本站代理，原始地址保留在 thumbnail_source
+    if remember_thumbnail(info):
+        video_info["thumbnail"] = get_thumbnail_url(info["extractor"], info["id"])
+    t_end = time.perf_counter()
+
+    logger.info(
+        f"视频解析耗时: 提取 {t_extract - t_start:.3f}s, "
+        f"格式整理 {t_end - t_extract:.3f}s, 总计 {t_end - t_start:.3f}s "
+        f"({len(info.get('formats') or [])} 个格式) - {video_url}"
+    )
+    return video_info
+
+# ---------------- 缩略图代理 ----------------
+# 每个缩略图只从源站拉取一次，缩放成若干宽度的 WebP 存到 uploads/thumbnails，
+# 按 (提取器, 视频 ID) 命名；缓存容量由存储清理任务按 THUMBNAIL_CACHE_MAX_BYTES 控制
+thumbnail_locks = {}
+thumbnail_locks_guard = threading.Lock()
+
+def get_thumbnail_key(extractor, video_id):
+    return f"{extractor}/{video_id}"
+
+def get_thumbnail_url(extractor, video_id, width=None):
+    # 批量解析在线程池中执行，没有请求上下文，不能使用 url_for
+    url = f"/thumbnail/{quote(str(extractor), safe='')}/{quote(str(video_id), safe='')}"
+    return f"{url}?w={width}" if width else url
+
+def get_thumbnail_path(key, width):
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+    return os.path.join(
+        app.config["UPLOAD_FOLDER"], "thumbnails", digest[:2], f"{digest}_{width}.webp"
+    )
+
+def remember_thumbnail(info):
+    """记录缩略图的原始地址，成功时返回 True"""
+    if not (info.get("thumbnail") and info.get("extractor") and info.get("id")):
+        return False
+    try:
+        with state_db() as db:
+            db.execute(
+                "INSERT INTO thumbnails (key, source_url, referer, updated_at) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET "
+                "source_url = excluded.source_url, referer = excluded.referer, "
+                "updated_at = excluded.updated_at, failed_at = NULL",
+                (
+                    get_thumbnail_key(info["extractor"], info["id"]),
+                    info["thumbnail"],
+                    info.get("webpage_url"),
+                    time.time(),
+                ),
+            )
+        return True
+    except sqlite3.Error as e:
+        logger.warning(f"记录缩略图地址失败: {str(e)}")
+        return False
+
+def pick_thumbnail_width(requested):
+    widths = sorted(Const.THUMBNAIL_WIDTHS)
+    for width in widths:
+        if requested <= width:
+            return width
+    return widths[-1]
+
+def fetch_thumbnail(key, source_url, referer):
+    """拉取原始缩略图并生成所有宽度的 WebP"""
+    # 与解析时 yt-dlp 使用相同的 User-Agent
+    headers = {"User-Agent": yt_dlp.utils.networking.std_headers["User-Agent"]}
+    if referer:
+        headers["Referer"] = referer
+    t_start = time.perf_counter()
+    with requests.get(
+        source_url, headers=headers, timeout=Const.THUMBNAIL_FETCH_TIMEOUT, stream=True
+    ) as response:
+        response.raise_for_status()
+        data = bytearray()
+        for chunk in response.iter_content(64 * 1024):
+            data.extend(chunk)
+            if len(data) > Const.THUMBNAIL_FETCH_MAX_BYTES:
+                raise ValueError("缩略图过大")
+    t_fetch = time.perf_counter()
+
+    # JPEG 在解码时直接按比例缩小到不小于最大宽度，省去全尺寸解码
+    image, _ = open_image_for_box(io.BytesIO(data), (max(Const.THUMBNAIL_WIDTHS), None))
+    image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+    for width in sorted(Const.THUMBNAIL_WIDTHS, reverse=True):
+        if image.width > width:
+            image = image.resize(
+                (width, max(1, round(image.height * width / image.width))),
+                Image.LANCZOS,
+            )
+        path = get_thumbnail_path(key, width)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        image.save(temp_path, "WEBP", quality=Const.THUMBNAIL_WEBP_QUALITY)
+        os.replace(temp_path, path)
+        register_artifact(path, "thumbnail")
+
+    logger.info(
+        f"缩略图已缓存: {key} ({len(data) / 1024:.0f}KB, "
+        f"拉取 {t_fetch - t_start:.2f}s, 处理 {time.perf_counter() - t_fetch:.2f}s)"
+    )
+
+def load_thumbnail(key):
+    """按记录的原始地址拉取缩略图，失败时中止请求"""
+    with state_db() as db:
+        row = db.execute(
+            "SELECT source_url, referer, failed_at FROM thumbnails WHERE key = ?", (key,)
+        ).fetchone()
+    if row is None:
+        abort(404)
+    # 源站失败后短时间内不再重试，避免每次页面加载都去请求
+    if row["failed_at"] and time.time() - row["failed_at"] < Const.THUMBNAIL_RETRY_AFTER:
+        abort(502)
+    try:
+        fetch_thumbnail(key, row["source_url"], row["referer"])
+    except Exception as e:
+        logger.warning(f"拉取缩略图失败 {key}: {str(e)}")
+        with state_db() as db:
+            db.execute(
+                "UPDATE thumbnails SET failed_at = ? WHERE key = ?", (time.time(), key)
+            )
+        abort(502)
+
+@app.route("/thumbnail/<extractor>/<path:video_id>")
+def video_thumbnail(extractor, video_id):
+    key = get_thumbnail_key(extractor, video_id)
+    width = pick_thumbnail_width(request.args.get("w", max(Const.THUMBNAIL_WIDTHS), type=int))
+    path = get_thumbnail_path(key, width)
+
+    touch_artifact(path)
+    if not os.path.isfile(path):
+        # 同一缩略图的并发请求只拉取一次
+        with thumbnail_locks_guard:
+            lock = thumbnail_locks.setdefault(key, threading.Lock())
+        try:
+            with lock:
+                if not os.path.isfile(path):
+                    load_thumbnail(key)
+        finally:
+            with thumbnail_locks_guard:
+                thumbnail_locks.pop(key, None)
+
+    stat = os.stat(path)
+    response = send_file(
+        os.path.abspath(path),
+        mimetype="image/webp",
+        conditional=True,
+        etag=file_etag(stat),
+        max_age=Const.THUMBNAIL_BROWSER_MAX_AGE,
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+# ---------------- 视频解析缓存 ----------------
+# 分享链接里常见的跟踪参数，不影响视频内容，归一化时去掉
+TRACKING_QUERY_PARAMS = {
+    "spm_id_from",
+    "vd_source",
+    "from_spmid",
+    "share_source",
+    "share_medium",
+    "share_plat",
+    "share_session_id",
+    "share_tag",
+    "share_from",
+    "unique_k",
+    "bbid",
+    "ts",
+    "si",
+    "feature",
+    "pp",
+    "fbclid",
+    "gclid",
+}
+
+# 同一站点的不同域名写法
+VIDEO_HOST_ALIASES = {
+    "youtube.com": "www.youtube.com",
+    "m.youtube.com": "www.youtube.com",
+    "bilibili.com": "www.bilibili.com",
+    "m.bilibili.com": "www.bilibili.com",
+}
+
+def normalize_video_url(video_url):
+    """归一化视频链接，作为解析缓存的键"""
+    parts = urlsplit(video_url.strip())
+    scheme = (parts.scheme or "https").lower()
+    if scheme == "http":
+        scheme = "https"
+    host = (parts.hostname or "").lower()
+    path = parts.path
+    query = parse_qsl(parts.query, keep_blank_values=True)
+
+    # youtu.be/<id> 短链接展开为标准地址
+    if host == "youtu.be" and path.strip("/"):
+        query.append(("v", path.strip("/")))
+        host, path = "www.youtube.com", "/watch"
+    host = VIDEO_HOST_ALIASES.get(host, host)
+    if parts.port:
+        host = f"{host}:{parts.port}"
+
+    query = sorted(
+        (k, v)
+        for k, v in query
+        if k.lower() not in TRACKING_QUERY_PARAMS and not k.lower().startswith("utm_")
+    )
+    path = path.rstrip("/") or "/"
+    return urlunsplit((scheme, host, path, urlencode(query), ""))
+
+def parse_cache_get(key):
+    now = time.time()
+    with state_db() as db:
+        row = db.execute(
+            "SELECT payload FROM parse_cache WHERE key = ? AND created_at > ?",
+            (key, now - Const.PARSE_CACHE_TTL),
+        ).fetchone()
+        if row is None:
+            return None
+        db.execute("UPDATE parse_cache SET last_access = ? WHERE key = ?", (now, key))
+    return json.loads(row["payload"])
+
+def parse_cache_put(key, video_info):
+    payload = json.dumps(video_info, ensure_ascii=False)
+    now = time.time()
+    with state_db(transaction=True) as db:
+        db.execute(
+            "INSERT OR REPLACE INTO parse_cache (key, payload, size, created_at, last_access) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (key, payload, len(payload.encode("utf-8")), now, now),
+        )
+        # 清理过期条目，并按最近访问时间淘汰超出容量的条目
+        db.execute(
+            "DELETE FROM parse_cache WHERE created_at <= ?", (now - Const.PARSE_CACHE_TTL,)
+        )
+        db.execute(
+            """
+            DELETE FROM parse_cache WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(size) OVER (ORDER BY last_access DESC, key) AS total
+                    FROM parse_cache
+                ) WHERE total > ?
+            )
+            """,
+            (Const.PARSE_CACHE_MAX_BYTES,),
+        )
+
+def get_video_info(video_url, use_cache=True):
+    """
+    获取视频信息，优先读取解析缓存
+    返回 (video_info, 是否命中缓存)；use_cache=False 时跳过读取但仍会刷新缓存
+    """
+    key = normalize_video_url(video_url)
+    if use_cache:
+        try:
+            video_info = parse_cache_get(key)
+        except sqlite3.Error as e:
+            logger.warning(f"读取解析缓存失败: {str(e)}")
+            video_info = None
+        record_cache_stat("parse", video_info is not None)
+        if video_info is not None:
+            logger.info(f"解析缓存命中: {key}")
+            return video_info, True
+
+    video_info = extract_video_info(video_url)
+    try:
+        parse_cache_put(key, video_info)
+    except sqlite3.Error as e:
+        logger.warning(f"写入解析缓存失败: {str(e)}")
+    return video_info, False
+
 # 视频解析API
 @app.route("/parse_video", methods=["POST"])
 def parse_video():
     data = request.get_json()
     video_url = data.get("url")
+    # no_cache=true 时强制重新解析
+    use_cache = not data.get("no_cache", False)
 
     if not video_url:
         return jsonify({"success": False, "error": "请输入视频链接"}), 400
 
     try:
-        # 第一步：获取所有可用格式
-        format_ydl = yt_dlp.YoutubeDL(
-            {
-                "quiet": True,
-                "no_warnings": True,
-                "simulate": True,
-                "listformats": True,
-            }
-        )
-
-        format_info = format_ydl.extract_info(video_url, download=False)
-
-        # 提取可用格式
-        available_formats = {}
-        audio_formats = []
-
-        for fmt in format_info.get("formats", []):
-            if fmt.get("format_id"):
-                resolution = fmt.get("height", 0)
-                ext = fmt.get("ext", "unknown")
-                filesize = fmt.get("filesize", 0)
-                vcodec = fmt.get("vcodec", "none")
-                acodec = fmt.get("acodec", "none")
-                format_note = fmt.get("format_note", "")
-
-                # 创建格式描述
-                format_desc = f"{ext.upper()}"
-                if resolution:
-                    format_desc += f" {resolution}p"
-                if format_note:
-                    format_desc += f" - {format_note}"
-                if filesize:
-                    format_desc += f" ({filesize//1024//1024}MB)"
-
-                # 区分视频格式和音频格式
-                if vcodec != "none" and acodec != "none" and acodec != "none?":
-                    # 视频+音频格式
-                    format_desc += " (含音频)"
-                elif vcodec != "none" and vcodec != "none?":
-                    # 纯视频格式
-                    format_desc += " (仅视频)"
-                elif acodec != "none" and acodec != "none?":
-                    # 纯音频格式
-                    format_desc += " (仅音频)"
-                    audio_formats.append(
-                        {"id": fmt["format_id"], "description": format_desc, "ext": ext}
-                    )
-                    continue
-                else:
-                    # 未知格式
-                    format_desc += " (未知)"
-
-                # 按分辨率分组
-                if resolution not in available_formats:
-                    available_formats[resolution] = []
-                available_formats[resolution].append(
-                    {
-                        "id": fmt["format_id"],
-                        "description": format_desc,
-                        "ext": ext,
-                        "has_audio": acodec != "none" and acodec != "none?",
-                    }
-                )
-
-        # 第二步：获取视频元数据
-        meta_ydl = yt_dlp.YoutubeDL(
-            {
-                "quiet": True,
-                "no_warnings": True,
-                "simulate": True,
-                "forcejson": True,
-            }
-        )
-
-        meta_info = meta_ydl.extract_info(video_url, download=False)
-
-        # 简化返回信息
-        video_info = {
-            "id": meta_info.get("id"),
-            "title": meta_info.get("title"),
-            "thumbnail": meta_info.get("thumbnail"),
-            "duration": meta_info.get("duration"),
-            "uploader": meta_info.get("uploader"),
-            "upload_date": meta_info.get("upload_date"),
-            "view_count": meta_info.get("view_count"),
-            "extractor": meta_info.get("extractor"),
-            "webpage_url": meta_info.get("webpage_url"),
-            "formats": available_formats,
-            "audio_formats": audio_formats,
-        }
-
-        return jsonify({"success": True, "video_info": video_info})
+        video_info, cached = get_video_info(video_url, use_cache)
+        return jsonify({"success": True, "video_info": video_info, "cached": cached})
+    except Exception as e:
+        error_msg, status = describe_parse_error(e)
+        return jsonify({"success": False, "error": error_msg}), status
 
-    except yt_dlp.utils.DownloadError as e:
+def describe_parse_error(e):
+    """将解析异常转换为 (友好的错误信息, HTTP 状态码)"""
+    if isinstance(e, yt_dlp.utils.DownloadError):
         error_msg = str(e)
         # 提取更友好的错误信息
         if "Requested format is not available" in error_msg:
@@ -317,588 +1353,2628 @@ def parse_video():
             error_msg = "不支持的URL，请检查链接是否正确"
         elif "Video unavailable" in error_msg:
             error_msg = "视频不可用或已被删除"
-        return jsonify({"success": False, "error": f"解析失败: {error_msg}"}), 400
-    except yt_dlp.utils.ExtractorError as e:
-        return jsonify({"success": False, "error": f"提取失败: {str(e)}"}), 400
-    except Exception as e:
-        app.logger.error(f"视频解析错误: {str(e)}")
-        return jsonify({"success": False, "error": f"服务器错误: {str(e)}"}), 500
-
-@app.route("/download_video", methods=["POST"])
-def download_video():
-    data = request.get_json()
-    video_url = data.get("url")
-    format_id = data.get("format_id")
-    merge_audio = data.get("merge_audio", True)
+        return f"解析失败: {error_msg}", 400
+    if isinstance(e, yt_dlp.utils.ExtractorError):
+        return f"提取失败: {str(e)}", 400
+    app.logger.error(f"视频解析错误: {str(e)}")
+    return f"服务器错误: {str(e)}", 500
+
+# ---------------- 批量解析 ----------------
+def extract_playlist_entries(playlist_url):
+    """平铺解析播放列表，只取条目列表，不解析每个视频的详细信息"""
+    with yt_dlp.YoutubeDL(
+        {
+            "quiet": True,
+            "no_warnings": True,
+            "simulate": True,
+            "extract_flat": "in_playlist",
+        }
+    ) as ydl:
+        info = ydl.extract_info(playlist_url, download=False)
 
-    if not video_url or not format_id:
-        return jsonify({"success": False, "error": "参数错误"}), 400
+    # 不是播放列表时当作单个视频
+    raw_entries = info.get("entries")
+    if raw_entries is None:
+        raw_entries = [{**info, "url": info.get("webpage_url") or playlist_url}]
 
-    # 检查 FFmpeg 是否可用
-    if not Const.FFMPEG_PATH:
-        return (
-            jsonify({"success": False, "error": "服务器未配置 FFmpeg，无法处理视频"}),
-            500,
+    entries = []
+    for entry in raw_entries:
+        if not entry:
+            continue
+        entries.append(
+            {
+                "index": len(entries),
+                "id": entry.get("id"),
+                "title": entry.get("title"),
+                "duration": entry.get("duration"),
+                "url": entry.get("url") or entry.get("webpage_url"),
+            }
         )
+    return info.get("title"), entries
 
+def parse_batch_item(index, video_url, use_cache):
     try:
-        # 创建临时目录
-        temp_dir = os.path.join(app.config["UPLOAD_FOLDER"], "videos")
-        os.makedirs(temp_dir, exist_ok=True)
-
-        # 添加进度钩子
-        def download_progress_hook(d):
-            if d["status"] == "downloading":
-                # 清理特殊空格字符并确保UTF-8编码
-                def clean_string(s):
-                    # 移除ANSI转义序列（颜色代码）
-                    s = re.sub(r"\x1b\[[0-9;]*m", "", s)
-                    # 替换特殊空格为普通空格
-                    s = s.replace("\xa0", " ")
-                    # 移除其他非打印字符
-                    return s.encode("utf-8", "ignore").decode("utf-8").strip()
+        video_info, cached = get_video_info(video_url, use_cache)
+        return {
+            "type": "video",
+            "index": index,
+            "url": video_url,
+            "success": True,
+            "video_info": video_info,
+            "cached": cached,
+        }
+    except Exception as e:
+        error_msg, _ = describe_parse_error(e)
+        return {
+            "type": "video",
+            "index": index,
+            "url": video_url,
+            "success": False,
+            "error": error_msg,
+        }
 
-                percent = clean_string(d.get("_percent_str", "0%"))
-                speed = clean_string(d.get("_speed_str", "N/A"))
-                eta = clean_string(d.get("_eta_str", "N/A"))
+def ndjson_line(obj):
+    return json.dumps(obj, ensure_ascii=False) + "\n"
 
-                # 发送进度数据
-                socketio.emit(
-                    "download_progress",
-                    {"percent": percent, "speed": speed, "eta": eta},
-                )
+# 批量解析API：多个链接或一个播放列表，结果以 NDJSON 逐行返回
+@app.route("/parse_videos", methods=["POST"])
+def parse_videos():
+    data = request.get_json(silent=True) or {}
+    urls = [u.strip() for u in data.get("urls") or [] if isinstance(u, str) and u.strip()]
+    playlist_url = data.get("playlist_url")
+    use_cache = not data.get("no_cache", False)
+    # 播放列表是否继续解析每个条目的详细信息
+    with_details = data.get("details", True)
 
-        # 配置下载选项
-        ydl_opts = {
-            "format": format_id,
-            "outtmpl": os.path.join(temp_dir, "%(title)s.%(ext)s"),
-            "merge_output_format": "mp4",
-            "ffmpeg_location": Const.FFMPEG_PATH,
-            "postprocessor_args": ["-y"],  # 覆盖输出文件
-            "verbose": True,
-            "progress_hooks": [download_progress_hook],
-        }
+    if not urls and not playlist_url:
+        return jsonify({"success": False, "error": "请输入视频链接"}), 400
+    if urls and playlist_url:
+        return (
+            jsonify({"success": False, "error": "视频链接和播放列表不能同时提交"}),
+            400,
+        )
+    if len(urls) > Const.BATCH_PARSE_MAX_ITEMS:
+        return (
+            jsonify(
+                {
+                    "success": False,
+                    "error": f"一次最多解析 {Const.BATCH_PARSE_MAX_ITEMS} 个链接",
+                }
+            ),
+            400,
+        )
 
-        # 添加后处理器
-        if merge_audio:
-            ydl_opts["postprocessors"] = [
-                {"key": "FFmpegVideoConvertor", "preferedformat": "mp4"}
+    def generate():
+        start = time.perf_counter()
+        items = list(enumerate(urls))
+        # 播放列表超出上限时只解析前 BATCH_PARSE_MAX_ITEMS 个条目，并单独返回一行告知客户端
+        truncated_total = None
+
+        if playlist_url:
+            try:
+                title, entries = extract_playlist_entries(playlist_url)
+            except Exception as e:
+                error_msg, _ = describe_parse_error(e)
+                yield ndjson_line({"type": "playlist", "success": False, "error": error_msg})
+                return
+            yield ndjson_line(
+                {"type": "playlist", "success": True, "title": title, "entries": entries}
+            )
+            if not with_details:
+                return
+            if len(entries) > Const.BATCH_PARSE_MAX_ITEMS:
+                truncated_total = len(entries)
+            items = [
+                (entry["index"], entry["url"])
+                for entry in entries[: Const.BATCH_PARSE_MAX_ITEMS]
+                if entry["url"]
             ]
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(video_url, download=True)
-            filename = ydl.prepare_filename(info)
+        # 并发解析，谁先完成先返回谁
+        pool = ThreadPoolExecutor(max_workers=Const.BATCH_PARSE_CONCURRENCY)
+        try:
+            futures = [
+                pool.submit(parse_batch_item, index, url, use_cache) for index, url in items
+            ]
+            succeeded = 0
+            for future in as_completed(futures):
+                result = future.result()
+                succeeded += result["success"]
+                yield ndjson_line(result)
+        finally:
+            # 客户端中途断开时不再等待剩余任务
+            pool.shutdown(wait=False, cancel_futures=True)
 
-            # 获取下载URL
-            download_url = url_for(
-                "download_video_file",
-                filename=os.path.basename(filename),
-                _external=True,
+        # done 是最后一行，截断记录放在它之前
+        if truncated_total is not None:
+            logger.info(
+                f"播放列表共 {truncated_total} 个条目，只解析了前 {Const.BATCH_PARSE_MAX_ITEMS} 个"
             )
-
-            return jsonify(
+            yield ndjson_line(
                 {
-                    "success": True,
-                    "filename": os.path.basename(filename),
-                    "download_url": download_url,
+                    "type": "truncated",
+                    "truncated": True,
+                    "total": truncated_total,
+                    "limit": Const.BATCH_PARSE_MAX_ITEMS,
                 }
             )
 
-    except yt_dlp.utils.DownloadError as e:
-        logger.error(f"视频下载失败: {str(e)}")
-        return jsonify({"success": False, "error": f"下载失败: {str(e)}"}), 400
-    except Exception as e:
-        logger.error(f"视频下载错误: {str(e)}")
-        return jsonify({"success": False, "error": f"服务器错误: {str(e)}"}), 500
-
-@app.route("/download_video/<filename>")
-def download_video_file(filename):
-    video_dir = os.path.join(app.config["UPLOAD_FOLDER"], "videos")
-    return send_from_directory(video_dir, filename, as_attachment=True)
+        elapsed = time.perf_counter() - start
+        logger.info(
+            f"批量解析完成: {succeeded}/{len(items)} 成功，耗时 {elapsed:.2f}s，"
+            f"并发 {Const.BATCH_PARSE_CONCURRENCY}"
+        )
+        yield ndjson_line(
+            {
+                "type": "done",
+                "total": len(items),
+                "succeeded": succeeded,
+                "elapsed": round(elapsed, 3),
+            }
+        )
 
-### 文件格式转换器
-# ================ 文件格式转换器实现 ================
+    response = Response(generate(), mimetype="application/x-ndjson")
+    response.headers["Cache-Control"] = "no-store"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
 
-# 配置转换目录
-CONVERT_DIR = os.path.join("uploads", "converted")
-os.makedirs(CONVERT_DIR, exist_ok=True)
+# 解析缓存统计
+@app.route("/parse_cache/stats", methods=["GET"])
+def parse_cache_stats():
+    try:
+        stats = get_cache_stats("parse")
+        with state_db() as db:
+            row = db.execute(
+                "SELECT COUNT(*) AS entries, COALESCE(SUM(size), 0) AS bytes FROM parse_cache"
+            ).fetchone()
+        stats.update({"entries": row["entries"], "bytes": row["bytes"]})
+        return jsonify({"success": True, **stats})
+    except sqlite3.Error as e:
+        return jsonify({"success": False, "error": f"读取缓存统计失败: {str(e)}"}), 500
+
+# ---------------- 视频下载任务队列 ----------------
+# 下载在后台执行器中运行，HTTP 请求只负责提交任务和查询状态。
+# 任务记录保存在共享状态数据库中，任意 worker 都能查询，
+# 全局并发上限也按数据库中 running 状态的任务数计算。
+
+# 本 worker 中的执行器是否已启动
+download_executors_started = False
+download_executors_lock = threading.Lock()
+# 有新任务提交或任务结束时唤醒本 worker 的执行器。
+# 执行器运行在 socketio 后台任务中，事件也要与之匹配：eventlet 下未打补丁时
+# threading.Event.wait 会阻塞整个进程，其他协程（转换任务、请求）都无法运行
+download_queue_event = socketio.server.eio.create_event()
+# 本 worker 中正在运行的任务 -> 取消事件
+running_download_cancels = {}
+
+def clean_progress_string(s):
+    """清理 yt-dlp 进度字符串中的特殊空格字符并确保UTF-8编码"""
+    # 移除ANSI转义序列（颜色代码）
+    s = re.sub(r"\x1b\[[0-9;]*m", "", s)
+    # 替换特殊空格为普通空格
+    s = s.replace("\xa0", " ")
+    # 移除其他非打印字符
+    return s.encode("utf-8", "ignore").decode("utf-8").strip()
+
+class ProgressThrottle:
+    """按最大频率放行进度更新，超出频率的更新被合并丢弃"""
+
+    def __init__(self, max_hz):
+        self.interval = 1.0 / max_hz if max_hz > 0 else 0.0
+        self.last = float("-inf")
+        self.lock = threading.Lock()
+
+    def allow(self):
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last < self.interval:
+                return False
+            self.last = now
+            return True
+
+class BandwidthScheduler:
+    """
+    所有 worker 共享的下载带宽预算
+    每个活动任务一个令牌桶，速率为 预算 / 所有 worker 的活动任务数，任务增减时自动重新分配；
+    registry 记录各 worker 的活动任务（add/remove/count），为 None 时只统计本进程的任务
+    """
 
-# 图像模式处理函数
-def handle_special_image_modes(img):
-    """
-    处理所有特殊图像模式，返回处理后的RGB图像
-    支持的模式: RGBA, LA, PA, P, CMYK, 1 (二值), L (灰度)
-    """
-    # 模式映射表
-    mode_handlers = {
-        # 带透明度的模式
-        "RGBA": lambda i: i.convert("RGB"),
-        "LA": lambda i: _convert_la(i),
-        "PA": lambda i: _convert_pa(i),
-        "RGBa": lambda i: i.convert("RGB"),
-        # 不带透明度的特殊模式
-        "P": lambda i: i.convert("RGB"),
-        "CMYK": lambda i: i.convert("RGB"),
-        "1": lambda i: i.convert("L").convert("RGB"),  # 二值图先转灰度再转RGB
-        "L": lambda i: i.convert("RGB"),  # 灰度转RGB
-        "I": lambda i: i.convert("RGB"),  # 32位整数灰度
-        "F": lambda i: i.convert("RGB"),  # 32位浮点灰度
-        # 其他未知模式
-        "default": lambda i: i.convert("RGB"),
-    }
+    # 统计吞吐量的滑动窗口（秒）
+    WINDOW = 5.0
+    # 重新读取全局活动任务数的间隔（秒）
+    REFRESH_INTERVAL = 1.0
+
+    def __init__(self, limit, registry=None):
+        self.limit = limit
+        self.registry = registry
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.shared_count = 0
+        self.counted_at = None
+
+    def register(self, job_id):
+        if self.registry is not None:
+            self.registry.add(job_id)
+        now = time.monotonic()
+        with self.lock:
+            # 下次分配时重新读取全局任务数
+            self.counted_at = None
+            self.jobs[job_id] = {
+                "tokens": 0.0,
+                "updated": now,
+                "started": now,
+                "bytes": 0,
+                "samples": deque(),
+                "seen": {},
+            }
 
-    handler = mode_handlers.get(img.mode, mode_handlers["default"])
-    return handler(img)
+    def unregister(self, job_id):
+        with self.lock:
+            self.jobs.pop(job_id, None)
+            self.counted_at = None
+        if self.registry is not None:
+            self.registry.remove(job_id)
+
+    def active_count(self, now):
+        """参与分配的任务数：全局计数按间隔刷新，读取失败时沿用上次的结果，不少于本进程的任务数"""
+        if self.registry is not None and (
+            self.counted_at is None or now - self.counted_at >= self.REFRESH_INTERVAL
+        ):
+            try:
+                self.shared_count = self.registry.count()
+            except Exception as e:
+                logger.warning(f"读取全局下载任务数失败: {str(e)}")
+            self.counted_at = now
+        return max(len(self.jobs), self.shared_count)
+
+    def consume(self, job_id, key, downloaded_bytes):
+        """
+        记录任务的下载进度，返回为遵守带宽预算需要等待的秒数
+        key 区分同一任务中的不同文件（音视频分开下载时已下载字节数会重新计数）
+        """
+        now = time.monotonic()
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return 0.0
+            delta = max(0, downloaded_bytes - job["seen"].get(key, 0))
+            job["seen"][key] = max(downloaded_bytes, job["seen"].get(key, 0))
+            job["bytes"] += delta
+            job["samples"].append((now, delta))
+            self._trim(job, now)
+
+            if not self.limit:
+                return 0.0
+            rate = self.limit / self.active_count(now)
+            # 桶容量为 1 秒的份额，空闲时积累的令牌不会无限增长
+            job["tokens"] = min(rate, job["tokens"] + (now - job["updated"]) * rate)
+            job["updated"] = now
+            job["tokens"] -= delta
+            return -job["tokens"] / rate if job["tokens"] < 0 else 0.0
+
+    def _trim(self, job, now):
+        samples = job["samples"]
+        while samples and samples[0][0] < now - self.WINDOW:
+            samples.popleft()
+
+    def stats(self):
+        now = time.monotonic()
+        with self.lock:
+            jobs = []
+            for job_id, job in self.jobs.items():
+                self._trim(job, now)
+                window = min(self.WINDOW, max(now - job["started"], 1e-3))
+                jobs.append(
+                    {
+                        "job_id": job_id,
+                        "bytes": job["bytes"],
+                        "throughput": round(sum(b for _, b in job["samples"]) / window),
+                    }
+                )
+            active = self.active_count(now)
+            share = self.limit / active if self.limit and active else None
+        return {
+            "limit": self.limit,
+            "active_jobs": active,
+            "share": share,
+            "aggregate_throughput": sum(j["throughput"] for j in jobs),
+            "jobs": jobs,
+        }
 
-def _convert_la(img):
-    """转换LA模式(灰度+alpha)为RGB"""
-    # 分离灰度和alpha通道
-    l, a = img.split()
+class SharedBandwidthRegistry:
+    """在共享数据库中登记正在下载的任务，所属进程退出后的记录在计数时清理"""
 
-    # 创建白色背景
-    background = Image.new("RGB", img.size, (255, 255, 255))
+    def add(self, job_id):
+        with state_db() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO bandwidth_shares (job_id, pid, registered_at) "
+                "VALUES (?, ?, ?)",
+                (job_id, os.getpid(), time.time()),
+            )
 
-    # 创建RGB灰度图像
-    rgb_img = Image.merge("RGB", (l, l, l))
+    def remove(self, job_id):
+        with state_db() as db:
+            db.execute("DELETE FROM bandwidth_shares WHERE job_id = ?", (job_id,))
 
-    # 应用alpha通道
-    background.paste(rgb_img, mask=a)
+    def count(self):
+        with state_db() as db:
+            pids = [row["pid"] for row in db.execute("SELECT DISTINCT pid FROM bandwidth_shares")]
+            for pid in pids:
+                if not psutil.pid_exists(pid):
+                    db.execute("DELETE FROM bandwidth_shares WHERE pid = ?", (pid,))
+            return db.execute("SELECT COUNT(*) FROM bandwidth_shares").fetchone()[0]
 
-    return background
+bandwidth_scheduler = BandwidthScheduler(
+    Const.DOWNLOAD_BANDWIDTH_LIMIT, SharedBandwidthRegistry()
+)
 
-def _convert_pa(img):
-    """转换PA模式(调色板+alpha)为RGB"""
-    # 先转换为RGBA
-    rgba_img = img.convert("RGBA")
+def download_room(job_id):
+    return f"download_{job_id}"
 
-    # 创建白色背景
-    background = Image.new("RGB", img.size, (255, 255, 255))
+def emit_download_progress(job_id, payload):
+    """只向订阅了该任务的客户端推送进度"""
+    socketio.emit(
+        "download_progress", {"job_id": job_id, **payload}, to=download_room(job_id)
+    )
 
-    # 应用alpha通道
-    r, g, b, a = rgba_img.split()
-    background.paste(rgba_img, mask=a)
+# 客户端订阅下载任务的进度
+@socketio.on("join_download")
+def on_join_download(data):
+    job_id = (data or {}).get("job_id")
+    if job_id:
+        join_room(download_room(job_id))
+
+def get_download_job(job_id):
+    with state_db() as db:
+        row = db.execute(
+            "SELECT rowid, * FROM download_jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["queue_position"] = None
+        if job["state"] == "queued":
+            # 排在前面的排队任务数 + 1
+            job["queue_position"] = (
+                db.execute(
+                    "SELECT COUNT(*) FROM download_jobs WHERE state = 'queued' "
+                    "AND (created_at < ? OR (created_at = ? AND rowid < ?))",
+                    (job["created_at"], job["created_at"], job["rowid"]),
+                ).fetchone()[0]
+                + 1
+            )
+    return job
+
+def update_download_job(job_id, **fields):
+    columns = ", ".join(f"{name} = ?" for name in fields)
+    with state_db() as db:
+        db.execute(
+            f"UPDATE download_jobs SET {columns} WHERE job_id = ?",
+            (*fields.values(), job_id),
+        )
 
-    return background
+def get_download_dedup_key(video_url, format_id, merge_audio):
+    """相同 (链接, 格式, 是否合并音频) 的下载共享同一个键"""
+    raw = f"{normalize_video_url(video_url)}\0{format_id}\0{int(bool(merge_audio))}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
 
-# 图片转PDF函数（处理所有图像模式）
-def convert_image_to_pdf(image_path, output_path, quality=90):
-    try:
-        # 打开图片
-        img = Image.open(image_path)
+def submit_download_job(video_url, format_id, merge_audio):
+    """
+    提交下载任务，返回 (任务ID, 方式)
+    方式: new - 新建任务; attached - 加入进行中的相同任务; reused - 复用已下载的文件
+    """
+    dedup_key = get_download_dedup_key(video_url, format_id, merge_audio)
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    with state_db(transaction=True) as db:
+        # 顺便清理过期的已结束任务记录
+        db.execute(
+            "DELETE FROM download_jobs WHERE state IN ('finished', 'failed', 'cancelled') "
+            "AND finished_at < ?",
+            (now - Const.DOWNLOAD_JOB_RETENTION,),
+        )
 
-        # 处理特殊图像模式
-        img = handle_special_image_modes(img)
+        # 相同的下载正在进行，直接加入
+        row = db.execute(
+            "SELECT job_id FROM download_jobs WHERE dedup_key = ? "
+            "AND state IN ('queued', 'running') ORDER BY created_at LIMIT 1",
+            (dedup_key,),
+        ).fetchone()
+        if row is not None:
+            db.execute(
+                "UPDATE download_jobs SET subscribers = subscribers + 1 WHERE job_id = ?",
+                (row["job_id"],),
+            )
+            return row["job_id"], "attached"
+
+        # 已下载过且文件仍在，直接生成一个已完成的任务
+        row = db.execute(
+            "SELECT filename, size FROM video_files WHERE dedup_key = ?", (dedup_key,)
+        ).fetchone()
+        if row is not None:
+            path = os.path.join(app.config["UPLOAD_FOLDER"], "videos", row["filename"])
+            if os.path.isfile(path) and os.path.getsize(path) == row["size"]:
+                db.execute(
+                    "UPDATE video_files SET last_access = ? WHERE dedup_key = ?",
+                    (now, dedup_key),
+                )
+                db.execute(
+                    "UPDATE artifacts SET last_access = ? WHERE path = ?",
+                    (now, "videos/" + row["filename"]),
+                )
+                db.execute(
+                    "INSERT INTO download_jobs (job_id, url, format_id, merge_audio, state, "
+                    "percent, filename, created_at, started_at, finished_at, dedup_key) "
+                    "VALUES (?, ?, ?, ?, 'finished', 100, ?, ?, ?, ?, ?)",
+                    (
+                        job_id,
+                        video_url,
+                        format_id,
+                        int(bool(merge_audio)),
+                        row["filename"],
+                        now,
+                        now,
+                        now,
+                        dedup_key,
+                    ),
+                )
+                return job_id, "reused"
+            db.execute("DELETE FROM video_files WHERE dedup_key = ?", (dedup_key,))
 
-        # 确保图像是RGB模式
-        if img.mode != "RGB":
-            img = img.convert("RGB")
+        db.execute(
+            "INSERT INTO download_jobs (job_id, url, format_id, merge_audio, state, "
+            "created_at, dedup_key) VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+            (job_id, video_url, format_id, int(bool(merge_audio)), now, dedup_key),
+        )
+    ensure_download_executors()
+    download_queue_event.set()
+    return job_id, "new"
+
+def claim_next_download_job():
+    """在全局并发上限内领取最早的排队任务，没有可执行的任务时返回 None"""
+    with state_db(transaction=True) as db:
+        # 所属进程已退出的 running 任务重新排队
+        for row in db.execute(
+            "SELECT job_id, state, worker_pid FROM download_jobs "
+            "WHERE state IN ('running', 'cancelling')"
+        ).fetchall():
+            if not row["worker_pid"] or not psutil.pid_exists(row["worker_pid"]):
+                logger.warning(f"下载任务 {row['job_id']} 的执行进程已退出，重新排队")
+                shutil.rmtree(get_download_job_dir(row["job_id"]), ignore_errors=True)
+                if row["state"] == "cancelling":
+                    db.execute(
+                        "UPDATE download_jobs SET state = 'cancelled', finished_at = ? "
+                        "WHERE job_id = ?",
+                        (time.time(), row["job_id"]),
+                    )
+                else:
+                    db.execute(
+                        "UPDATE download_jobs SET state = 'queued', worker_pid = NULL "
+                        "WHERE job_id = ?",
+                        (row["job_id"],),
+                    )
 
-        # 创建临时JPEG文件
-        temp_jpg = os.path.join(CONVERT_DIR, f"temp_{uuid.uuid4().hex}.jpg")
-        img.save(temp_jpg, "JPEG", quality=quality)
+        running = db.execute(
+            "SELECT COUNT(*) FROM download_jobs WHERE state IN ('running', 'cancelling')"
+        ).fetchone()[0]
+        if running >= Const.DOWNLOAD_MAX_CONCURRENT:
+            return None
+
+        row = db.execute(
+            "SELECT * FROM download_jobs WHERE state = 'queued' "
+            "ORDER BY created_at, rowid LIMIT 1"
+        ).fetchone()
+        if row is None:
+            return None
+
+        db.execute(
+            "UPDATE download_jobs SET state = 'running', worker_pid = ?, started_at = ? "
+            "WHERE job_id = ?",
+            (os.getpid(), time.time(), row["job_id"]),
+        )
+        return dict(row)
 
-        # 转换为PDF
-        with open(output_path, "wb") as f:
-            f.write(img2pdf.convert(temp_jpg))
+def download_executor():
+    while True:
+        try:
+            job = claim_next_download_job()
+        except sqlite3.Error as e:
+            logger.warning(f"领取下载任务失败: {str(e)}")
+            job = None
+
+        if job is None:
+            # 等待新任务或其他任务结束；跨 worker 的变化靠定时轮询发现
+            download_queue_event.wait(Const.DOWNLOAD_QUEUE_POLL_INTERVAL)
+            download_queue_event.clear()
+            continue
 
-        # 删除临时文件
-        os.remove(temp_jpg)
-        return True
+        try:
+            run_download_job(job)
+        except Exception as e:
+            # 单个任务出错不能结束执行器，否则本 worker 不再领取任务；任务标记为失败，不会一直停在 running
+            logger.error(f"下载任务 {job['job_id']} 执行出错: {str(e)}", exc_info=True)
+            try:
+                update_download_job(
+                    job["job_id"],
+                    state="failed",
+                    error=f"服务器错误: {str(e)}",
+                    finished_at=time.time(),
+                )
+            except sqlite3.Error as db_error:
+                logger.warning(f"标记下载任务失败时出错: {str(db_error)}")
+        download_queue_event.set()
+
+def ensure_download_executors():
+    global download_executors_started
+    with download_executors_lock:
+        if download_executors_started:
+            return
+        for _ in range(Const.DOWNLOAD_EXECUTORS_PER_WORKER):
+            socketio.start_background_task(download_executor)
+        download_executors_started = True
+        logger.info(f"已启动 {Const.DOWNLOAD_EXECUTORS_PER_WORKER} 个下载执行器")
+
+# ---------------- 封装为 MP4 ----------------
+# 能直接放进 MP4 容器的编码，这些流只需复制（remux），其余才需要重新编码
+MP4_VIDEO_CODECS = {"h264", "hevc", "av1", "vp9", "mpeg4"}
+MP4_AUDIO_CODECS = {"aac", "mp3", "ac3", "eac3", "alac", "opus"}
+
+def probe_media_streams(path):
+    """使用 ffprobe 读取音视频流的类型和编码"""
+    result = subprocess.run(
+        [
+            Const.FFPROBE_PATH,
+            "-v", "error",
+            "-show_entries", "stream=index,codec_type,codec_name",
+            "-of", "json",
+            path,
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    streams = json.loads(result.stdout).get("streams", [])
+    return [s for s in streams if s.get("codec_type") in ("video", "audio")]
+
+def build_mp4_codec_args(streams, force_transcode=False):
+    """按流决定复制还是转码，返回 (ffmpeg 编码参数, 是否有流需要转码)"""
+    args = []
+    transcode = False
+    video_idx = audio_idx = 0
+    for stream in streams:
+        codec = stream.get("codec_name")
+        if stream["codec_type"] == "video":
+            if codec in MP4_VIDEO_CODECS and not force_transcode:
+                args += [f"-c:v:{video_idx}", "copy"]
+                if codec == "hevc":
+                    # Apple 设备只识别 hvc1 标签
+                    args += [f"-tag:v:{video_idx}", "hvc1"]
+            else:
+                args += [
+                    f"-c:v:{video_idx}", "libx264",
+                    "-preset", Const.MERGE_TRANSCODE_PRESET,
+                    "-crf", str(Const.MERGE_TRANSCODE_CRF),
+                    "-pix_fmt", "yuv420p",
+                ]
+                transcode = True
+            video_idx += 1
+        else:
+            if codec in MP4_AUDIO_CODECS and not force_transcode:
+                args += [f"-c:a:{audio_idx}", "copy"]
+            else:
+                args += [f"-c:a:{audio_idx}", "aac", f"-b:a:{audio_idx}", "192k"]
+                transcode = True
+            audio_idx += 1
+    return args, transcode
 
-    except Exception as e:
-        logging.error(f"图片转PDF错误: {str(e)}", exc_info=True)
-        return False
+def merge_to_mp4(input_path, work_dir, force_transcode=False):
+    """
+    将下载结果封装为 MP4，优先只复制流（remux），编码不兼容时才转码
+    返回 (输出文件路径, 方式, 耗时秒数)，方式为 none / remux / transcode
+    """
+    start = time.perf_counter()
+    if input_path.lower().endswith(".mp4") and not force_transcode:
+        return input_path, "none", 0.0
+
+    streams = probe_media_streams(input_path)
+    codec_args, transcode = build_mp4_codec_args(streams, force_transcode)
+    strategy = "transcode" if transcode else "remux"
+
+    # 输出先写到任务目录，取消任务时可以按目录结束 FFmpeg 进程
+    base_name = os.path.splitext(os.path.basename(input_path))[0]
+    temp_output = os.path.join(work_dir, f"{base_name}.mp4")
+    subprocess.run(
+        [
+            Const.FFMPEG_PATH,
+            "-y",
+            "-v", "error",
+            "-i", input_path,
+            "-map", "0:v?",
+            "-map", "0:a?",
+            *codec_args,
+            "-movflags", "+faststart",
+            temp_output,
+        ],
+        capture_output=True,
+        check=True,
+    )
 
-# 文件转换路由（支持进度更新）
-@app.route("/convert_files", methods=["POST"])
-def convert_files():
-    if "files" not in request.files:
-        return jsonify({"success": False, "error": "未选择文件"}), 400
+    output_path = os.path.join(os.path.dirname(input_path), f"{base_name}.mp4")
+    os.replace(temp_output, output_path)
+    if os.path.abspath(output_path) != os.path.abspath(input_path):
+        os.remove(input_path)
+    return output_path, strategy, time.perf_counter() - start
+
+def get_download_job_dir(job_id):
+    """任务的临时目录，存放 .part、分片和合并前的中间文件"""
+    return os.path.join(app.config["UPLOAD_FOLDER"], "videos", ".jobs", job_id)
+
+def kill_job_processes(job_dir):
+    """结束命令行中引用了任务目录的子进程（FFmpeg 后处理等）"""
+    # yt-dlp 和 merge_to_mp4 传给 FFmpeg 的是相对路径（可能带 file: 前缀），
+    # 按相对路径匹配，同时也能匹配绝对路径
+    job_dir = os.path.normpath(job_dir)
+    killed = 0
+    for proc in psutil.process_iter(["pid", "cmdline"]):
+        try:
+            cmdline = proc.info["cmdline"] or []
+            if proc.pid != os.getpid() and any(
+                job_dir in os.path.normpath(arg) for arg in cmdline
+            ):
+                proc.kill()
+                killed += 1
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    if killed:
+        logger.info(f"已结束 {killed} 个与任务目录相关的进程: {job_dir}")
+    return killed
 
-    files = request.files.getlist("files")
-    if len(files) == 0:
-        return jsonify({"success": False, "error": "未选择文件"}), 400
+def watch_download_cancel(job_id, job_dir, cancel_event, done_event):
+    """
+    监视任务的取消请求
+    其他 worker 上发起的取消只写入数据库，这里定时检查并通知本进程中的下载
+    """
+    while not done_event.wait(Const.DOWNLOAD_CANCEL_POLL_INTERVAL):
+        if not cancel_event.is_set():
+            try:
+                job = get_download_job(job_id)
+            except sqlite3.Error:
+                continue
+            if job is None or job["state"] != "cancelling":
+                continue
+            cancel_event.set()
+        # 下载阶段由进度钩子抛出异常中止，后处理阶段直接结束 FFmpeg 进程
+        kill_job_processes(job_dir)
+
+def run_download_job(job):
+    job_id = job["job_id"]
+    video_url = job["url"]
+    logger.info(f"开始执行下载任务 {job_id}: {video_url} [{job['format_id']}]")
+
+    # 最终文件存放目录，按去重键分目录，不同任务的同名视频互不覆盖
+    video_root = os.path.join(app.config["UPLOAD_FOLDER"], "videos")
+    video_dir = os.path.join(video_root, job["dedup_key"][:16])
+    # 任务临时目录
+    job_dir = get_download_job_dir(job_id)
+    os.makedirs(job_dir, exist_ok=True)
+
+    cancel_event = threading.Event()
+    done_event = socketio.server.eio.create_event()
+    running_download_cancels[job_id] = cancel_event
+    socketio.start_background_task(
+        watch_download_cancel, job_id, job_dir, cancel_event, done_event
+    )
+
+    last_saved = 0
+    throttle = ProgressThrottle(Const.DOWNLOAD_PROGRESS_MAX_HZ)
+
+    def check_cancelled():
+        if cancel_event.is_set():
+            raise yt_dlp.utils.DownloadCancelled("下载已取消")
+
+    def wait_for_bandwidth(d):
+        downloaded = d.get("downloaded_bytes")
+        if downloaded is None:
+            return
+        delay = bandwidth_scheduler.consume(job_id, d.get("filename"), downloaded)
+        # 分段等待，等待期间也能及时响应取消
+        while delay > 0 and not cancel_event.is_set():
+            step = min(delay, 0.25)
+            socketio.sleep(step)
+            delay -= step
+        check_cancelled()
+
+    # 添加进度钩子
+    def download_progress_hook(d):
+        nonlocal last_saved
+        check_cancelled()
+        if d["status"] == "downloading":
+            wait_for_bandwidth(d)
+            # 超出推送频率的更新直接丢弃，不做字符串清理
+            now = time.time()
+            emit_due = throttle.allow()
+            save_due = now - last_saved >= Const.DOWNLOAD_STATUS_SAVE_INTERVAL
+            if not emit_due and not save_due:
+                return
+
+            percent = clean_progress_string(d.get("_percent_str", "0%"))
+            speed = clean_progress_string(d.get("_speed_str", "N/A"))
+            eta = clean_progress_string(d.get("_eta_str", "N/A"))
+
+            # 发送进度数据
+            if emit_due:
+                emit_download_progress(
+                    job_id, {"percent": percent, "speed": speed, "eta": eta}
+                )
+
+            # 写入数据库的进度限频，供状态查询接口使用
+            if save_due:
+                last_saved = now
+                try:
+                    update_download_job(
+                        job_id,
+                        percent=float(percent.rstrip("%") or 0),
+                        speed=speed,
+                        eta=eta,
+                    )
+                except (sqlite3.Error, ValueError) as e:
+                    logger.debug(f"更新下载进度失败: {str(e)}")
+
+    # 后处理开始前同样检查取消请求
+    def postprocessor_hook(d):
+        check_cancelled()
+
+    # 配置下载选项
+    ydl_opts = {
+        "format": job["format_id"],
+        "outtmpl": "%(title)s.%(ext)s",
+        # 中间文件写入任务目录，完成后移动到视频目录
+        "paths": {"home": video_dir, "temp": job_dir},
+        # 编码与 MP4 不兼容时先合并为 MKV，再由 merge_to_mp4 处理
+        "merge_output_format": "mp4/mkv",
+        "ffmpeg_location": Const.FFMPEG_PATH,
+        "postprocessor_args": ["-y"],  # 覆盖输出文件
+        "socket_timeout": Const.DOWNLOAD_SOCKET_TIMEOUT,
+        # DASH/HLS 分片并发下载
+        "concurrent_fragment_downloads": Const.DOWNLOAD_FRAGMENT_CONCURRENCY,
+        "verbose": True,
+        "progress_hooks": [download_progress_hook],
+        "postprocessor_hooks": [postprocessor_hook],
+    }
 
-    # 获取转换选项
-    options = request.form.get("options")
     try:
-        options = json.loads(options) if options else {}
-    except:
-        options = {}
+        # 登记会写共享数据库，失败时同样按任务失败处理
+        bandwidth_scheduler.register(job_id)
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(video_url, download=True)
+            filename = ydl.prepare_filename(info)
+        check_cancelled()
+
+        # 输出 MP4：能复制流就不转码
+        merge_strategy, merge_seconds = None, None
+        if job["merge_audio"]:
+            filename, merge_strategy, merge_seconds = merge_to_mp4(filename, job_dir)
+            logger.info(
+                f"下载任务 {job_id} 封装方式: {merge_strategy}, 耗时 {merge_seconds:.2f}s"
+            )
 
-    # 获取任务ID
-    task_id = options.get("task_id", "")
+        # 相对视频目录的路径
+        relative_name = os.path.relpath(filename, video_root).replace(os.sep, "/")
+        now = time.time()
+        with state_db(transaction=True) as db:
+            db.execute(
+                "UPDATE download_jobs SET state = 'finished', percent = 100, eta = '00:00', "
+                "filename = ?, merge_strategy = ?, merge_seconds = ?, finished_at = ? "
+                "WHERE job_id = ?",
+                (relative_name, merge_strategy, merge_seconds, now, job_id),
+            )
+            # 记录到文件索引，供后续相同请求复用
+            db.execute(
+                "INSERT OR REPLACE INTO video_files "
+                "(dedup_key, filename, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (job["dedup_key"], relative_name, os.path.getsize(filename), now, now),
+            )
+        register_artifact(filename, "video")
+        # 最终进度不受限频影响，保证客户端能收到 100%
+        emit_download_progress(
+            job_id,
+            {"percent": "100%", "speed": "N/A", "eta": "00:00", "state": "finished"},
+        )
+        logger.info(f"下载任务 {job_id} 完成: {os.path.basename(filename)}")
+    except Exception as e:
+        if cancel_event.is_set():
+            # 取消后 FFmpeg 被结束等引起的错误都按取消处理
+            finish_cancelled_download(job_id)
+        elif isinstance(e, yt_dlp.utils.DownloadError):
+            logger.error(f"视频下载失败: {str(e)}")
+            update_download_job(
+                job_id, state="failed", error=f"下载失败: {str(e)}", finished_at=time.time()
+            )
+        else:
+            logger.error(f"视频下载错误: {str(e)}", exc_info=True)
+            update_download_job(
+                job_id, state="failed", error=f"服务器错误: {str(e)}", finished_at=time.time()
+            )
+    finally:
+        done_event.set()
+        running_download_cancels.pop(job_id, None)
+        # 清理 .part 和分片等中间文件
+        shutil.rmtree(job_dir, ignore_errors=True)
+        try:
+            bandwidth_scheduler.unregister(job_id)
+        except sqlite3.Error as e:
+            # 留下的登记记录在所属进程退出后由 count 清理
+            logger.warning(f"注销下载任务 {job_id} 的带宽份额失败: {str(e)}")
+
+def finish_cancelled_download(job_id):
+    finished_at = time.time()
+    update_download_job(
+        job_id, state="cancelled", error="下载已取消", finished_at=finished_at
+    )
+    job = get_download_job(job_id)
+    if job and job["cancel_requested_at"]:
+        logger.info(
+            f"下载任务 {job_id} 已取消，释放耗时 {finished_at - job['cancel_requested_at']:.3f}s"
+        )
+    emit_download_progress(job_id, {"state": "cancelled"})
+
+def cancel_download_job(job_id):
+    """
+    请求取消下载任务，返回取消后的任务状态
+    排队中的任务直接取消；运行中的任务标记为 cancelling，由执行器中止并清理；
+    多个客户端共享的任务只有在最后一个客户端取消时才真正取消
+    """
+    now = time.time()
+    with state_db(transaction=True) as db:
+        row = db.execute(
+            "SELECT state, subscribers FROM download_jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        state = row["state"]
+        if state in ("queued", "running") and row["subscribers"] > 1:
+            # 还有其他客户端在等待同一个下载，只退订不取消
+            db.execute(
+                "UPDATE download_jobs SET subscribers = subscribers - 1 WHERE job_id = ?",
+                (job_id,),
+            )
+            return state
+        if state == "queued":
+            state = "cancelled"
+            db.execute(
+                "UPDATE download_jobs SET state = ?, error = '下载已取消', "
+                "cancel_requested_at = ?, finished_at = ? WHERE job_id = ?",
+                (state, now, now, job_id),
+            )
+        elif state == "running":
+            state = "cancelling"
+            db.execute(
+                "UPDATE download_jobs SET state = ?, cancel_requested_at = ? WHERE job_id = ?",
+                (state, now, job_id),
+            )
+
+    if state == "cancelling":
+        cancel_event = running_download_cancels.get(job_id)
+        if cancel_event is not None:
+            # 任务就在本 worker 中运行，立即通知
+            cancel_event.set()
+        # 任务可能在其他 worker 中运行，直接结束其 FFmpeg 进程
+        kill_job_processes(get_download_job_dir(job_id))
+    return state
+
+# ---------------- 边下边传 ----------------
+# 不落盘：FFmpeg 直接从源站拉流，封装为分片 MP4 写到 stdout，再以分块响应发给浏览器
+
+# 本 worker 中同时进行的边下边传数量
+stream_slots = threading.BoundedSemaphore(Const.STREAM_MAX_CONCURRENT)
+
+# FFmpeg 能直接读取的协议
+STREAMABLE_PROTOCOLS = {"http", "https", "m3u8", "m3u8_native"}
+
+# yt-dlp 编码标识 -> FFmpeg 编码名
+YTDLP_CODEC_NAMES = {
+    "avc1": "h264",
+    "avc3": "h264",
+    "hev1": "hevc",
+    "hvc1": "hevc",
+    "av01": "av1",
+    "vp09": "vp9",
+    "mp4a": "aac",
+    "ac-3": "ac3",
+    "ec-3": "eac3",
+}
+
+def ytdlp_codec_name(codec):
+    codec = (codec or "").split(".")[0].lower()
+    return YTDLP_CODEC_NAMES.get(codec, codec)
+
+def build_stream_command(info):
+    """根据解析结果构造边下边传的 FFmpeg 命令，格式不支持时返回 None"""
+    formats = info.get("requested_formats") or [info]
+    input_args, streams, map_args = [], [], []
+    for idx, fmt in enumerate(formats):
+        if fmt.get("protocol") not in STREAMABLE_PROTOCOLS:
+            return None
+        headers = "".join(f"{k}: {v}\r\n" for k, v in (fmt.get("http_headers") or {}).items())
+        if headers:
+            input_args += ["-headers", headers]
+        input_args += ["-reconnect", "1", "-reconnect_streamed", "1", "-i", fmt["url"]]
+
+        vcodec, acodec = fmt.get("vcodec"), fmt.get("acodec")
+        if vcodec != "none":
+            streams.append({"codec_type": "video", "codec_name": ytdlp_codec_name(vcodec)})
+            map_args += ["-map", f"{idx}:v:0"]
+        if acodec != "none":
+            streams.append({"codec_type": "audio", "codec_name": ytdlp_codec_name(acodec)})
+            map_args += ["-map", f"{idx}:a:0"]
+
+    codec_args, _ = build_mp4_codec_args(streams)
+    return [
+        Const.FFMPEG_PATH,
+        "-v", "error",
+        *input_args,
+        *map_args,
+        *codec_args,
+        "-f", "mp4",
+        # 分片 MP4 不需要回写文件头，可以直接输出到管道
+        "-movflags", "frag_keyframe+empty_moov+default_base_moof",
+        "pipe:1",
+    ]
+
+# 边下边传下载
+@app.route("/stream_video", methods=["GET"])
+def stream_video():
+    video_url = request.args.get("url")
+    format_id = request.args.get("format_id")
+
+    if not video_url or not format_id:
+        return jsonify({"success": False, "error": "参数错误"}), 400
+    if not Const.FFMPEG_PATH:
+        return (
+            jsonify({"success": False, "error": "服务器未配置 FFmpeg，无法处理视频"}),
+            500,
+        )
+    if not stream_slots.acquire(blocking=False):
+        return jsonify({"success": False, "error": "服务器繁忙，请稍后重试"}), 429
+
+    proc = None
+    released = False
+
+    def cleanup():
+        nonlocal released
+        if released:
+            return
+        released = True
+        # 客户端断开或传输结束，结束 FFmpeg 并释放名额
+        if proc is not None and proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        stream_slots.release()
+
+    try:
+        # 直链有时效，每次都重新解析
+        with yt_dlp.YoutubeDL(
+            {"quiet": True, "no_warnings": True, "simulate": True, "format": format_id}
+        ) as ydl:
+            info = ydl.extract_info(video_url, download=False)
+
+        command = build_stream_command(info)
+        if command is None:
+            cleanup()
+            return (
+                jsonify({"success": False, "error": "该格式不支持边下边传，请使用普通下载"}),
+                400,
+            )
+
+        start = time.perf_counter()
+        proc = subprocess.Popen(
+            command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        fd = proc.stdout.fileno()
+        first_chunk = os.read(fd, Const.STREAM_CHUNK_SIZE)
+        if not first_chunk:
+            cleanup()
+            return jsonify({"success": False, "error": "拉取视频流失败"}), 502
+        logger.info(
+            f"边下边传开始: {video_url} [{format_id}]，首字节耗时 {time.perf_counter() - start:.2f}s"
+        )
+    except yt_dlp.utils.DownloadError as e:
+        cleanup()
+        return jsonify({"success": False, "error": f"解析失败: {str(e)}"}), 400
+    except Exception as e:
+        cleanup()
+        logger.error(f"边下边传错误: {str(e)}", exc_info=True)
+        return jsonify({"success": False, "error": f"服务器错误: {str(e)}"}), 500
+
+    def generate():
+        yield first_chunk
+        while True:
+            chunk = os.read(fd, Const.STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+    title = (info.get("title") or "video").replace("/", "_").replace("\\", "_")
+    response = Response(generate(), mimetype="video/mp4")
+    response.headers["Content-Disposition"] = attachment_disposition(f"{title}.mp4")
+    response.headers["Cache-Control"] = "no-store"
+    # nginx 等反向代理不要缓冲
+    response.headers["X-Accel-Buffering"] = "no"
+    response.call_on_close(cleanup)
+    return response
+
+# 提交下载任务，立即返回任务ID
+@app.route("/download_video", methods=["POST"])
+def download_video():
+    data = request.get_json()
+    video_url = data.get("url")
+    format_id = data.get("format_id")
+    merge_audio = data.get("merge_audio", True)
+    # stream=true 时不在服务器保存文件，返回边下边传地址
+    stream = data.get("stream", False)
+
+    if not video_url or not format_id:
+        return jsonify({"success": False, "error": "参数错误"}), 400
+
+    # 检查 FFmpeg 是否可用
+    if not Const.FFMPEG_PATH:
+        return (
+            jsonify({"success": False, "error": "服务器未配置 FFmpeg，无法处理视频"}),
+            500,
+        )
+
+    if stream:
+        stream_url = url_for(
+            "stream_video", url=video_url, format_id=format_id, _external=True
+        )
+        return jsonify({"success": True, "stream_url": stream_url})
+
+    try:
+        job_id, mode = submit_download_job(video_url, format_id, merge_audio)
+        job = get_download_job(job_id)
+    except sqlite3.Error as e:
+        logger.error(f"提交下载任务失败: {str(e)}")
+        return jsonify({"success": False, "error": f"服务器错误: {str(e)}"}), 500
+
+    return (
+        jsonify(
+            {
+                "success": True,
+                "job_id": job_id,
+                "state": job["state"],
+                "queue_position": job["queue_position"],
+                "mode": mode,
+            }
+        ),
+        202,
+    )
+
+# 查询下载任务状态
+@app.route("/download_status/<job_id>", methods=["GET"])
+def download_status(job_id):
+    job = get_download_job(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "任务不存在"}), 404
+
+    return jsonify(
+        {
+            "success": True,
+            "job_id": job_id,
+            "state": job["state"],
+            "percent": job["percent"],
+            "speed": job["speed"],
+            "eta": job["eta"],
+            "queue_position": job["queue_position"],
+            "error": job["error"],
+            # 从请求取消到任务释放的耗时（秒）
+            "cancel_latency": (
+                round(job["finished_at"] - job["cancel_requested_at"], 3)
+                if job["state"] == "cancelled" and job["cancel_requested_at"]
+                else None
+            ),
+        }
+    )
+
+# 获取下载任务结果
+@app.route("/download_result/<job_id>", methods=["GET"])
+def download_result(job_id):
+    job = get_download_job(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "任务不存在"}), 404
+    if job["state"] in ("failed", "cancelled"):
+        return jsonify({"success": False, "state": job["state"], "error": job["error"]}), 400
+    if job["state"] != "finished":
+        return (
+            jsonify({"success": False, "state": job["state"], "error": "任务尚未完成"}),
+            409,
+        )
+
+    # 获取下载URL
+    download_url = url_for(
+        "download_video_file", filename=job["filename"], _external=True
+    )
+    return jsonify(
+        {
+            "success": True,
+            "filename": os.path.basename(job["filename"]),
+            "download_url": download_url,
+            # 封装方式（none / remux / transcode）及耗时
+            "merge_strategy": job["merge_strategy"],
+            "merge_seconds": job["merge_seconds"],
+        }
+    )
+
+# 本 worker 的下载吞吐量统计，带宽份额按所有 worker 的活动任务计算
+@app.route("/download_stats", methods=["GET"])
+def download_stats():
+    return jsonify({"success": True, "worker_pid": os.getpid(), **bandwidth_scheduler.stats()})
+
+# 取消下载任务
+@app.route("/cancel_download", methods=["POST"])
+def cancel_download():
+    data = request.get_json(silent=True) or {}
+    job_id = data.get("job_id")
+    if not job_id:
+        return jsonify({"success": False, "error": "参数错误"}), 400
+
+    try:
+        state = cancel_download_job(job_id)
+    except sqlite3.Error as e:
+        logger.error(f"取消下载任务失败: {str(e)}")
+        return jsonify({"success": False, "error": f"服务器错误: {str(e)}"}), 500
+    if state is None:
+        return jsonify({"success": False, "error": "任务不存在"}), 404
+
+    logger.info(f"下载任务 {job_id} 取消请求已处理，当前状态: {state}")
+    return jsonify({"success": True, "job_id": job_id, "state": state})
+
+@app.route("/download_video/<path:filename>")
+def download_video_file(filename):
+    video_dir = os.path.join(app.config["UPLOAD_FOLDER"], "videos")
+    return send_upload_file(video_dir, filename)
+
+### 文件格式转换器
+# ================ 文件格式转换器实现 ================
+
+# 配置转换目录
+CONVERT_DIR = os.path.join("uploads", "converted")
+os.makedirs(CONVERT_DIR, exist_ok=True)
+
+# ---------------- 转换进程池 ----------------
+# PIL 编解码、img2pdf、pdf2image 都是 CPU 密集的，放到进程池中并行执行，同一请求的多个文件可以用满多个核。
+# 子进程以 spawn 方式启动，只需导入 converter 模块；某个文件导致子进程崩溃时整个进程池会失效，
+# 此时重建进程池并把受影响的文件逐个重试，一个文件不会拖累同批的其他文件。
+# 子进程通过共享队列上报单个文件内部的进度（如 PDF 的页数），等待任务时定期转发给对应的回调
+conversion_pool = None
+conversion_pool_lock = threading.Lock()
+conversion_progress_queue = None
+conversion_progress_handlers = {}
+
+def get_conversion_pool():
+    global conversion_pool, conversion_progress_queue
+    with conversion_pool_lock:
+        if conversion_pool is None:
+            workers = Const.CONVERT_POOL_WORKERS or os.cpu_count() or 1
+            context = multiprocessing.get_context("spawn")
+            if conversion_progress_queue is None:
+                conversion_progress_queue = context.Queue()
+            conversion_pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=context,
+                max_tasks_per_child=Const.CONVERT_POOL_MAX_TASKS_PER_CHILD,
+                initializer=init_worker,
+                initargs=(conversion_progress_queue,),
+            )
+            logger.info(f"已启动转换进程池: {workers} 个进程")
+        return conversion_pool
+
+def reset_conversion_pool(pool):
+    global conversion_pool
+    with conversion_pool_lock:
+        if conversion_pool is pool:
+            conversion_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def shutdown_conversion_pool():
+    # 在 eventlet 下解释器退出时 concurrent.futures 自带的清理会一直等待，先主动关闭进程池
+    with conversion_pool_lock:
+        pool = conversion_pool
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+atexit.register(shutdown_conversion_pool)
+
+def submit_conversion(fn, *args, **kwargs):
+    pool = get_conversion_pool()
+    try:
+        return pool, pool.submit(fn, *args, **kwargs)
+    except BrokenProcessPool:
+        # 进程池已被其他请求中崩溃的任务破坏
+        reset_conversion_pool(pool)
+        pool = get_conversion_pool()
+        return pool, pool.submit(fn, *args, **kwargs)
+
+def dispatch_conversion_progress():
+    """把子进程上报的进度转发给对应的回调，同一 worker 的多个任务共用队列，由任一等待方转发"""
+    while conversion_progress_queue is not None:
+        try:
+            progress_key, done, total = conversion_progress_queue.get_nowait()
+        except queue.Empty:
+            return
+        handler = conversion_progress_handlers.get(progress_key)
+        if handler:
+            handler(done, total)
+
+def wait_conversion(futures):
+    """等待一批任务，期间转发进度，返回已完成的任务"""
+    done, _ = wait(futures, timeout=Const.CONVERT_PROGRESS_INTERVAL, return_when=FIRST_COMPLETED)
+    dispatch_conversion_progress()
+    return done
+
+def run_conversion_task(fn, *args, **kwargs):
+    """在进程池中执行单个任务并等待结果，子进程崩溃时抛出 RuntimeError"""
+    pool, future = submit_conversion(fn, *args, **kwargs)
+    while not wait_conversion([future]):
+        pass
+    try:
+        return future.result()
+    except BrokenProcessPool:
+        reset_conversion_pool(pool)
+        raise RuntimeError("转换进程异常退出")
+
+def run_conversion_tasks(tasks, on_done=None, on_progress=None, costs=None, on_admit=None):
+    """
+    并行执行 {键: (函数, 参数...)}，每个任务完成时调用 on_done(键, 结果, 异常)
+    on_progress 不为空时以 progress_key 参数调用任务函数，子进程上报的进度通过 on_progress(键, 已完成, 总数) 回调
+    costs 为 {键: 像素数} 时按像素预算准入：预算不足的任务按顺序排队，等待超过 CONVERT_ADMISSION_TIMEOUT 的任务失败；
+    任务提交到进程池时调用 on_admit(键, 等待秒数)
+    返回 {键: (结果, 异常)}，单个任务失败不影响其他任务
+    """
+    results = {}
+    progress_keys = {}
+    if on_progress:
+        for key in tasks:
+            progress_key = uuid.uuid4().hex
+            progress_keys[key] = progress_key
+            conversion_progress_handlers[progress_key] = (
+                lambda done, total, key=key: on_progress(key, done, total)
+            )
+    reservations = {}
+
+    def finish(key, result, error):
+        # 任务结束后迟到的进度不再转发
+        conversion_progress_handlers.pop(progress_keys.get(key), None)
+        release_conversion_pixels(reservations.pop(key, None))
+        results[key] = (result, error)
+        if on_done:
+            on_done(key, result, error)
+
+    def task_kwargs(key):
+        return {"progress_key": progress_keys[key]} if key in progress_keys else {}
+
+    futures = {}
+    pending = set()
+    waiting = list(tasks)
+    queued_at = time.monotonic()
+
+    def admit():
+        # 按提交顺序准入，排在前面的大文件不会一直被后面的小文件插队
+        while waiting:
+            key = waiting[0]
+            pixels = (costs or {}).get(key, 0)
+            waited = time.monotonic() - queued_at
+            if pixels:
+                reservation = reserve_conversion_pixels(pixels)
+                if reservation is None:
+                    if waited <= Const.CONVERT_ADMISSION_TIMEOUT:
+                        return
+                    waiting.pop(0)
+                    finish(key, None, RuntimeError("服务器繁忙，等待内存预算超时"))
+                    continue
+                reservations[key] = reservation
+                record_admission_wait(waited)
+            waiting.pop(0)
+            if on_admit:
+                on_admit(key, waited)
+            fn, *args = tasks[key]
+            pool, future = submit_conversion(fn, *args, **task_kwargs(key))
+            futures[future] = (key, pool)
+            pending.add(future)
+
+    try:
+        broken = []
+        admit()
+        while pending or waiting:
+            if not pending:
+                # 全部任务都在等待其他请求释放预算
+                socketio.sleep(Const.CONVERT_PROGRESS_INTERVAL)
+                admit()
+                continue
+            for future in wait_conversion(pending):
+                pending.discard(future)
+                key, pool = futures[future]
+                try:
+                    finish(key, future.result(), None)
+                except BrokenProcessPool:
+                    broken.append((key, pool))
+                except Exception as e:
+                    finish(key, None, e)
+            admit()
+
+        if broken:
+            logger.warning(f"转换进程异常退出，逐个重试 {len(broken)} 个文件")
+            for pool in {pool for _, pool in broken}:
+                reset_conversion_pool(pool)
+            for key, _ in sorted(broken, key=lambda item: item[0]):
+                fn, *args = tasks[key]
+                try:
+                    finish(key, run_conversion_task(fn, *args, **task_kwargs(key)), None)
+                except Exception as e:
+                    finish(key, None, e)
+    finally:
+        for progress_key in progress_keys.values():
+            conversion_progress_handlers.pop(progress_key, None)
+        for reservation in reservations.values():
+            release_conversion_pixels(reservation)
+    return results
+
+# ---------------- 像素预算准入 ----------------
+# 解码后的位图是转换时内存占用的大头，提交到进程池之前先按文件头估算像素数并占用预算：
+# 本 worker 的预算在内存中计数，所有 worker 共享的预算记录在共享数据库中（进程退出后其占用自动失效）。
+# 预算不足时任务排队等待，单个文件超过预算或等待超时时失败，避免几个超大文件把 worker 拖进交换区
+conversion_pixels_in_use = 0
+conversion_pixels_lock = threading.Lock()
+# 本 worker 的准入等待统计
+conversion_admission_stats = {"admitted": 0, "waited": 0, "total_wait": 0.0, "max_wait": 0.0}
+
+def get_pixel_budget():
+    """单个文件允许的最大像素数"""
+    return min(Const.CONVERT_WORKER_PIXEL_BUDGET, Const.CONVERT_GLOBAL_PIXEL_BUDGET)
+
+def record_admission_wait(waited):
+    with conversion_pixels_lock:
+        stats = conversion_admission_stats
+        stats["admitted"] += 1
+        if waited >= Const.CONVERT_PROGRESS_INTERVAL:
+            stats["waited"] += 1
+        stats["total_wait"] += waited
+        stats["max_wait"] = max(stats["max_wait"], waited)
+
+def reserve_conversion_pixels(pixels):
+    """预算足够时占用 pixels 个像素并返回占用ID，否则返回 None"""
+    global conversion_pixels_in_use
+    with conversion_pixels_lock:
+        if conversion_pixels_in_use + pixels > Const.CONVERT_WORKER_PIXEL_BUDGET:
+            return None
+        reservation_id = uuid.uuid4().hex
+        with state_db(transaction=True) as db:
+            # 清理已退出进程遗留的占用
+            for row in db.execute("SELECT DISTINCT pid FROM pixel_reservations").fetchall():
+                if not psutil.pid_exists(row["pid"]):
+                    db.execute("DELETE FROM pixel_reservations WHERE pid = ?", (row["pid"],))
+            in_use = db.execute(
+                "SELECT COALESCE(SUM(pixels), 0) FROM pixel_reservations"
+            ).fetchone()[0]
+            if in_use + pixels > Const.CONVERT_GLOBAL_PIXEL_BUDGET:
+                return None
+            db.execute(
+                "INSERT INTO pixel_reservations (reservation_id, pid, pixels, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                (reservation_id, os.getpid(), pixels, time.time()),
+            )
+        conversion_pixels_in_use += pixels
+        return reservation_id, pixels
+
+def release_conversion_pixels(reservation):
+    global conversion_pixels_in_use
+    if reservation is None:
+        return
+    reservation_id, pixels = reservation
+    with conversion_pixels_lock:
+        conversion_pixels_in_use -= pixels
+    try:
+        with state_db() as db:
+            db.execute(
+                "DELETE FROM pixel_reservations WHERE reservation_id = ?", (reservation_id,)
+            )
+    except sqlite3.Error as e:
+        logger.warning(f"释放像素预算失败: {str(e)}")
+
+def wait_conversion_pixels(pixels):
+    """等待并占用像素预算，返回 (占用, 等待秒数)；超时抛出 RuntimeError"""
+    start = time.monotonic()
+    while True:
+        reservation = reserve_conversion_pixels(pixels)
+        waited = time.monotonic() - start
+        if reservation is not None:
+            record_admission_wait(waited)
+            return reservation, waited
+        if waited > Const.CONVERT_ADMISSION_TIMEOUT:
+            raise RuntimeError("服务器繁忙，等待内存预算超时")
+        socketio.sleep(Const.CONVERT_PROGRESS_INTERVAL)
+
+@app.route("/convert_admission/stats", methods=["GET"])
+def convert_admission_stats():
+    try:
+        with state_db() as db:
+            row = db.execute(
+                "SELECT COUNT(*) AS reservations, COALESCE(SUM(pixels), 0) AS pixels "
+                "FROM pixel_reservations"
+            ).fetchone()
+        with conversion_pixels_lock:
+            stats = dict(conversion_admission_stats)
+        admitted = stats.pop("admitted")
+        total_wait = stats.pop("total_wait")
+        return jsonify(
+            {
+                "success": True,
+                "admitted": admitted,
+                "waited": stats["waited"],
+                "avg_wait": round(total_wait / admitted, 3) if admitted else 0.0,
+                "max_wait": round(stats["max_wait"], 3),
+                "worker_pixels": conversion_pixels_in_use,
+                "worker_budget": Const.CONVERT_WORKER_PIXEL_BUDGET,
+                "global_pixels": row["pixels"],
+                "global_budget": Const.CONVERT_GLOBAL_PIXEL_BUDGET,
+                "reservations": row["reservations"],
+            }
+        )
+    except sqlite3.Error as e:
+        return jsonify({"success": False, "error": f"读取准入统计失败: {str(e)}"}), 500
+
+# ---------------- 转换结果缓存 ----------------
+# 以 (输入文件内容的 SHA-256, 目标格式及影响输出的选项) 为键缓存转换结果，相同的转换直接复用，不再解码和编码。
+# 缓存文件放在 uploads/convert_cache/ 下，登记为 convert_cache 类型的产物，由存储清理任务按
+# CONVERT_CACHE_MAX_BYTES 以最近最少访问淘汰；写入和命中缓存都使用硬链接，不复制文件内容
+CONVERT_CACHE_DIR = os.path.join(app.config["UPLOAD_FOLDER"], "convert_cache")
+CONVERT_CACHE_VERSION = 2  # 转换实现改变了输出时递增，使旧的缓存失效
+
+def get_conversion_cache_key(digests, original_ext, options, merge):
+    target_format = options.get("targetFormat", "pdf")
+    raster = None
+    if original_ext == "pdf" and target_format in IMAGE_EXTENSIONS:
+        raster = get_raster_options(options)
+    parts = {
+        "version": CONVERT_CACHE_VERSION,
+        "inputs": digests,
+        "target": target_format,
+        "quality": int(options.get("imageQuality", 90)),
+        "resize": get_resize_box(options),
+        "merge": merge,
+        "raster": raster,
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+def get_conversion_cache_dir(key):
+    return os.path.join(CONVERT_CACHE_DIR, key[:2], key)
+
+def link_or_copy(src, dst):
+    """优先创建硬链接，文件系统不支持时复制"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+def conversion_cache_get(key):
+    """返回缓存的输出 [(文件名后缀, 路径)]，未命中时返回 None；条目中有文件已被清理时删除该条目"""
+    with state_db() as db:
+        row = db.execute(
+            "SELECT outputs FROM conversion_cache WHERE key = ?", (key,)
+        ).fetchone()
+    outputs = None
+    if row is not None:
+        entry_dir = get_conversion_cache_dir(key)
+        outputs = [
+            (suffix, os.path.join(entry_dir, name)) for suffix, name in json.loads(row["outputs"])
+        ]
+        if all(os.path.isfile(path) for _, path in outputs):
+            for _, path in outputs:
+                touch_artifact(path)
+        else:
+            with state_db() as db:
+                db.execute("DELETE FROM conversion_cache WHERE key = ?", (key,))
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            outputs = None
+    record_cache_stat("convert", outputs is not None)
+    return outputs
+
+def conversion_cache_put(key, outputs, stem):
+    """把一次转换的输出 [{"filename", "path"}] 放入缓存，stem 为输出文件名的公共前缀，命中时替换为新的前缀"""
+    entry_dir = get_conversion_cache_dir(key)
+    if os.path.isdir(entry_dir):
+        return
+    os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+    work_dir = tempfile.mkdtemp(dir=os.path.dirname(entry_dir))
+    manifest = []
+    size = 0
+    try:
+        for i, item in enumerate(outputs):
+            extension = os.path.splitext(item["filename"])[1]
+            suffix = (
+                item["filename"][len(stem):] if item["filename"].startswith(stem) else extension
+            )
+            name = f"{i}{extension}"
+            link_or_copy(item["path"], os.path.join(work_dir, name))
+            manifest.append((suffix, name))
+            size += os.path.getsize(item["path"])
+        # 整个目录改名后才可见，并发写入同一个键时只有一个成功
+        os.rename(work_dir, entry_dir)
+    except OSError as e:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if not os.path.isdir(entry_dir):
+            logger.warning(f"写入转换缓存失败: {str(e)}")
+        return
+
+    with state_db() as db:
+        db.execute(
+            "INSERT OR REPLACE INTO conversion_cache (key, outputs, size, created_at) "
+            "VALUES (?, ?, ?, ?)",
+            (key, json.dumps(manifest), size, time.time()),
+        )
+    for _, name in manifest:
+        register_artifact(os.path.join(entry_dir, name), "convert_cache")
+
+def restore_cached_outputs(cached, stem, dest_dir):
+    """把缓存的输出链接到任务目录，文件名使用本次转换的前缀"""
+    outputs = []
+    for suffix, path in cached:
+        filename = stem + suffix
+        target_path = os.path.join(dest_dir, filename)
+        link_or_copy(path, target_path)
+        outputs.append(
+            {"filename": filename, "file_size": os.path.getsize(target_path), "path": target_path}
+        )
+    return outputs
+
+@app.route("/convert_cache/stats", methods=["GET"])
+def convert_cache_stats():
+    try:
+        stats = get_cache_stats("convert")
+        with state_db() as db:
+            row = db.execute(
+                "SELECT COUNT(*) AS entries, COALESCE(SUM(size), 0) AS bytes FROM conversion_cache"
+            ).fetchone()
+        stats.update(
+            {
+                "entries": row["entries"],
+                "bytes": row["bytes"],
+                "max_bytes": Const.CONVERT_CACHE_MAX_BYTES,
+            }
+        )
+        return jsonify({"success": True, **stats})
+    except sqlite3.Error as e:
+        return jsonify({"success": False, "error": f"读取缓存统计失败: {str(e)}"}), 500
+
+# ---------------- 可续传的分块上传 ----------------
+# 参考 tus 协议：POST /uploads 创建上传（Upload-Length、Upload-Metadata），PATCH 从 Upload-Offset 处追加数据，
+# HEAD 查询服务器已收到的字节数，DELETE 放弃上传。连接中断后客户端查询偏移量继续发送，不必重传整个文件。
+# 数据直接写入 uploads/staging/ 下的最终位置，提交转换时移动到任务目录，不再复制；
+# 边接收边计算 SHA-256，哈希状态只保存在接收数据的 worker 进程中，续传请求落到其他 worker 时从已写入的部分补算
+TUS_VERSION = "1.0.0"
+STAGING_DIR = os.path.join(app.config["UPLOAD_FOLDER"], "staging")
+os.makedirs(STAGING_DIR, exist_ok=True)
+upload_hashers = {}  # 上传ID -> (已计算的字节数, sha256 对象, 更新时间)
+upload_hashers_lock = threading.Lock()
+
+def save_upload_with_digest(file, path):
+    """保存上传的文件，同时计算 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "wb") as f:
+        while chunk := file.stream.read(Const.UPLOAD_READ_SIZE):
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest()
+
+def get_staged_upload_path(upload_id):
+    return os.path.join(STAGING_DIR, upload_id)
+
+def get_staged_upload(upload_id):
+    with state_db() as db:
+        row = db.execute(
+            "SELECT * FROM staged_uploads WHERE upload_id = ?", (upload_id,)
+        ).fetchone()
+    return dict(row) if row else None
+
+def parse_upload_metadata(header):
+    """解析 Upload-Metadata: "键 base64值,键 base64值" """
+    metadata = {}
+    for item in (header or "").split(","):
+        key, _, value = item.strip().partition(" ")
+        if key:
+            try:
+                metadata[key] = base64.b64decode(value).decode("utf-8")
+            except ValueError:
+                metadata[key] = ""
+    return metadata
+
+def tus_response(body=None, status=204, headers=None):
+    response = jsonify(body) if body is not None else Response(status=status)
+    response.status_code = status
+    response.headers["Tus-Resumable"] = TUS_VERSION
+    response.headers["Cache-Control"] = "no-store"
+    for name, value in (headers or {}).items():
+        response.headers[name] = str(value)
+    return response
+
+def get_upload_hasher(upload_id, path, offset):
+    """取出与已写入数据对应的哈希状态；续传请求落到其他 worker 或上次写入中断时，从文件中补算"""
+    with upload_hashers_lock:
+        hashed, hasher, _ = upload_hashers.pop(upload_id, (0, None, 0))
+    if hasher is None or hashed != offset:
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            remaining = offset
+            while remaining:
+                chunk = f.read(min(Const.UPLOAD_READ_SIZE, remaining))
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                remaining -= len(chunk)
+    return hasher
+
+def prune_upload_hashers():
+    """丢弃长时间没有续传的上传的哈希状态"""
+    expire_before = time.time() - Const.UPLOAD_STAGING_EXPIRE
+    with upload_hashers_lock:
+        for upload_id in [k for k, v in upload_hashers.items() if v[2] < expire_before]:
+            del upload_hashers[upload_id]
+
+def claim_staged_uploads(upload_ids):
+    """
+    取出已上传完成的文件并删除上传记录，返回 [(文件名, 暂存路径, sha256)]
+    有不存在或未上传完成的上传时抛出 ValueError，此时不取出任何文件
+    """
+    with state_db(transaction=True) as db:
+        rows = []
+        for upload_id in upload_ids:
+            row = db.execute(
+                "SELECT * FROM staged_uploads WHERE upload_id = ?", (str(upload_id),)
+            ).fetchone()
+            if row is None:
+                raise ValueError(f"上传不存在或已过期: {upload_id}")
+            if row["sha256"] is None:
+                raise ValueError(f"文件尚未上传完成: {row['filename']}")
+            rows.append(row)
+        db.executemany(
+            "DELETE FROM staged_uploads WHERE upload_id = ?",
+            [(row["upload_id"],) for row in rows],
+        )
+    return [
+        (row["filename"], get_staged_upload_path(row["upload_id"]), row["sha256"])
+        for row in rows
+    ]
+
+def clean_expired_uploads(expire_before):
+    """删除长时间没有续传的上传及暂存目录中没有记录的文件"""
+    now = time.time()
+    with state_db(transaction=True) as db:
+        expired = [
+            row["upload_id"]
+            for row in db.execute(
+                "SELECT upload_id FROM staged_uploads WHERE updated_at < ? "
+                "AND (busy_until IS NULL OR busy_until < ?)",
+                (expire_before, now),
+            )
+        ]
+        db.executemany(
+            "DELETE FROM staged_uploads WHERE upload_id = ?", [(i,) for i in expired]
+        )
+        known = {row["upload_id"] for row in db.execute("SELECT upload_id FROM staged_uploads")}
+    for name in os.listdir(STAGING_DIR):
+        path = os.path.join(STAGING_DIR, name)
+        try:
+            if name in known or os.path.getmtime(path) >= expire_before:
+                continue
+            os.remove(path)
+        except OSError:
+            continue
+    if expired:
+        logger.info(f"清理过期的未完成上传: {len(expired)} 个")
+
+@app.route("/uploads", methods=["OPTIONS"])
+def upload_options():
+    return tus_response(
+        headers={
+            "Tus-Version": TUS_VERSION,
+            "Tus-Extension": "creation,termination",
+            "Tus-Max-Size": Const.UPLOAD_MAX_SIZE,
+        }
+    )
+
+# 创建上传
+@app.route("/uploads", methods=["POST"])
+def create_upload():
+    size = request.headers.get("Upload-Length", type=int)
+    if size is None or size < 0:
+        return tus_response({"success": False, "error": "缺少 Upload-Length"}, 400)
+    if size > Const.UPLOAD_MAX_SIZE:
+        return tus_response({"success": False, "error": "文件过大"}, 413)
+    metadata = parse_upload_metadata(request.headers.get("Upload-Metadata"))
+    filename = metadata.get("filename", "")
+    if not filename:
+        return tus_response({"success": False, "error": "缺少文件名"}, 400)
+
+    upload_id = uuid.uuid4().hex
+    open(get_staged_upload_path(upload_id), "wb").close()
+    now = time.time()
+    # 空文件不会有 PATCH 请求，创建时即上传完成
+    digest = hashlib.sha256().hexdigest() if size == 0 else None
+    with state_db() as db:
+        db.execute(
+            "INSERT INTO staged_uploads (upload_id, filename, size, upload_offset, "
+            "sha256, created_at, updated_at) VALUES (?, ?, ?, 0, ?, ?, ?)",
+            (upload_id, filename, size, digest, now, now),
+        )
+    prune_upload_hashers()
+    if digest is None:
+        with upload_hashers_lock:
+            upload_hashers[upload_id] = (0, hashlib.sha256(), now)
+
+    return tus_response(
+        {"success": True, "upload_id": upload_id},
+        201,
+        {
+            "Location": url_for("upload_offset", upload_id=upload_id, _external=True),
+            "Upload-Offset": 0,
+        },
+    )
+
+# 查询已收到的字节数
+@app.route("/uploads/<upload_id>", methods=["HEAD"])
+def upload_offset(upload_id):
+    upload = get_staged_upload(upload_id)
+    if upload is None:
+        return tus_response(status=404)
+    return tus_response(
+        status=200,
+        headers={"Upload-Offset": upload["upload_offset"], "Upload-Length": upload["size"]},
+    )
 
-    logger.info(f"转换任务ID: {task_id}")
+# 从指定偏移量追加数据
+@app.route("/uploads/<upload_id>", methods=["PATCH"])
+def patch_upload(upload_id):
+    if request.mimetype != "application/offset+octet-stream":
+        return tus_response({"success": False, "error": "Content-Type 错误"}, 415)
+    offset = request.headers.get("Upload-Offset", type=int)
+
+    # 占用上传，防止同一上传的多个 PATCH 请求同时写入
+    now = time.time()
+    with state_db(transaction=True) as db:
+        row = db.execute(
+            "SELECT * FROM staged_uploads WHERE upload_id = ?", (upload_id,)
+        ).fetchone()
+        if row is None:
+            return tus_response({"success": False, "error": "上传不存在或已过期"}, 404)
+        if row["upload_offset"] != offset or (row["busy_until"] or 0) > now:
+            return tus_response(
+                {"success": False, "error": "偏移量不一致"},
+                409,
+                {"Upload-Offset": row["upload_offset"]},
+            )
+        db.execute(
+            "UPDATE staged_uploads SET busy_until = ? WHERE upload_id = ?",
+            (now + Const.UPLOAD_PATCH_TIMEOUT, upload_id),
+        )
+
+    size = row["size"]
+    hasher = None
+    written = 0
+    too_large = False
+    # 从占用之后的任何异常都要在 finally 中释放占用，否则该上传在 UPLOAD_PATCH_TIMEOUT 内无法续传
+    try:
+        path = get_staged_upload_path(upload_id)
+        hasher = get_upload_hasher(upload_id, path, offset)
+        with open(path, "r+b") as f:
+            f.seek(offset)
+            while True:
+                remaining = size - offset - written
+                # 多读一个字节用于发现超出 Upload-Length 的数据
+                chunk = request.stream.read(min(Const.UPLOAD_READ_SIZE, remaining + 1))
+                if not chunk:
+                    break
+                if len(chunk) > remaining:
+                    chunk = chunk[:remaining]
+                    too_large = True
+                f.write(chunk)
+                hasher.update(chunk)
+                written += len(chunk)
+                if too_large:
+                    break
+    except ClientDisconnected:
+        # 已收到的部分保留，客户端续传时从新的偏移量开始
+        logger.info(f"上传 {upload_id} 连接中断，已收到 {offset + written}/{size} 字节")
+    finally:
+        new_offset = offset + written
+        digest = None
+        if hasher is not None:
+            digest = hasher.hexdigest() if new_offset == size else None
+            with upload_hashers_lock:
+                if digest is None:
+                    upload_hashers[upload_id] = (new_offset, hasher, time.time())
+        with state_db() as db:
+            db.execute(
+                "UPDATE staged_uploads SET upload_offset = ?, sha256 = ?, updated_at = ?, "
+                "busy_until = NULL WHERE upload_id = ?",
+                (new_offset, digest, time.time(), upload_id),
+            )
+
+    if too_large:
+        return tus_response(
+            {"success": False, "error": "数据超出 Upload-Length"},
+            413,
+            {"Upload-Offset": new_offset},
+        )
+    return tus_response(headers={"Upload-Offset": new_offset})
+
+# 放弃上传
+@app.route("/uploads/<upload_id>", methods=["DELETE"])
+def delete_upload(upload_id):
+    with state_db() as db:
+        cursor = db.execute("DELETE FROM staged_uploads WHERE upload_id = ?", (upload_id,))
+    if cursor.rowcount == 0:
+        return tus_response(status=404)
+    with upload_hashers_lock:
+        upload_hashers.pop(upload_id, None)
+    try:
+        os.remove(get_staged_upload_path(upload_id))
+    except OSError:
+        pass
+    return tus_response()
+
+# ---------------- 后台转换任务 ----------------
+# 上传完成后立即返回任务ID，转换在后台进行，与客户端连接无关；
+# 状态保存在共享数据库中，任一 worker 都能查询，结果在保留期内不会被存储清理删除
+active_conversion_jobs = 0
+active_conversion_jobs_lock = threading.Lock()
+
+def acquire_conversion_slot():
+    """本 worker 同时进行的转换任务数未达上限时占用一个名额"""
+    global active_conversion_jobs
+    with active_conversion_jobs_lock:
+        if active_conversion_jobs >= Const.CONVERT_MAX_JOBS_PER_WORKER:
+            return False
+        active_conversion_jobs += 1
+        return True
+
+def release_conversion_slot():
+    global active_conversion_jobs
+    with active_conversion_jobs_lock:
+        active_conversion_jobs -= 1
+
+def get_conversion_job(job_id):
+    with state_db() as db:
+        row = db.execute(
+            "SELECT * FROM conversion_jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+    if row is None:
+        return None
+    job = dict(row)
+    job["files"] = json.loads(job["files"])
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    # 所属进程已退出的任务不会再有进展
+    if job["state"] == "running" and not psutil.pid_exists(job["worker_pid"]):
+        job["state"] = "failed"
+        job["error"] = "转换进程已退出"
+        update_conversion_job(
+            job_id, state="failed", error=job["error"], finished_at=time.time()
+        )
+    return job
+
+def update_conversion_job(job_id, **fields):
+    columns = ", ".join(f"{name} = ?" for name in fields)
+    with state_db() as db:
+        db.execute(
+            f"UPDATE conversion_jobs SET {columns} WHERE job_id = ?",
+            (*fields.values(), job_id),
+        )
 
-    # 创建临时目录
-    temp_dir = tempfile.mkdtemp(dir=CONVERT_DIR)
-    converted_files = []
+def get_conversion_job_expiry(job):
+    if job["finished_at"] is None:
+        return None
+    return job["finished_at"] + Const.CONVERT_JOB_RETENTION
+
+def run_conversion_job(job_id, task_id, temp_dir, entries, options):
+    """
+    在后台执行一个转换任务
+    entries: [(上传文件名, 原始文件路径, 扩展名, 目标文件路径), ...]，不支持的文件已在提交时剔除
+    """
+    try:
+        convert_entries(job_id, task_id, temp_dir, entries, options)
+    except Exception as e:
+        logger.error(f"转换任务 {job_id} 出错: {str(e)}", exc_info=True)
+        fail_conversion_job(job_id, temp_dir, f"服务器错误: {str(e)}")
+    finally:
+        release_conversion_slot()
+
+def fail_conversion_job(job_id, temp_dir, error):
+    # 失败信息由状态接口返回，尚未完成的文件一并标记为失败
+    job = get_conversion_job(job_id)
+    files = [
+        dict(item, state="failed") if item["state"] in ("queued", "converting") else item
+        for item in job["files"]
+    ]
+    update_conversion_job(
+        job_id, state="failed", error=error, files=json.dumps(files), finished_at=time.time()
+    )
+    shutil.rmtree(temp_dir, ignore_errors=True)
+
+def convert_entries(job_id, task_id, temp_dir, entries, options):
     target_format = options.get("targetFormat", "pdf")
     merge_pdf = options.get("mergePdf", True)
+    job = get_conversion_job(job_id)
+    file_states = job["files"]
 
     # 记录开始时间
     start_time = time.time()
+    update_conversion_job(job_id, started_at=start_time)
 
-    # 发送进度更新
+    # 发送进度更新，同时写入任务状态
     def send_progress(percent, message, eta="--:--"):
+        update_conversion_job(
+            job_id, percent=percent, message=message, eta=eta, files=json.dumps(file_states)
+        )
         socketio.emit(
             "conversion_progress",
-            {"task_id": task_id, "percent": percent, "message": message, "eta": eta},
+            {
+                "task_id": task_id,
+                "job_id": job_id,
+                "percent": percent,
+                "message": message,
+                "eta": eta,
+            },
             namespace="/",
         )
 
-    total_files = len(files)
-    processed_files = 0
+    total_files = len(file_states)
+
+    # 把转换任务并行交给进程池，已有缓存的直接复用
+    tasks = {}
+    results = {}
+    cache_keys = {}
+    cache_hits = 0
+    costs = {}
+    for idx, (filename, original_path, original_ext, target_path) in entries:
+        # 如果是合并PDF，不立即转换，稍后统一处理
+        if merge_pdf and original_ext in IMAGE_EXTENSIONS and target_format == "pdf":
+            results[idx] = [
+                {
+                    "type": "image",
+                    "path": original_path,
+                    "filename": filename,
+                    "target_path": target_path,
+                }
+            ]
+            continue
 
-    # 发送初始进度
-    send_progress(0, "开始转换...")
-    logger.info(f"开始转换 {total_files} 个文件，目标格式: {target_format}")
+        stem = os.path.splitext(os.path.basename(target_path))[0]
+        cache_key = get_conversion_cache_key(
+            [file_states[idx]["sha256"]], original_ext, options, False
+        )
+        cached = conversion_cache_get(cache_key)
+        if cached is not None:
+            results[idx] = restore_cached_outputs(cached, stem, temp_dir)
+            file_states[idx]["state"] = "finished"
+            file_states[idx]["cached"] = True
+            os.remove(original_path)
+            cache_hits += 1
+            continue
+        cache_keys[idx] = (cache_key, stem)
 
-    # 处理每个文件
-    for idx, file in enumerate(files):
-        if file.filename == "":
+        # 只读文件头估算像素数，超出单个文件上限的直接拒绝；读不出来的文件交给转换时报告具体错误
+        try:
+            pixels = estimate_conversion_pixels(
+                original_path, original_ext, target_format, options
+            )
+        except Exception:
+            pixels = 0
+        if pixels > get_pixel_budget():
+            file_states[idx]["state"] = "failed"
+            file_states[idx]["error"] = (
+                f"图像过大（{pixels // 10000} 万像素），超过单个文件的上限 "
+                f"{get_pixel_budget() // 10000} 万像素"
+            )
+            logger.warning(f"拒绝转换 {filename}: {file_states[idx]['error']}")
+            os.remove(original_path)
             continue
+        costs[idx] = pixels
 
-        # 更新进度
-        processed_files += 1
-        progress = int((processed_files / total_files) * 100)
-        logger.info(
-            f"正在处理文件: {file.filename} ({processed_files}/{total_files}) - 进度: {progress}%"
+        tasks[idx] = (
+            convert_file, original_path, original_ext, target_format, target_path, options
         )
 
-        # 计算ETA
+    # 发送初始进度
+    send_progress(0, "开始转换...")
+    logger.info(f"开始转换 {total_files} 个文件，目标格式: {target_format}")
+
+    processed_files = total_files - len(tasks)
+    if cache_hits:
+        logger.info(f"转换缓存命中 {cache_hits} 个文件")
+
+    def estimate_eta(done):
         elapsed = time.time() - start_time
-        time_per_file = elapsed / processed_files if processed_files > 0 else 5
-        remaining_time = time_per_file * (total_files - processed_files)
-        minutes = int(remaining_time // 60)
-        seconds = int(remaining_time % 60)
-        eta = f"{minutes:02d}:{seconds:02d}"
+        remaining_time = elapsed / done * (total_files - done)
+        return f"{int(remaining_time // 60):02d}:{int(remaining_time % 60):02d}"
 
+    # 多页 PDF 每渲染完一页更新进度
+    def on_file_progress(idx, done_pages, total_pages):
+        done = processed_files + done_pages / total_pages
+        filename = file_states[idx]["filename"]
         send_progress(
-            progress,
-            f"正在处理文件: {file.filename} ({processed_files}/{total_files})",
-            eta,
+            int(done / total_files * 100),
+            f"正在转换 {filename}: 第 {done_pages}/{total_pages} 页",
+            estimate_eta(done),
         )
 
-        # 生成唯一文件名
-        original_ext = file.filename.rsplit(".", 1)[1].lower()
-        unique_id = uuid.uuid4().hex
-        original_filename = f"{unique_id}.{original_ext}"
-        original_path = os.path.join(temp_dir, original_filename)
+    # 获得像素预算、提交到进程池时记录等待时间
+    def on_file_admit(idx, waited):
+        file_states[idx]["state"] = "converting"
+        file_states[idx]["admission_wait"] = round(waited, 2)
+        if waited >= Const.CONVERT_PROGRESS_INTERVAL:
+            filename = file_states[idx]["filename"]
+            logger.info(f"{filename} 等待内存预算 {waited:.1f}s 后开始转换")
+            send_progress(
+                int(processed_files / total_files * 100),
+                f"开始转换 {filename}（等待内存预算 {waited:.1f}s）",
+            )
 
-        # 保存原始文件
-        file.save(original_path)
+    # 每个文件转换完成时更新进度
+    def on_file_done(idx, outputs, error):
+        nonlocal processed_files
+        processed_files += 1
+        filename = file_states[idx]["filename"]
+        if error is None:
+            results[idx] = outputs
+            file_states[idx]["state"] = "finished"
+            cache_key, stem = cache_keys[idx]
+            conversion_cache_put(cache_key, outputs, stem)
+        else:
+            logging.error(f"转换文件 {filename} 时出错: {str(error)}")
+            file_states[idx]["state"] = "failed"
+            file_states[idx]["error"] = str(error)
+        # 清理原始文件
+        try:
+            os.remove(tasks[idx][1])
+        except OSError:
+            pass
 
-        # 生成目标文件名
-        target_filename = (
-            f"{file.filename.rsplit('.', 1)[0]}_{unique_id}.{target_format}"
+        progress = int((processed_files / total_files) * 100)
+        eta = estimate_eta(processed_files)
+        logger.info(
+            f"已处理文件: {filename} ({processed_files}/{total_files}) - 进度: {progress}%"
+        )
+        send_progress(
+            progress, f"已处理文件: {filename} ({processed_files}/{total_files})", eta
         )
-        target_path = os.path.join(temp_dir, target_filename)
 
-        # 根据文件类型执行转换
-        success = False
-        file_size = 0
+    run_conversion_tasks(tasks, on_file_done, on_file_progress, costs, on_file_admit)
 
-        try:
-            # PDF转图片
-            if original_ext == "pdf" and target_format in [
-                "png",
-                "jpg",
-                "jpeg",
-                "bmp",
-                "gif",
-                "tiff",
-                "webp",
-            ]:
-                # 更新进度
-                send_progress(progress, f"转换PDF到图片: {file.filename}")
-
-                # PDF转图片 - 转换所有页面
-                images = convert_from_path(original_path)
-
-                # 创建文件夹存放所有页面
-                pdf_pages_dir = os.path.join(temp_dir, f"{uuid.uuid4().hex}_pages")
-                os.makedirs(pdf_pages_dir, exist_ok=True)
-
-                # 保存所有页面
-                for i, image in enumerate(images):
-                    page_filename = f"{os.path.splitext(target_filename)[0]}_page{i+1}.{target_format}"
-                    page_path = os.path.join(pdf_pages_dir, page_filename)
-                    image.save(page_path)
-
-                    converted_files.append(
-                        {
-                            "filename": page_filename,
-                            "file_size": os.path.getsize(page_path),
-                            "path": page_path,
-                        }
-                    )
-
-                success = True
+    # 按上传顺序整理结果
+    converted_files = [item for idx in sorted(results) for item in results[idx]]
 
-            # 图片转PDF
-            elif (
-                original_ext in ["png", "jpg", "jpeg", "bmp", "gif", "tiff", "webp"]
-                and target_format == "pdf"
-            ):
-                # 更新进度
-                send_progress(progress, f"转换图片到PDF: {file.filename}")
-
-                # 如果是合并PDF，不立即转换，稍后统一处理
-                if merge_pdf:
-                    # 只保存图片路径，稍后合并
-                    converted_files.append(
-                        {
-                            "type": "image",
-                            "path": original_path,
-                            "filename": file.filename,
-                            "target_path": target_path,
-                        }
-                    )
-                    success = True
-                else:
-                    # 单个图片转PDF
-                    success = convert_image_to_pdf(
-                        original_path, target_path, int(options.get("imageQuality", 90))
+    # 处理合并PDF的情况
+    merge_indexes = [idx for idx in sorted(results) if results[idx][0].get("type") == "image"]
+    if merge_indexes:
+        # 更新进度
+        for idx in merge_indexes:
+            file_states[idx]["state"] = "converting"
+        send_progress(95, "合并PDF文件中...")
+        logger.info("开始合并PDF文件...")
+
+        # 创建合并后的PDF文件
+        merged_filename = f"merged_{uuid.uuid4().hex}.pdf"
+        merged_path = os.path.join(temp_dir, merged_filename)
+
+        # 获取所有需要合并的图片路径
+        image_paths = [
+            item["path"] for item in converted_files if item.get("type") == "image"
+        ]
+
+        # 相同的图片按相同顺序合并过时直接复用
+        merge_stem = os.path.splitext(merged_filename)[0]
+        merge_cache_key = get_conversion_cache_key(
+            [file_states[idx]["sha256"] for idx in merge_indexes], None, options, True
+        )
+        cached = conversion_cache_get(merge_cache_key)
+        if cached is not None:
+            merged_path = restore_cached_outputs(cached, merge_stem, temp_dir)[0]["path"]
+            logger.info("合并PDF命中转换缓存")
+        else:
+            # 合并时逐张处理图片，按其中最大的一张占用像素预算
+            merge_pixels = 0
+            for path in image_paths:
+                try:
+                    merge_pixels = max(
+                        merge_pixels,
+                        estimate_conversion_pixels(
+                            path, os.path.splitext(path)[1][1:].lower(), "pdf", options
+                        ),
                     )
-                    if success:
-                        file_size = os.path.getsize(target_path)
-                        converted_files.append(
-                            {
-                                "filename": target_filename,
-                                "file_size": file_size,
-                                "path": target_path,
-                            }
-                        )
-
-            # 图片格式转换
-            elif original_ext in [
-                "png",
-                "jpg",
-                "jpeg",
-                "bmp",
-                "gif",
-                "tiff",
-                "webp",
-            ] and target_format in ["png", "jpg", "jpeg", "bmp", "gif", "tiff", "webp"]:
-                # 更新进度
-                send_progress(progress, f"转换图片格式: {file.filename}")
-                logger.info(f"转换图片格式: {file.filename} -> {target_format}")
-
-                # 图片格式转换
-                img = Image.open(original_path)
-
-                # 处理特殊图像模式
-                img = handle_special_image_modes(img)
-
-                # 确保目标格式兼容
-                if target_format in ["jpg", "jpeg"] and img.mode != "RGB":
-                    img = img.convert("RGB")
-
-                # 调整质量
-                quality = int(options.get("imageQuality", 90))
-
-                # 调整大小
-                resize_option = options.get("resizeOption", "original")
-                if resize_option == "hd":
-                    img = img.resize((1920, 1080), Image.Resampling.LANCZOS)
-                elif resize_option == "fullhd":
-                    img = img.resize((2560, 1440), Image.Resampling.LANCZOS)
-
-                # 保存为目标格式
-                if target_format in ["jpg", "jpeg"]:
-                    img.save(target_path, "JPEG", quality=quality)
-                else:
-                    img.save(target_path, format=target_format.upper(), quality=quality)
-
-                file_size = os.path.getsize(target_path)
-                converted_files.append(
-                    {
-                        "filename": target_filename,
-                        "file_size": file_size,
-                        "path": target_path,
-                    }
-                )
-                success = True
-
-            # PDF转PDF（不需要转换）
-            elif original_ext == "pdf" and target_format == "pdf":
-                # 直接复制文件
-                shutil.copy(original_path, target_path)
-                file_size = os.path.getsize(target_path)
-                converted_files.append(
-                    {
-                        "filename": target_filename,
-                        "file_size": file_size,
-                        "path": target_path,
-                    }
+                except Exception:
+                    pass
+            # 合并图片到PDF，一次写入，不生成每页的临时PDF
+            # 超过单个文件上限的图片独占全部预算
+            reservation = None
+            try:
+                reservation, waited = wait_conversion_pixels(
+                    min(merge_pixels, get_pixel_budget())
                 )
-                success = True
-
-            else:
-                success = False
-                logging.warning(
-                    f"不支持从 {original_ext} 到 {target_format} 的转换: {file.filename}"
+                if waited >= Const.CONVERT_PROGRESS_INTERVAL:
+                    logger.info(f"合并PDF等待内存预算 {waited:.1f}s")
+                page_count = run_conversion_task(
+                    images_to_pdf,
+                    image_paths,
+                    merged_path,
+                    int(options.get("imageQuality", 90)),
                 )
+            except Exception as e:
+                logging.error(f"合并PDF时出错: {str(e)}", exc_info=True)
+                fail_conversion_job(job_id, temp_dir, f"合并PDF失败: {str(e)}")
+                return
+            finally:
+                release_conversion_pixels(reservation)
+            if not page_count:
+                logging.error("没有成功转换的图片用于合并PDF")
+                fail_conversion_job(job_id, temp_dir, "合并PDF失败: 没有成功转换的图片")
+                return
+            conversion_cache_put(
+                merge_cache_key, [{"filename": merged_filename, "path": merged_path}], merge_stem
+            )
 
-            # 对于非合并PDF的单个转换，记录成功
-            if not success:
-                logging.error(f"文件转换失败: {file.filename}")
-
-        except Exception as e:
-            logging.error(f"转换文件 {file.filename} 时出错: {str(e)}", exc_info=True)
-            success = False
-
-        finally:
-            # 清理原始文件（除了需要合并的图片）
-            if not (
-                original_ext in ["png", "jpg", "jpeg", "bmp", "gif", "tiff", "webp"]
-                and target_format == "pdf"
-                and merge_pdf
-            ):
-                try:
-                    os.remove(original_path)
-                except:
-                    pass
-
-    # 处理合并PDF的情况
-    if (
-        merge_pdf
-        and target_format == "pdf"
-        and len([f for f in converted_files if f.get("type") == "image"]) > 0
-    ):
-        try:
-            # 更新进度
-            send_progress(95, "合并PDF文件中...")
-            logger.info("开始合并PDF文件...")
-
-            # 创建合并后的PDF文件
-            merged_filename = f"merged_{uuid.uuid4().hex}.pdf"
-            merged_path = os.path.join(temp_dir, merged_filename)
-
-            # 获取所有需要合并的图片路径
-            image_paths = [
-                item["path"] for item in converted_files if item.get("type") == "image"
-            ]
+        for path in image_paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        for idx in merge_indexes:
+            file_states[idx]["state"] = "finished"
 
-            # 合并图片到PDF
-            if image_paths:
-                # 创建一个临时PDF列表
-                temp_pdfs = []
-
-                for img_path in image_paths:
-                    # 为每个图片创建PDF
-                    temp_pdf = f"{img_path}.pdf"
-                    if convert_image_to_pdf(
-                        img_path, temp_pdf, int(options.get("imageQuality", 90))
-                    ):
-                        temp_pdfs.append(temp_pdf)
-
-                # 合并所有PDF
-                if temp_pdfs:
-                    merger = PdfMerger()
-
-                    for pdf_path in temp_pdfs:
-                        merger.append(pdf_path)
-
-                    merger.write(merged_path)
-                    merger.close()
-
-                    # 获取文件大小
-                    file_size = os.path.getsize(merged_path)
-
-                    # 添加到转换结果
-                    converted_files = [
-                        {
-                            "filename": merged_filename,
-                            "file_size": file_size,
-                            "path": merged_path,
-                        }
-                    ]
-
-                    # 清理临时PDF
-                    for pdf_path in temp_pdfs:
-                        try:
-                            os.remove(pdf_path)
-                        except:
-                            pass
-                else:
-                    logging.error("没有成功转换的图片用于合并PDF")
-                    return (
-                        jsonify(
-                            {
-                                "success": False,
-                                "error": "合并PDF失败: 没有成功转换的图片",
-                            }
-                        ),
-                        500,
-                    )
-        except Exception as e:
-            logging.error(f"合并PDF时出错: {str(e)}", exc_info=True)
-            return jsonify({"success": False, "error": f"合并PDF失败: {str(e)}"}), 500
+        # 添加到转换结果
+        converted_files = [
+            {
+                "filename": merged_filename,
+                "file_size": os.path.getsize(merged_path),
+                "path": merged_path,
+            }
+        ]
 
     # 如果没有成功转换的文件
     if len(converted_files) == 0:
-        return jsonify({"success": False, "error": "没有文件成功转换"}), 400
+        fail_conversion_job(job_id, temp_dir, "没有文件成功转换")
+        return
 
-    # 生成下载信息
+    # 生成结果信息，保存相对转换目录的路径，下载地址在查询结果时生成
     result_files = []
     for item in converted_files:
         if "path" in item and os.path.exists(item["path"]):
-            # 生成下载URL
-            download_url = url_for(
-                "download_converted_file",
-                filename=os.path.basename(item["path"]),
-                _external=True,
-            )
+            register_artifact(item["path"], "converted")
             result_files.append(
                 {
                     "filename": item["filename"],
                     "file_size": item.get("file_size", 0),
-                    "download_url": download_url,
+                    "path": os.path.relpath(item["path"], CONVERT_DIR).replace(os.sep, "/"),
                 }
             )
 
-    # 如果有多个文件，创建ZIP文件
-    zip_url = None
-    if len(result_files) > 1 or (len(result_files) == 1 and merge_pdf):
+    # 多个文件时提供打包下载，压缩包在下载时生成
+    zip_result = len(result_files) > 1 or (len(result_files) == 1 and merge_pdf)
+
+    update_conversion_job(
+        job_id,
+        state="finished",
+        result=json.dumps({"files": result_files, "zip": zip_result}),
+        finished_at=time.time(),
+    )
+    send_progress(100, "转换完成!", "00:00")
+    logger.info(f"文件转换完成! 任务ID: {job_id}")
+
+# 文件转换路由：保存上传的文件后立即返回任务ID，转换在后台进行
+@app.route("/convert_files", methods=["POST"])
+def convert_files():
+    # 分块上传完成后以 JSON 提交 {"upload_ids": [...], "options": {...}}；也兼容直接用 multipart 提交文件
+    if request.is_json:
+        data = request.get_json(silent=True) or {}
+        upload_ids = data.get("upload_ids") or []
+        files = []
+        if not isinstance(upload_ids, list) or len(upload_ids) == 0:
+            return jsonify({"success": False, "error": "未选择文件"}), 400
+        options = data.get("options") or {}
+    else:
+        upload_ids = []
+        if "files" not in request.files:
+            return jsonify({"success": False, "error": "未选择文件"}), 400
+
+        files = [file for file in request.files.getlist("files") if file.filename]
+        if len(files) == 0:
+            return jsonify({"success": False, "error": "未选择文件"}), 400
+
+        # 获取转换选项
+        options = request.form.get("options")
         try:
-            # 更新进度
-            send_progress(98, "打包文件中...")
-            logger.info("开始打包转换后的文件...")
+            options = json.loads(options) if options else {}
+        except:
+            options = {}
 
-            # 创建ZIP文件
-            zip_filename = f"converted_files_{uuid.uuid4().hex}.zip"
-            zip_path = os.path.join(CONVERT_DIR, zip_filename)
+    # 获取任务ID（前端用于过滤进度事件）
+    task_id = options.get("task_id", "")
+    target_format = options.get("targetFormat", "pdf")
+
+    # PDF 转图片的页码范围、分辨率和缩放尺寸在提交时检查，避免任务在后台才失败
+    try:
+        get_raster_options(options)
+        get_resize_box(options)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    if not acquire_conversion_slot():
+        response = jsonify(
+            {"success": False, "error": "服务器正忙，当前转换任务过多，请稍后重试"}
+        )
+        response.headers["Retry-After"] = str(Const.CONVERT_BUSY_RETRY_AFTER)
+        return response, 429
 
-            with zipfile.ZipFile(zip_path, "w") as zipf:
-                for file in converted_files:
-                    if "path" in file and os.path.exists(file["path"]):
-                        zipf.write(file["path"], file["filename"])
+    # 取出分块上传的文件：[(文件名, 暂存路径或上传的文件对象, sha256)]
+    try:
+        sources = claim_staged_uploads(upload_ids) if upload_ids else []
+    except ValueError as e:
+        release_conversion_slot()
+        return jsonify({"success": False, "error": str(e)}), 400
+    sources += [(file.filename, file, None) for file in files]
 
-            zip_url = url_for(
-                "download_converted_file", filename=zip_filename, _external=True
+    temp_dir = None
+    try:
+        # 创建临时目录，把所有文件移动（分块上传）或保存（multipart）到其中
+        temp_dir = tempfile.mkdtemp(dir=CONVERT_DIR)
+        entries = []
+        file_states = []
+        for idx, (filename, source, digest) in enumerate(sources):
+            file_states.append({"filename": filename, "state": "queued", "error": None})
+            original_ext = filename.rsplit(".", 1)[1].lower() if "." in filename else ""
+            if not is_supported_conversion(original_ext, target_format):
+                logging.warning(
+                    f"不支持从 {original_ext} 到 {target_format} 的转换: {filename}"
+                )
+                file_states[idx]["state"] = "skipped"
+                file_states[idx]["error"] = f"不支持从 {original_ext} 转换为 {target_format}"
+                if isinstance(source, str):
+                    os.remove(source)
+                continue
+
+            # 生成唯一文件名
+            unique_id = uuid.uuid4().hex
+            original_path = os.path.join(temp_dir, f"{unique_id}.{original_ext}")
+
+            # 保存原始文件，同时记录内容哈希
+            if isinstance(source, str):
+                os.replace(source, original_path)
+            else:
+                digest = save_upload_with_digest(source, original_path)
+            file_states[idx]["sha256"] = digest
+
+            # 生成目标文件名
+            target_filename = f"{filename.rsplit('.', 1)[0]}_{unique_id}.{target_format}"
+            target_path = os.path.join(temp_dir, target_filename)
+            entries.append((idx, (filename, original_path, original_ext, target_path)))
+
+        if not entries:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            release_conversion_slot()
+            return jsonify({"success": False, "error": "没有可转换的文件"}), 400
+
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with state_db(transaction=True) as db:
+            # 顺便清理过期的已结束任务记录，其结果文件此后交由存储清理按访问时间淘汰
+            db.execute(
+                "DELETE FROM conversion_jobs WHERE state IN ('finished', 'failed') "
+                "AND finished_at < ?",
+                (now - Const.CONVERT_JOB_RETENTION,),
             )
-        except Exception as e:
-            logging.error(f"创建ZIP文件时出错: {str(e)}", exc_info=True)
+            db.execute(
+                "INSERT INTO conversion_jobs (job_id, task_id, state, files, output_dir, "
+                "options, worker_pid, created_at) VALUES (?, ?, 'running', ?, ?, ?, ?, ?)",
+                (
+                    job_id,
+                    task_id,
+                    json.dumps(file_states),
+                    get_artifact_key(temp_dir),
+                    json.dumps(options),
+                    os.getpid(),
+                    now,
+                ),
+            )
+    except Exception as e:
+        logger.error(f"提交转换任务失败: {str(e)}", exc_info=True)
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        release_conversion_slot()
+        return jsonify({"success": False, "error": f"服务器错误: {str(e)}"}), 500
+
+    logger.info(f"转换任务ID: {job_id}（前端任务ID: {task_id}），共 {len(entries)} 个文件")
+    socketio.start_background_task(
+        run_conversion_job, job_id, task_id, temp_dir, entries, options
+    )
+    return (
+        jsonify(
+            {
+                "success": True,
+                "job_id": job_id,
+                "state": "running",
+                "status_url": url_for("convert_status", job_id=job_id, _external=True),
+                "result_url": url_for("convert_result", job_id=job_id, _external=True),
+            }
+        ),
+        202,
+    )
+
+# 查询转换任务状态
+@app.route("/convert_status/<job_id>", methods=["GET"])
+def convert_status(job_id):
+    job = get_conversion_job(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "任务不存在"}), 404
+
+    return jsonify(
+        {
+            "success": True,
+            "job_id": job_id,
+            "state": job["state"],
+            "percent": job["percent"],
+            "message": job["message"],
+            "eta": job["eta"],
+            "files": job["files"],
+            "error": job["error"],
+            "expires_at": get_conversion_job_expiry(job),
+        }
+    )
+
+# 获取转换任务结果
+@app.route("/convert_result/<job_id>", methods=["GET"])
+def convert_result(job_id):
+    job = get_conversion_job(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "任务不存在"}), 404
+    if job["state"] == "failed":
+        return jsonify({"success": False, "state": job["state"], "error": job["error"]}), 400
+    if job["state"] != "finished":
+        return (
+            jsonify({"success": False, "state": job["state"], "error": "任务尚未完成"}),
+            409,
+        )
+
+    # 生成下载信息，跳过已被清理的文件
+    result_files = []
+    for item in job["result"]["files"]:
+        if os.path.isfile(os.path.join(CONVERT_DIR, *item["path"].split("/"))):
+            result_files.append(
+                {
+                    "filename": item["filename"],
+                    "file_size": item["file_size"],
+                    "download_url": url_for(
+                        "download_converted_file", filename=item["path"], _external=True
+                    ),
+                }
+            )
+    if not result_files:
+        return jsonify({"success": False, "state": job["state"], "error": "转换结果已过期"}), 410
+    zip_url = None
+    if job["result"]["zip"]:
+        zip_url = url_for("download_conversion_zip", job_id=job_id, _external=True)
 
-    # 返回结果
-    send_progress(100, "转换完成!", "00:00")
-    logger.info("文件转换完成!")
     return jsonify(
         {
             "success": True,
             "files": result_files,
             "zip_url": zip_url,
             "file_count": len(result_files),
+            "expires_at": get_conversion_job_expiry(job),
+        }
+    )
+
+# ---------------- 打包下载 ----------------
+# 打包下载时边压缩边发送，不在磁盘上生成 ZIP：写入不可 seek 的缓冲区时 zipfile 使用数据描述符，
+# 每写入一块就发送给客户端。已压缩的格式直接存储，BMP/TIFF 等未压缩的格式用 deflate 压缩
+ZIP_STORED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".pdf", ".zip"}
+
+class ZipStreamBuffer(io.RawIOBase):
+    """收集 zipfile 写出的数据，由生成器取走后发送"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def generate_zip_stream(files):
+    """files 为 [(压缩包内文件名, 路径)]，逐块生成 ZIP 数据"""
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, "w") as zipf:
+        for name, path in files:
+            stat = os.stat(path)
+            info = zipfile.ZipInfo(name, time.localtime(stat.st_mtime)[:6])
+            if os.path.splitext(name)[1].lower() in ZIP_STORED_EXTENSIONS:
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+            # 预先给出原始大小，zipfile 据此决定该条目是否需要 ZIP64 记录
+            info.file_size = stat.st_size
+            with open(path, "rb") as src, zipf.open(info, "w") as dest:
+                while True:
+                    chunk = src.read(Const.STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    if buffer.chunks:
+                        yield buffer.take()
+            # 关闭条目时写出数据描述符
+            yield buffer.take()
+    # 中央目录在关闭时写出
+    yield buffer.take()
+
+@app.route("/convert_result/<job_id>/zip", methods=["GET"])
+def download_conversion_zip(job_id):
+    job = get_conversion_job(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "任务不存在"}), 404
+    if job["state"] != "finished" or not job["result"]["zip"]:
+        return jsonify({"success": False, "error": "该任务没有可打包的结果"}), 400
+
+    files = []
+    for item in job["result"]["files"]:
+        path = os.path.join(CONVERT_DIR, *item["path"].split("/"))
+        touch_artifact(path)
+        if os.path.isfile(path):
+            files.append((item["filename"], path))
+    if not files:
+        return jsonify({"success": False, "error": "转换结果已过期"}), 410
+
+    response = Response(generate_zip_stream(files), mimetype="application/zip")
+    response.headers["Content-Disposition"] = attachment_disposition("converted_files.zip")
+    response.headers["Cache-Control"] = "no-store"
+    # nginx 等反向代理不要缓冲
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+# ---------------- PDF 预览 ----------------
+# 只以低分辨率渲染前几页，按文件内容的 SHA-256 缓存，同一文件再次预览时不再渲染；
+# 预览图很小，直接在请求中调用 pdftoppm，不在转换进程池中排队。缓存容量由存储清理任务按 PDF_PREVIEW_CACHE_MAX_BYTES 控制
+def get_preview_path(digest, page):
+    return os.path.join(
+        app.config["UPLOAD_FOLDER"],
+        "previews",
+        digest[:2],
+        f"{digest}_{Const.PDF_PREVIEW_SIZE}_{page}.jpg",
+    )
+
+@app.route("/convert_preview", methods=["GET", "POST"])
+def convert_preview():
+    # 优先预览已分块上传完成的文件（upload_id），提交转换时复用同一上传，文件只上传一次；
+    # 也兼容以 multipart 直接提交文件
+    upload_id = request.values.get("upload_id")
+    file = request.files.get("file")
+    if upload_id:
+        upload = get_staged_upload(upload_id)
+        if upload is None:
+            return jsonify({"success": False, "error": "上传不存在或已过期"}), 404
+        if upload["sha256"] is None:
+            return jsonify({"success": False, "error": "文件尚未上传完成"}), 409
+        filename = upload["filename"]
+    elif file is None or file.filename == "":
+        return jsonify({"success": False, "error": "未选择文件"}), 400
+    else:
+        filename = file.filename
+    if not filename.lower().endswith(".pdf"):
+        return jsonify({"success": False, "error": "只支持预览PDF文件"}), 400
+    pages = request.values.get("pages", 1, type=int)
+    pages = min(max(pages, 1), Const.PDF_PREVIEW_MAX_PAGES)
+
+    t_start = time.perf_counter()
+    fd, temp_path = tempfile.mkstemp(suffix=".pdf", dir=STAGING_DIR)
+    os.close(fd)
+    try:
+        if upload_id:
+            # 链接一份再渲染，期间提交转换把暂存文件移走也不受影响
+            os.remove(temp_path)
+            link_or_copy(get_staged_upload_path(upload_id), temp_path)
+            digest = upload["sha256"]
+        else:
+            digest = save_upload_with_digest(file, temp_path)
+        try:
+            page_count = get_pdf_page_count(temp_path)
+        except Exception as e:
+            logger.warning(f"读取PDF页数失败: {str(e)}")
+            return jsonify({"success": False, "error": "无法读取PDF文件"}), 400
+        page_paths = {
+            page: get_preview_path(digest, page)
+            for page in range(1, min(pages, page_count) + 1)
+        }
+        for path in page_paths.values():
+            touch_artifact(path)
+        missing = {page: path for page, path in page_paths.items() if not os.path.isfile(path)}
+        if missing:
+            os.makedirs(os.path.dirname(page_paths[1]), exist_ok=True)
+            render_pdf_preview(
+                temp_path, missing, Const.PDF_PREVIEW_SIZE, Const.PDF_PREVIEW_QUALITY
+            )
+            for path in missing.values():
+                register_artifact(path, "preview")
+    except Exception as e:
+        logger.error(f"生成PDF预览失败: {str(e)}")
+        return jsonify({"success": False, "error": f"生成预览失败: {str(e)}"}), 500
+    finally:
+        # 链接暂存文件失败时临时文件已被删除，不能让清理掩盖原来的错误
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+
+    seconds = time.perf_counter() - t_start
+    logger.info(
+        f"PDF预览: {len(page_paths)}/{page_count} 页，"
+        f"{'缓存命中' if not missing else f'渲染 {len(missing)} 页'}，耗时 {seconds:.2f}s"
+    )
+    previews_root = os.path.join(app.config["UPLOAD_FOLDER"], "previews")
+    return jsonify(
+        {
+            "success": True,
+            "page_count": page_count,
+            "cached": not missing,
+            "pages": [
+                {
+                    "page": page,
+                    "url": url_for(
+                        "convert_preview_image",
+                        filename=os.path.relpath(path, previews_root).replace(os.sep, "/"),
+                    ),
+                }
+                for page, path in page_paths.items()
+            ],
         }
     )
 
+@app.route("/convert_preview/<path:filename>")
+def convert_preview_image(filename):
+    previews_root = os.path.join(app.config["UPLOAD_FOLDER"], "previews")
+    path = safe_join(os.path.abspath(previews_root), filename)
+    if path is None:
+        abort(404)
+    touch_artifact(path)
+    if not os.path.isfile(path):
+        abort(404)
+
+    # 文件名包含内容哈希，内容不会变化
+    response = send_file(
+        path,
+        mimetype="image/jpeg",
+        conditional=True,
+        etag=file_etag(os.stat(path)),
+        max_age=Const.PDF_PREVIEW_BROWSER_MAX_AGE,
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+# 请求体超过 MAX_CONTENT_LENGTH
+@app.errorhandler(RequestEntityTooLarge)
+def request_entity_too_large(e):
+    limit = app.config["MAX_CONTENT_LENGTH"] / 1024 / 1024
+    return (
+        jsonify({"success": False, "error": f"请求过大，单次请求最多 {limit:.0f}MB，大文件请分块上传"}),
+        413,
+    )
+
 # 下载转换后的文件
-@app.route("/download_converted/<filename>")
+@app.route("/download_converted/<path:filename>")
 def download_converted_file(filename):
-    return send_from_directory(CONVERT_DIR, filename, as_attachment=True)
+    return send_upload_file(CONVERT_DIR, filename)
 
 # 文件转换器页面
 @app.route("/file_converter", methods=["GET"])
@@ -966,7 +4042,10 @@ def api_weather():
 
 
 
-initialize()
+# 转换进程池以 spawn 方式启动子进程时，子进程会以 __mp_main__ 的名义重新导入主模块，不需要初始化；
+# 基准测试等只导入模块的场景设置 ZZH_TOOL_SKIP_INIT=1 跳过（不安装依赖、不启动后台任务）
+if __name__ != "__mp_main__" and not os.environ.get("ZZH_TOOL_SKIP_INIT"):
+    initialize()
 if __name__ == "__main__":
     logger.info(f"Running on http://127.0.0.1:{Const.PORT}")
     socketio.run(app, debug=Const.DEBUG, port=Const.PORT)
\ No newline at end of file
@@ -0,0 +1,45 @@
+"""
+基准测试共用：在临时目录中导入 app，不运行 initialize()
+
+上传目录、共享状态数据库和 key.cf 都建在临时目录下，基准测试不会改动工作区，也不会清理 uploads/ 中的数据；
+不自动安装 FFmpeg / Poppler，不预压缩静态文件，不启动存储清理和下载执行器
+"""
+import os
+import platform
+import shutil
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def find_tool(name):
+    """查找项目目录下（FFmpeg/bin、Poppler/Library/bin）或 PATH 中的可执行文件，找不到时返回 None"""
+    exe = f"{name}.exe" if platform.system() == "Windows" else name
+    for directory in (
+        os.path.join(ROOT, "FFmpeg", "bin"),
+        os.path.join(ROOT, "Poppler", "Library", "bin"),
+    ):
+        path = os.path.join(directory, exe)
+        if os.path.isfile(path):
+            return path
+    return shutil.which(name)
+
+def load_app():
+    """
+    切换到新建的临时目录并导入 app，返回 (app 模块, 临时目录)
+    进程结束前工作目录都在临时目录中，调用方在结束时删除该目录
+    """
+    work_dir = tempfile.mkdtemp(prefix="bench_app_")
+    os.environ["ZZH_TOOL_SKIP_INIT"] = "1"
+    os.chdir(work_dir)
+
+    import app
+    from config.const import Const
+
+    app.init_state_db()
+    Const.FFMPEG_PATH = find_tool("ffmpeg")
+    Const.FFPROBE_PATH = find_tool("ffprobe")
+    # pdf2image 从 PATH 中查找 pdftoppm，转换子进程继承同一个 PATH
+    pdftoppm = find_tool("pdftoppm")
+    if pdftoppm:
+        os.environ["PATH"] = os.path.dirname(pdftoppm) + os.pathsep + os.environ["PATH"]
+    return app, work_dir
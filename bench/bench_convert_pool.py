@@ -0,0 +1,96 @@
+"""
+转换进程池基准测试：通过 /convert_files 转换一批 PNG -> JPG，比较不同进程数下的耗时
+
+用法: python bench/bench_convert_pool.py [--files 100] [--workers 1 2 4 8]
+app 在临时目录中导入（见 bench_app.py），不会改动工作区
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_app import load_app
+
+def make_png(size):
+    from PIL import Image
+
+    # 渐变 + 噪声，解码和编码的开销接近真实照片
+    gradient = Image.linear_gradient("L").resize(size).convert("RGB")
+    image = Image.blend(Image.effect_noise(size, 30).convert("RGB"), gradient, 0.6)
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+def wait_for_job(client, job_id):
+    """轮询转换任务直到结束，返回结果"""
+    import app
+
+    while True:
+        status = client.get(f"/convert_status/{job_id}").get_json()
+        if status["state"] != "running":
+            return client.get(f"/convert_result/{job_id}").get_json()
+        # 让出给后台任务（eventlet 下 time.sleep 不会切换）
+        app.socketio.sleep(0.05)
+
+def run_batch(client, data, count):
+    import app
+
+    # 清空转换结果缓存，否则预热之后的同一批文件都会直接命中缓存
+    with app.state_db() as db:
+        db.execute("DELETE FROM conversion_cache")
+    files = [(io.BytesIO(data), f"image_{i:03d}.png") for i in range(count)]
+    options = json.dumps({"targetFormat": "jpg", "mergePdf": False, "imageQuality": 85})
+    t_start = time.perf_counter()
+    response = client.post(
+        "/convert_files",
+        data={"files": files, "options": options},
+        content_type="multipart/form-data",
+    )
+    result = wait_for_job(client, response.get_json()["job_id"])
+    seconds = time.perf_counter() - t_start
+    if not result.get("success") or result["file_count"] != count:
+        raise RuntimeError(f"转换失败: {result}")
+    return seconds
+
+def main():
+    parser = argparse.ArgumentParser(description="转换进程池基准测试")
+    parser.add_argument("--files", type=int, default=100, help="每批文件数")
+    parser.add_argument("--width", type=int, default=2400)
+    parser.add_argument("--height", type=int, default=1800)
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=sorted({1, 2, 4, os.cpu_count() or 1})
+    )
+    args = parser.parse_args()
+
+    app, work_dir = load_app()
+    try:
+        return run_benchmarks(app, args)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def run_benchmarks(app, args):
+    from config.const import Const
+
+    data = make_png((args.width, args.height))
+    client = app.app.test_client()
+    print(f"CPU 核数: {os.cpu_count()}，每批 {args.files} 个 PNG（{len(data) / 1024 / 1024:.1f}MB/个）")
+    print(f"{'进程数':<8}{'耗时(s)':>10}{'文件/秒':>10}{'加速比':>8}")
+    baseline = None
+    for workers in args.workers:
+        Const.CONVERT_POOL_WORKERS = workers
+        if app.conversion_pool is not None:
+            app.reset_conversion_pool(app.conversion_pool)
+        # 预热：启动子进程并导入 converter，不计入耗时
+        run_batch(client, data, workers)
+        seconds = run_batch(client, data, args.files)
+        baseline = baseline or seconds
+        print(f"{workers:<8}{seconds:>10.2f}{args.files / seconds:>10.1f}{baseline / seconds:>7.1f}x")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
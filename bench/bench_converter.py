@@ -0,0 +1,297 @@
+"""
+文件转换器基准测试：在本地生成合成样例，通过 Flask 测试客户端走完整的 /convert_files 流程
+（提交、后台转换、查询结果），统计各条路径的 文件/秒、MB/秒、p50/p95 延迟和峰值内存，结果保存为 JSON
+
+路径:
+  image_to_pdf[模式]  单张图片转 PDF，覆盖 handle_special_image_modes 处理的各种图像模式
+  format[模式]        图片格式转换（转 JPG）
+  merged_pdf          多张图片合并为一个 PDF
+  pdf_to_png          多页 PDF 逐页转 PNG
+  mixed               图片和 PDF 混合的一批文件
+
+用法: python bench/bench_converter.py [--repeat 10] [--output result.json] [--compare old.json]
+app 在临时目录中导入（见 bench_app.py），不会改动工作区；PDF 路径需要已安装 Poppler，测量期间不使用转换结果缓存
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import PIL
+import psutil
+from PIL import Image
+
+from bench_app import ROOT, load_app
+
+# 图像模式 -> 样例文件格式（选能原样保存该模式的格式）
+IMAGE_MODES = {
+    "RGB": "jpg",
+    "L": "png",
+    "RGBA": "png",
+    "LA": "png",
+    "PA": "tiff",
+    "P": "png",
+    "CMYK": "jpg",
+    "1": "png",
+    "I": "tiff",
+    "F": "tiff",
+}
+SAVE_FORMATS = {"jpg": "JPEG", "png": "PNG", "tiff": "TIFF"}
+
+# ---------------- 样例生成 ----------------
+def make_base_image(size, seed):
+    """渐变 + 噪声 + 半透明通道，解码和编码的开销接近真实照片"""
+    gradient = Image.linear_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 20 + seed)
+    image = Image.merge("RGB", (gradient, noise, gradient.rotate(90).resize(size)))
+    alpha = Image.radial_gradient("L").resize(size)
+    return image, alpha
+
+def make_image(mode, size, seed):
+    """生成指定模式的图片文件内容，返回 (扩展名, 数据)"""
+    image, alpha = make_base_image(size, seed)
+    if mode in ("RGBA", "LA", "PA"):
+        image = image.convert("RGBA")
+        image.putalpha(alpha)
+        if mode == "PA":
+            image = image.convert("P").convert("PA")
+            image.putalpha(alpha)
+    if mode == "I":
+        image = image.convert("L").point(lambda value: value * 256).convert("I")
+    elif mode == "F":
+        image = image.convert("L").convert("F")
+    elif mode != image.mode:
+        image = image.convert(mode)
+
+    ext = IMAGE_MODES[mode]
+    buffer = io.BytesIO()
+    image.save(buffer, SAVE_FORMATS[ext])
+    return ext, buffer.getvalue()
+
+def make_pdf(pages, size, seed):
+    """生成多页 PDF，每页一张 150 DPI 的图片"""
+    images = [make_base_image(size, seed + page)[0] for page in range(pages)]
+    buffer = io.BytesIO()
+    images[0].save(buffer, "PDF", save_all=True, append_images=images[1:], resolution=150)
+    return buffer.getvalue()
+
+def build_corpora(args):
+    """返回 {路径名: (文件列表 [(文件名, 数据)], 转换选项)}"""
+    size = (args.width, args.height)
+    corpora = {}
+    for mode in IMAGE_MODES:
+        files = []
+        for i in range(args.files):
+            ext, data = make_image(mode, size, i)
+            files.append((f"{mode}_{i}.{ext}", data))
+        corpora[f"image_to_pdf[{mode}]"] = (
+            files,
+            {"targetFormat": "pdf", "mergePdf": False, "imageQuality": 85},
+        )
+        corpora[f"format[{mode}]"] = (
+            files,
+            {"targetFormat": "jpg", "mergePdf": False, "imageQuality": 85},
+        )
+
+    photos = [
+        (f"photo_{i}.jpg", make_image("RGB", size, i)[1]) for i in range(args.files * 2)
+    ]
+    corpora["merged_pdf"] = (
+        photos,
+        {"targetFormat": "pdf", "mergePdf": True, "imageQuality": 85},
+    )
+
+    pdfs = [
+        (f"document_{i}.pdf", make_pdf(args.pages, size, i)) for i in range(args.files)
+    ]
+    corpora["pdf_to_png"] = (
+        pdfs,
+        {"targetFormat": "png", "mergePdf": False, "dpi": args.dpi},
+    )
+
+    # 各种模式的图片与 PDF 混在一批中
+    mixed = [files[0] for name, (files, _) in corpora.items() if name.startswith("format[")]
+    mixed += pdfs[:1] + photos[:2]
+    corpora["mixed"] = (
+        mixed,
+        {"targetFormat": "png", "mergePdf": False, "dpi": args.dpi},
+    )
+    return corpora
+
+# ---------------- 测量 ----------------
+def get_rss():
+    """本进程与转换子进程的常驻内存之和（字节）"""
+    process = psutil.Process()
+    total = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            total += child.memory_info().rss
+        except psutil.Error:
+            pass
+    return total
+
+def run_request(client, files, options, peak):
+    """提交一批文件并等待转换完成，返回耗时（秒）；peak 记录期间的最大内存"""
+    import app
+
+    # 清空转换结果缓存，每次都测量真实的转换
+    with app.state_db() as db:
+        db.execute("DELETE FROM conversion_cache")
+
+    t_start = time.perf_counter()
+    response = client.post(
+        "/convert_files",
+        data={
+            "files": [(io.BytesIO(data), filename) for filename, data in files],
+            "options": json.dumps(options),
+        },
+        content_type="multipart/form-data",
+    )
+    body = response.get_json()
+    if response.status_code != 202:
+        raise RuntimeError(f"提交失败: {body}")
+    job_id = body["job_id"]
+    while True:
+        peak[0] = max(peak[0], get_rss())
+        status = client.get(f"/convert_status/{job_id}").get_json()
+        if status["state"] != "running":
+            break
+        # 让出给后台任务（eventlet 下 time.sleep 不会切换）
+        app.socketio.sleep(0.01)
+    seconds = time.perf_counter() - t_start
+
+    failed = [item for item in status["files"] if item["state"] != "finished"]
+    if status["state"] != "finished" or failed:
+        raise RuntimeError(f"转换失败: {status['error'] or failed}")
+    return seconds
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+def measure(client, files, options, repeat):
+    peak = [get_rss()]
+    latencies = [run_request(client, files, options, peak) for _ in range(repeat)]
+    total_seconds = sum(latencies)
+    total_bytes = sum(len(data) for _, data in files) * repeat
+    return {
+        "requests": repeat,
+        "files_per_request": len(files),
+        "files_per_sec": round(len(files) * repeat / total_seconds, 3),
+        "mb_per_sec": round(total_bytes / 1024 / 1024 / total_seconds, 3),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "peak_rss_mb": round(peak[0] / 1024 / 1024, 1),
+    }
+
+def get_git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=ROOT,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# ---------------- 输出 ----------------
+def print_results(results, baseline=None):
+    header = f"{'路径':<22}{'文件/秒':>10}{'MB/秒':>10}{'p50(ms)':>10}{'p95(ms)':>10}{'峰值内存(MB)':>14}"
+    if baseline:
+        header += f"{'p50 变化':>10}"
+    print(header)
+    for name, row in results.items():
+        line = (
+            f"{name:<22}{row['files_per_sec']:>10.2f}{row['mb_per_sec']:>10.2f}"
+            f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['peak_rss_mb']:>14.1f}"
+        )
+        old = (baseline or {}).get(name)
+        if old:
+            line += f"{(row['p50_ms'] / old['p50_ms'] - 1) * 100:>+9.1f}%"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="文件转换器基准测试")
+    parser.add_argument("--repeat", type=int, default=10, help="每条路径提交的请求数")
+    parser.add_argument("--files", type=int, default=4, help="每个请求中每种样例的文件数")
+    parser.add_argument("--width", type=int, default=1600)
+    parser.add_argument("--height", type=int, default=1200)
+    parser.add_argument("--pages", type=int, default=8, help="样例 PDF 的页数")
+    parser.add_argument("--dpi", type=int, default=150, help="PDF 转 PNG 的分辨率")
+    parser.add_argument("--paths", nargs="+", help="只运行名称以这些前缀开头的路径")
+    parser.add_argument("--output", help="结果 JSON 文件，默认 bench_converter_<时间>.json")
+    parser.add_argument("--compare", help="与之前保存的结果 JSON 比较 p50 延迟")
+    args = parser.parse_args()
+    # 导入 app 后工作目录切换到临时目录，相对路径先按当前目录解析
+    output = os.path.abspath(
+        args.output or f"bench_converter_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    compare = os.path.abspath(args.compare) if args.compare else None
+
+    app, work_dir = load_app()
+    try:
+        return run_benchmarks(app, args, output, compare)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def run_benchmarks(app, args, output, compare):
+    from config.const import Const
+
+    corpora = build_corpora(args)
+    if args.paths:
+        corpora = {
+            name: corpus
+            for name, corpus in corpora.items()
+            if name.startswith(tuple(args.paths))
+        }
+    client = app.app.test_client()
+    # 预热：启动转换进程池，不计入结果
+    warmup_files, warmup_options = corpora.get("format[RGB]") or next(iter(corpora.values()))
+    run_request(client, warmup_files[:1], warmup_options, [0])
+
+    results = {}
+    for name, (files, options) in corpora.items():
+        results[name] = measure(client, files, options, args.repeat)
+        print(f"{name} 完成", file=sys.stderr)
+
+    report = {
+        "version": Const.VERSION,
+        "commit": get_git_commit(),
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "pool_workers": Const.CONVERT_POOL_WORKERS or os.cpu_count(),
+        },
+        "parameters": {
+            key: getattr(args, key)
+            for key in ("repeat", "files", "width", "height", "pages", "dpi")
+        },
+        "results": results,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    baseline = None
+    if compare:
+        with open(compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+    print(f"结果已保存到 {output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
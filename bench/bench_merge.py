@@ -0,0 +1,79 @@
+"""
+视频封装基准测试：比较 remux（只复制流）与 transcode（重新编码）两条路径
+
+用法: python bench/bench_merge.py [--duration 30] [--repeat 3]
+需要已安装 FFmpeg / FFprobe；app 在临时目录中导入（见 bench_app.py），不会改动工作区
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_app import load_app
+from config.const import Const
+
+# 样例文件: 文件名 -> (视频编码参数, 音频编码参数)
+SAMPLES = {
+    "h264_aac.mkv": (["-c:v", "libx264", "-preset", "veryfast"], ["-c:a", "aac"]),
+    "vp9_opus.webm": (["-c:v", "libvpx-vp9", "-deadline", "realtime", "-cpu-used", "8"], ["-c:a", "libopus"]),
+    "vp8_vorbis.webm": (["-c:v", "libvpx", "-deadline", "realtime", "-cpu-used", "8"], ["-c:a", "libvorbis"]),
+}
+
+def make_sample(path, video_args, audio_args, duration):
+    subprocess.run(
+        [
+            Const.FFMPEG_PATH, "-y", "-v", "error",
+            "-f", "lavfi", "-i", f"testsrc2=size=1280x720:rate=30:duration={duration}",
+            "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+            *video_args, *audio_args,
+            path,
+        ],
+        check=True,
+    )
+
+def run_once(app, sample_path, work_dir, force_transcode):
+    # merge_to_mp4 会替换输入文件，每次都在副本上运行
+    copy_path = os.path.join(work_dir, "input" + os.path.splitext(sample_path)[1])
+    shutil.copy(sample_path, copy_path)
+    output_path, strategy, seconds = app.merge_to_mp4(copy_path, work_dir, force_transcode)
+    os.remove(output_path)
+    return strategy, seconds
+
+def main():
+    parser = argparse.ArgumentParser(description="MP4 封装路径基准测试")
+    parser.add_argument("--duration", type=int, default=30, help="样例视频时长（秒）")
+    parser.add_argument("--repeat", type=int, default=3, help="每条路径重复次数")
+    args = parser.parse_args()
+
+    app, sample_dir = load_app()
+    try:
+        if not Const.FFMPEG_PATH or not Const.FFPROBE_PATH:
+            print("未找到 FFmpeg / FFprobe")
+            return 1
+
+        print(f"{'样例':<18}{'自动选择':<12}{'耗时(s)':>10}{'强制转码(s)':>12}{'加速比':>8}")
+        for name, (video_args, audio_args) in SAMPLES.items():
+            sample_path = os.path.join(sample_dir, name)
+            make_sample(sample_path, video_args, audio_args, args.duration)
+            work_dir = os.path.join(sample_dir, "work")
+            os.makedirs(work_dir, exist_ok=True)
+
+            auto = [run_once(app, sample_path, work_dir, False) for _ in range(args.repeat)]
+            forced = [run_once(app, sample_path, work_dir, True) for _ in range(args.repeat)]
+            auto_time = statistics.median(r[1] for r in auto)
+            forced_time = statistics.median(r[1] for r in forced)
+            print(
+                f"{name:<18}{auto[0][0]:<12}{auto_time:>10.2f}{forced_time:>12.2f}"
+                f"{forced_time / auto_time:>7.1f}x"
+            )
+    finally:
+        shutil.rmtree(sample_dir, ignore_errors=True)
+    print("强制转码即改动前 FFmpegVideoConvertor 的行为")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
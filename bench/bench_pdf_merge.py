@@ -0,0 +1,151 @@
+"""
+图片合并 PDF 基准测试：比较改动前的逐页路径（临时 JPEG -> 每页 PDF -> PdfMerger）
+与单次写入路径（images_to_pdf，兼容图片原样嵌入）的吞吐量和峰值内存
+
+用法: python bench/bench_pdf_merge.py [--pages 200] [--width 2400] [--height 1800]
+需要在项目根目录运行；每条路径在独立子进程中执行，以便分别统计峰值内存
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 样例集: 名称 -> (保存格式, 图像模式)
+CORPORA = {
+    "jpeg": ("JPEG", "RGB"),
+    "png": ("PNG", "RGB"),
+    "png_alpha": ("PNG", "RGBA"),
+    "webp": ("WEBP", "RGB"),
+}
+
+def make_corpus(directory, name, pages, size):
+    from PIL import Image, ImageDraw
+
+    fmt, mode = CORPORA[name]
+    if fmt == "PNG":
+        # PNG 多为截图类内容：纯色背景上的色块和文字
+        base = Image.new(mode, size, "white")
+        draw = ImageDraw.Draw(base)
+        for y in range(0, size[1], 120):
+            draw.rectangle((60, y + 20, size[0] - 60, y + 50), fill=(70, 120, 200))
+            for x in range(60, size[0] - 400, 400):
+                draw.text((x, y + 70), "lorem ipsum dolor sit amet", fill="black")
+    else:
+        # 照片类内容：渐变 + 噪声，压缩后的大小接近真实照片
+        gradient = Image.linear_gradient("L").resize(size).convert(mode)
+        base = Image.blend(Image.effect_noise(size, 40).convert(mode), gradient, 0.6)
+    paths = []
+    for i in range(pages):
+        image = base.copy()
+        ImageDraw.Draw(image).text((40, 40), f"page {i + 1}", fill="black")
+        path = os.path.join(directory, f"{i:04d}.{fmt.lower()}")
+        image.save(path, fmt, quality=90)
+        paths.append(path)
+    return paths
+
+def legacy_merge(image_paths, output_path, quality):
+    """改动前 convert_files() 的合并流程"""
+    import img2pdf
+    from PIL import Image
+    from PyPDF2 import PdfMerger
+    from converter import handle_special_image_modes
+
+    temp_pdfs = []
+    for image_path in image_paths:
+        img = handle_special_image_modes(Image.open(image_path))
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        temp_jpg = f"{image_path}.jpg"
+        img.save(temp_jpg, "JPEG", quality=quality)
+        with open(f"{image_path}.pdf", "wb") as f:
+            f.write(img2pdf.convert(temp_jpg))
+        os.remove(temp_jpg)
+        temp_pdfs.append(f"{image_path}.pdf")
+    merger = PdfMerger()
+    for pdf_path in temp_pdfs:
+        merger.append(pdf_path)
+    merger.write(output_path)
+    merger.close()
+    for pdf_path in temp_pdfs:
+        os.remove(pdf_path)
+    return len(temp_pdfs)
+
+def run_variant(variant, image_paths, output_path):
+    """在子进程中执行一条路径，返回耗时和内存"""
+    from converter import images_to_pdf
+
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t_start = time.perf_counter()
+    if variant == "legacy":
+        pages = legacy_merge(image_paths, output_path, 90)
+    else:
+        pages = images_to_pdf(image_paths, output_path, 90)
+    seconds = time.perf_counter() - t_start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "pages": pages,
+        "seconds": seconds,
+        "baseline_mb": baseline / 1024,
+        "peak_mb": peak / 1024,
+        "output_mb": os.path.getsize(output_path) / 1024 / 1024,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="图片合并 PDF 基准测试")
+    parser.add_argument("--pages", type=int, default=200, help="每个样例集的页数")
+    parser.add_argument("--width", type=int, default=2400)
+    parser.add_argument("--height", type=int, default=1800)
+    parser.add_argument("--corpus", choices=list(CORPORA), action="append", help="只测试指定样例集")
+    parser.add_argument("--variant", help=argparse.SUPPRESS)
+    parser.add_argument("--files", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        with open(args.files) as f:
+            image_paths = json.load(f)
+        output_path = os.path.join(os.path.dirname(args.files), f"{args.variant}.pdf")
+        print(json.dumps(run_variant(args.variant, image_paths, output_path)))
+        return 0
+
+    work_dir = tempfile.mkdtemp(prefix="bench_pdf_merge_")
+    try:
+        print(
+            f"{'样例集':<11}{'路径':<8}{'耗时(s)':>9}{'页/秒':>8}{'输入MB/s':>10}"
+            f"{'峰值内存(MB)':>14}{'增量(MB)':>10}{'输出(MB)':>10}"
+        )
+        for name in args.corpus or CORPORA:
+            corpus_dir = os.path.join(work_dir, name)
+            os.makedirs(corpus_dir)
+            image_paths = make_corpus(corpus_dir, name, args.pages, (args.width, args.height))
+            input_mb = sum(os.path.getsize(p) for p in image_paths) / 1024 / 1024
+            files_json = os.path.join(corpus_dir, "files.json")
+            with open(files_json, "w") as f:
+                json.dump(image_paths, f)
+
+            for variant in ("legacy", "single"):
+                result = subprocess.run(
+                    [sys.executable, __file__, "--variant", variant, "--files", files_json],
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                )
+                r = json.loads(result.stdout.strip().splitlines()[-1])
+                print(
+                    f"{name:<11}{variant:<8}{r['seconds']:>9.2f}{r['pages'] / r['seconds']:>8.1f}"
+                    f"{input_mb / r['seconds']:>10.1f}{r['peak_mb']:>14.0f}"
+                    f"{r['peak_mb'] - r['baseline_mb']:>10.0f}{r['output_mb']:>10.1f}"
+                )
+            print(f"{'':<11}输入 {args.pages} 页共 {input_mb:.1f}MB")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
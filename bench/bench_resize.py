@@ -0,0 +1,86 @@
+"""
+图片缩放基准测试：比较改动前的整图解码 + LANCZOS 缩放与现在的 convert_file 缩放路径
+
+用法: python bench/bench_resize.py [--width 6000] [--height 4000] [--repeat 3]
+默认样例为 2400 万像素（6000x4000）的 JPEG 和 PNG
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from converter import RESIZE_PRESETS, convert_file, handle_special_image_modes
+
+def make_sample(path, width, height):
+    # 渐变加噪声，接近照片的压缩率
+    img = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    noise = Image.effect_noise((width // 4, height // 4), 60).resize((width, height))
+    img = Image.merge("RGB", (img.getchannel(0), noise, img.getchannel(2)))
+    draw = ImageDraw.Draw(img)
+    for i in range(0, width, width // 12):
+        draw.ellipse((i, height // 4, i + width // 10, height // 2), fill=(i % 255, 80, 160))
+    img = img.filter(ImageFilter.GaussianBlur(1))
+    if path.endswith(".png"):
+        img.save(path, "PNG", compress_level=1)
+    else:
+        img.save(path, "JPEG", quality=92)
+
+def legacy_resize(input_path, output_path, size, quality):
+    """改动前的实现：完整解码，转换模式后直接拉伸到固定尺寸"""
+    img = Image.open(input_path)
+    img = handle_special_image_modes(img)
+    img = img.resize(size, Image.Resampling.LANCZOS)
+    img.save(output_path, "JPEG", quality=quality)
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="图片缩放路径基准测试")
+    parser.add_argument("--width", type=int, default=6000, help="样例宽度")
+    parser.add_argument("--height", type=int, default=4000, help="样例高度")
+    parser.add_argument("--repeat", type=int, default=3, help="每条路径重复次数")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_resize_")
+    try:
+        print(f"{'样例':<12}{'缩放':<10}{'改动前(s)':>10}{'现在(s)':>10}{'加速比':>8}{'输出尺寸':>14}")
+        for name in ("photo.jpg", "photo.png"):
+            sample_path = os.path.join(work_dir, name)
+            make_sample(sample_path, args.width, args.height)
+            output_path = os.path.join(work_dir, "output.jpg")
+            ext = name.rsplit(".", 1)[1]
+            for option, size in RESIZE_PRESETS.items():
+                options = {"resizeOption": option, "imageQuality": 90}
+                legacy = [
+                    timed(legacy_resize, sample_path, output_path, size, 90)
+                    for _ in range(args.repeat)
+                ]
+                current = [
+                    timed(convert_file, sample_path, ext, "jpg", output_path, options)
+                    for _ in range(args.repeat)
+                ]
+                with Image.open(output_path) as img:
+                    output_size = f"{img.width}x{img.height}"
+                legacy_time = statistics.median(legacy)
+                current_time = statistics.median(current)
+                print(
+                    f"{name:<12}{option:<10}{legacy_time:>10.3f}{current_time:>10.3f}"
+                    f"{legacy_time / current_time:>7.1f}x{output_size:>14}"
+                )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print("改动前的输出固定为预设尺寸，不保持宽高比")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,6 +10,106 @@ class Const:
     
     FFMPEG_PATH, FFPROBE_PATH = None, None
 
+    # 共享状态数据库（多个 gunicorn worker 共用，存放解析缓存等）
+    STATE_DB_PATH = "uploads/zzh_tool.db"
+    STATE_DB_TIMEOUT = 10  # 等待数据库锁的秒数
+
+    # 视频解析缓存
+    PARSE_CACHE_TTL = 30 * 60  # 缓存有效期（秒）
+    PARSE_CACHE_MAX_BYTES = 32 * 1024 * 1024  # 缓存总大小上限，超出后按 LRU 淘汰
+
+    # 批量解析
+    BATCH_PARSE_CONCURRENCY = 8  # 同时进行的解析数
+    BATCH_PARSE_MAX_ITEMS = 200  # 一次最多解析的链接数（播放列表同样适用）
+
+    # 视频下载任务队列
+    DOWNLOAD_MAX_CONCURRENT = 3  # 全局（所有 worker 合计）同时下载的任务数
+    DOWNLOAD_EXECUTORS_PER_WORKER = 2  # 每个 worker 进程中的下载执行器数量
+    DOWNLOAD_QUEUE_POLL_INTERVAL = 1.0  # 执行器轮询排队任务的间隔（秒）
+    DOWNLOAD_STATUS_SAVE_INTERVAL = 1.0  # 下载进度写入数据库的最小间隔（秒）
+    DOWNLOAD_JOB_RETENTION = 24 * 60 * 60  # 已结束任务记录的保留时间（秒）
+    DOWNLOAD_PROGRESS_MAX_HZ = 4  # 每个任务每秒最多推送的进度事件数
+    DOWNLOAD_CANCEL_POLL_INTERVAL = 0.5  # 检查跨 worker 取消请求的间隔（秒）
+    MERGE_TRANSCODE_PRESET = "veryfast"  # 编码不兼容 MP4 时转码使用的 x264 预设
+    MERGE_TRANSCODE_CRF = 23
+    DOWNLOAD_SOCKET_TIMEOUT = 15  # 网络读取超时（秒），也是下载卡住时取消生效的最长等待
+    DOWNLOAD_FRAGMENT_CONCURRENCY = 4  # 每个任务并发下载的 DASH/HLS 分片数
+    DOWNLOAD_BANDWIDTH_LIMIT = 0  # 所有 worker 合计的下载带宽预算（字节/秒），在全部活动任务间平均分配；0 表示不限速
+
+    # 边下边传（不落盘）
+    STREAM_MAX_CONCURRENT = 4  # 每个 worker 同时进行的边下边传数量
+    STREAM_CHUNK_SIZE = 64 * 1024  # 每次向客户端发送的最大字节数
+
+    # 下载文件的发送方式: "direct"（Flask 发送）/ "x-accel"（nginx）/ "x-sendfile"（Apache 等）
+    FILE_SERVE_MODE = "direct"
+    X_ACCEL_PREFIX = "/_uploads/"  # x-accel 模式下 nginx 中映射到 uploads/ 的 internal location
+
+    # 文件转换
+    CONVERT_POOL_WORKERS = None  # 每个 worker 进程的转换进程数，None 表示 CPU 核数
+    CONVERT_POOL_MAX_TASKS_PER_CHILD = 100  # 转换子进程处理多少个任务后重启，避免内存持续增长
+    CONVERT_MAX_JOBS_PER_WORKER = 2  # 每个 worker 进程同时进行的转换任务数，超出时返回 429
+    CONVERT_BUSY_RETRY_AFTER = 5  # 转换任务已满时建议客户端重试的等待时间（秒）
+    CONVERT_JOB_RETENTION = 24 * 60 * 60  # 转换结果的保留时间（秒），期间不会被存储清理删除
+    CONVERT_WORKER_PIXEL_BUDGET = 256 * 1000 * 1000  # 每个 worker 同时转换的图像像素总数上限（RGB 约 768MB）
+    CONVERT_GLOBAL_PIXEL_BUDGET = 768 * 1000 * 1000  # 所有 worker 合计的像素上限，单个文件超过两者中较小的一个时拒绝
+    CONVERT_ADMISSION_TIMEOUT = 10 * 60  # 等待像素预算的最长时间（秒），超时后该文件转换失败
+    CONVERT_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 转换结果缓存容量上限，超出后按最近最少访问淘汰
+    CONVERT_PROGRESS_INTERVAL = 0.5  # 转发转换子进程上报进度的间隔（秒）
+    PDF_RASTER_DPI = 200  # PDF 转图片的默认分辨率
+    PDF_RASTER_THREADS = 4  # 每个 PDF 同时运行的 pdftoppm 进程数
+    PDF_RASTER_CHUNK_PAGES = 10  # 每批渲染的页数，每批完成后移入输出目录并上报进度
+    PDF_RASTER_MAX_MEMORY = 512 * 1024 * 1024  # 每个 PDF 渲染时位图占用的内存上限（字节），超出时减少并行数或降低 DPI
+    PDF_RASTER_MIN_DPI = 36  # 转换选项中 DPI 的允许范围
+    PDF_RASTER_MAX_DPI = 600
+    PDF_RASTER_MIN_DIMENSION = 64  # 转换选项中最大边长（像素）的下限
+    RESIZE_REDUCING_GAP = 1.5  # 缩放时先按整数倍缩小，只对剩下不超过该倍数的部分做 LANCZOS 插值；越大质量越好、越慢
+    RESIZE_MAX_DIMENSION = 16384  # 自定义缩放尺寸的上限（像素）
+    PDF_PREVIEW_SIZE = 320  # 预览图的最大边长（像素）
+    PDF_PREVIEW_MAX_PAGES = 10  # 一次最多预览的页数
+    PDF_PREVIEW_QUALITY = 70  # 预览图的 JPEG 质量
+    PDF_PREVIEW_CACHE_MAX_BYTES = 256 * 1024 * 1024  # 预览图缓存容量上限，超出后按最近最少访问淘汰
+    PDF_PREVIEW_BROWSER_MAX_AGE = 30 * 24 * 60 * 60  # 预览图的浏览器缓存时间（秒）
+
+    # 上传
+    MAX_CONTENT_LENGTH = 1024 * 1024 * 1024  # 单个请求体的最大字节数（multipart 提交或一次 PATCH）
+    UPLOAD_MAX_SIZE = 4 * 1024 * 1024 * 1024  # 分块上传单个文件的最大字节数
+    UPLOAD_READ_SIZE = 1024 * 1024  # 接收上传数据时每次读取的字节数
+    UPLOAD_PATCH_TIMEOUT = 10 * 60  # 一次 PATCH 请求占用上传的最长时间（秒），超时后允许其他请求续传
+    UPLOAD_STAGING_EXPIRE = 24 * 60 * 60  # 未完成的上传超过该时间没有续传则删除（秒）
+
+    # 响应压缩
+    COMPRESS_MIN_SIZE = 1024  # 小于该字节数的响应不压缩
+    COMPRESS_MIMETYPES = (
+        "application/json",
+        "text/html",
+        "text/css",
+        "text/plain",
+        "text/javascript",
+        "application/javascript",
+        "image/svg+xml",
+    )
+    COMPRESS_BROTLI_QUALITY = 5  # 动态响应的 Brotli 压缩等级（0-11），兼顾速度与压缩率
+    COMPRESS_GZIP_LEVEL = 6  # 动态响应的 gzip 压缩等级（1-9）
+    STATIC_PRECOMPRESS_EXTENSIONS = (".js", ".css", ".svg", ".html", ".json", ".txt")  # 启动时预压缩的静态文件类型
+
+    # 视频缩略图代理
+    THUMBNAIL_WIDTHS = (320, 640)  # 缓存的 WebP 宽度，请求时取不小于所需宽度的最小一档
+    THUMBNAIL_WEBP_QUALITY = 80
+    THUMBNAIL_CACHE_MAX_BYTES = 256 * 1024 * 1024  # 缩略图缓存容量上限，超出后按最近最少访问淘汰
+    THUMBNAIL_FETCH_TIMEOUT = 10  # 拉取原始缩略图的超时（秒）
+    THUMBNAIL_FETCH_MAX_BYTES = 10 * 1024 * 1024  # 原始缩略图的最大字节数
+    THUMBNAIL_RETRY_AFTER = 5 * 60  # 拉取失败后在该时间内不再重试（秒）
+    THUMBNAIL_BROWSER_MAX_AGE = 30 * 24 * 60 * 60  # 浏览器缓存时间（秒）
+
+    # 存储管理（uploads/videos 与 uploads/converted）
+    STORAGE_QUOTA_BYTES = 20 * 1024 * 1024 * 1024  # 产物总大小上限，超出后按最近最少访问淘汰
+    STORAGE_MAX_AGE = 7 * 24 * 60 * 60  # 超过该时间未被访问的产物直接删除（秒）
+    STORAGE_ACCESS_GRACE = 60 * 60  # 刚生成或刚被访问的产物在该时间内不会被淘汰（秒）
+    STORAGE_SWEEP_INTERVAL = 10 * 60  # 清理任务的执行间隔（秒）
+
+    # Socket.IO 消息队列（如 "redis://127.0.0.1:6379/0"），多 worker 间转发事件；None 表示不使用
+    SOCKETIO_MESSAGE_QUEUE = None
+
     # https://dev.qweather.com/docs/api/weather/weather-now/
     WEATHER_URL = "https://me3md8xy63.re.qweatherapi.com/v7/weather/now/"
 
@@ -0,0 +1,552 @@
+# 文件转换的具体实现：只依赖 PIL / img2pdf / pdf2image，不依赖 Flask 应用，
+# 可以在转换进程池（spawn 方式启动）的子进程中导入和执行
+import io
+import logging
+import math
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+
+import img2pdf
+from PIL import Image, ImageOps
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+from config.const import Const
+
+logger = logging.getLogger("ZZH-Tool")
+
+IMAGE_EXTENSIONS = ["png", "jpg", "jpeg", "bmp", "gif", "tiff", "webp"]
+
+# ---------------- 进度上报 ----------------
+# 子进程通过进程池初始化时传入的队列上报 (进度键, 已完成, 总数)，由主进程转发给对应任务
+progress_queue = None
+
+def init_worker(queue):
+    global progress_queue
+    progress_queue = queue
+
+def report_progress(progress_key, done, total):
+    if progress_queue is not None and progress_key is not None:
+        progress_queue.put((progress_key, done, total))
+
+# 图像模式处理函数
+def handle_special_image_modes(img):
+    """
+    处理所有特殊图像模式，返回处理后的RGB图像
+    支持的模式: RGBA, LA, PA, P, CMYK, 1 (二值), L (灰度)
+    """
+    # 模式映射表
+    mode_handlers = {
+        # 带透明度的模式
+        "RGBA": lambda i: i.convert("RGB"),
+        "LA": lambda i: _convert_la(i),
+        "PA": lambda i: _convert_pa(i),
+        "RGBa": lambda i: i.convert("RGB"),
+        # 不带透明度的特殊模式
+        "P": lambda i: i.convert("RGB"),
+        "CMYK": lambda i: i.convert("RGB"),
+        "1": lambda i: i.convert("L").convert("RGB"),  # 二值图先转灰度再转RGB
+        "L": lambda i: i.convert("RGB"),  # 灰度转RGB
+        "I": lambda i: i.convert("RGB"),  # 32位整数灰度
+        "F": lambda i: i.convert("RGB"),  # 32位浮点灰度
+        # 其他未知模式
+        "default": lambda i: i.convert("RGB"),
+    }
+
+    handler = mode_handlers.get(img.mode, mode_handlers["default"])
+    return handler(img)
+
+def _convert_la(img):
+    """转换LA模式(灰度+alpha)为RGB"""
+    # 分离灰度和alpha通道
+    l, a = img.split()
+
+    # 创建白色背景
+    background = Image.new("RGB", img.size, (255, 255, 255))
+
+    # 创建RGB灰度图像
+    rgb_img = Image.merge("RGB", (l, l, l))
+
+    # 应用alpha通道
+    background.paste(rgb_img, mask=a)
+
+    return background
+
+def _convert_pa(img):
+    """转换PA模式(调色板+alpha)为RGB"""
+    # 先转换为RGBA
+    rgba_img = img.convert("RGBA")
+
+    # 创建白色背景
+    background = Image.new("RGB", img.size, (255, 255, 255))
+
+    # 应用alpha通道
+    r, g, b, a = rgba_img.split()
+    background.paste(rgba_img, mask=a)
+
+    return background
+
+# ---------------- 缩放 ----------------
+# 等比缩放到目标尺寸框内，不拉伸，已经放得下的图片不处理。
+# JPEG 在解码时直接按 1/2、1/4、1/8 缩小（draft），解码的像素少几倍；其余格式先用 reduce 按整数倍缩小，
+# 只有剩下不超过 RESIZE_REDUCING_GAP 倍的部分用 LANCZOS 插值
+RESIZE_PRESETS = {"hd": (1920, 1080), "fullhd": (2560, 1440)}
+
+def get_resize_box(options):
+    """
+    从转换选项读取目标尺寸框 (最大宽度, 最大高度)，不缩放时返回 None，不限制的一边为 None
+    resizeOption 为 custom 时从 maxWidth/maxHeight 读取；选项无效时抛出 ValueError
+    """
+    resize_option = options.get("resizeOption") or "original"
+    if resize_option == "original":
+        return None
+    if resize_option in RESIZE_PRESETS:
+        return RESIZE_PRESETS[resize_option]
+    if resize_option != "custom":
+        raise ValueError(f"未知的调整大小选项: {resize_option}")
+
+    box = []
+    for key, label in (("maxWidth", "最大宽度"), ("maxHeight", "最大高度")):
+        value = options.get(key)
+        if value in (None, ""):
+            box.append(None)
+            continue
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{label}必须是整数") from None
+        if not 1 <= value <= Const.RESIZE_MAX_DIMENSION:
+            raise ValueError(f"{label}必须在 1 到 {Const.RESIZE_MAX_DIMENSION} 之间")
+        box.append(value)
+    if box == [None, None]:
+        raise ValueError("自定义尺寸需要指定最大宽度或最大高度")
+    return tuple(box)
+
+def get_fit_size(size, box):
+    """等比缩放到 box 内的尺寸，已经放得下时返回 None"""
+    width, height = size
+    max_width = box[0] or width
+    max_height = box[1] or height
+    if width <= max_width and height <= max_height:
+        return None
+    scale = min(max_width / width, max_height / height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def open_image_for_box(image_path, box):
+    """打开图片（路径或文件对象）并算出缩放后的尺寸，返回 (图片, 目标尺寸或 None)；需要缩小的 JPEG 按目标尺寸解码"""
+    img = Image.open(image_path)
+    target_size = get_fit_size(img.size, box) if box else None
+    if target_size and img.format == "JPEG":
+        # libjpeg 在 DCT 域按 1/2、1/4、1/8 缩小，相当于先做了一次低通，解码结果不小于目标尺寸
+        img.draft(None, target_size)
+    return img, target_size
+
+def resize_image(img, target_size):
+    if target_size is None or img.size == target_size:
+        return img
+    return img.resize(
+        target_size, Image.Resampling.LANCZOS, reducing_gap=Const.RESIZE_REDUCING_GAP
+    )
+
+# ---------------- 图片转 PDF ----------------
+# img2pdf 能原样嵌入的图片（基线 JPEG、不带透明度的 PNG）直接交给它，不解码也不重新压缩；
+# 其余图片在内存中转换模式并编码为 JPEG。所有页面一次写入同一个 PDF，不产生临时文件
+# 使用 img2pdf 自带的 PDF 写入器：pikepdf 写入器会再复制一份图片数据，峰值内存翻倍
+ORIENTATION_TAG = 0x0112  # EXIF 方向
+
+def is_pdf_passthrough_image(img):
+    if img.format == "JPEG":
+        # CMYK 和渐进式 JPEG 仍重新编码
+        return (
+            img.mode in ("RGB", "L")
+            and not img.info.get("progressive")
+            and not img.info.get("progression")
+        )
+    if img.format == "PNG":
+        return img.mode in ("RGB", "L", "P", "1") and "transparency" not in img.info
+    return False
+
+def encode_pdf_image(img, quality=90):
+    """把图片编码为内存中的 JPEG"""
+    # 原样嵌入的 JPEG 由 img2pdf 按 EXIF 方向旋转，重新编码的图片在这里旋转，保持一致
+    if img.getexif().get(ORIENTATION_TAG, 1) != 1:
+        img = ImageOps.exif_transpose(img)
+    if img.mode not in ("RGB", "L"):
+        img = handle_special_image_modes(img)
+    buffer = io.BytesIO()
+    img.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+def prepare_pdf_image(image_path, quality=90, passthrough=True):
+    """返回 (交给 img2pdf 的文件路径或 JPEG 数据, 是否原样嵌入, 是否需要按 EXIF 旋转)"""
+    with Image.open(image_path) as img:
+        if passthrough and is_pdf_passthrough_image(img):
+            # 传路径而不是预先读出的数据，img2pdf 取出图像数据后即释放原文件内容
+            rotated = img.format == "JPEG" and img.getexif().get(ORIENTATION_TAG, 1) != 1
+            return image_path, True, rotated
+        return encode_pdf_image(img, quality), False, False
+
+def images_to_pdf(image_paths, output_path, quality=90):
+    """
+    把多张图片按顺序写成一个 PDF，返回写入的页数
+    无法读取的图片跳过；img2pdf 拒绝原样数据时全部重新编码后再试一次
+    """
+    t_start = time.perf_counter()
+    pages = []
+    for image_path in image_paths:
+        try:
+            pages.append((image_path, *prepare_pdf_image(image_path, quality)))
+        except Exception as e:
+            logging.error(f"读取图片失败 {os.path.basename(image_path)}: {str(e)}")
+    if not pages:
+        return 0
+
+    def write_pdf():
+        # 读取 EXIF 方向会让 img2pdf 完整解码 PNG，只在有需要旋转的 JPEG 时开启
+        rotation = (
+            img2pdf.Rotation.ifvalid
+            if any(rotated for *_, rotated in pages)
+            else img2pdf.Rotation.none
+        )
+        with open(output_path, "wb") as f:
+            img2pdf.convert(
+                [data for _, data, _, _ in pages],
+                outputstream=f,
+                rotation=rotation,
+                engine=img2pdf.Engine.internal,
+            )
+
+    try:
+        write_pdf()
+    except Exception as e:
+        if not any(raw for _, _, raw, _ in pages):
+            raise
+        logging.warning(f"部分图片无法原样嵌入，全部重新编码: {str(e)}")
+        pages = [
+            (image_path, *prepare_pdf_image(image_path, quality, passthrough=False))
+            for image_path, *_ in pages
+        ]
+        write_pdf()
+
+    logger.info(
+        f"图片转PDF: {len(pages)} 页（原样嵌入 {sum(raw for _, _, raw, _ in pages)} 页），"
+        f"耗时 {time.perf_counter() - t_start:.2f}s"
+    )
+    return len(pages)
+
+# ---------------- PDF 转图片 ----------------
+# pdftoppm 分批把页面直接写到磁盘（paths_only），进程中不会同时持有整份 PDF 的位图；
+# 每个 pdftoppm 进程同一时间只持有一页位图，按内存上限限制并行的 pdftoppm 数量，单页超出上限时降低 DPI
+PDF_NATIVE_FORMATS = {"jpg": "jpeg", "jpeg": "jpeg", "png": "png", "tiff": "tiff"}
+PDF_PAGE_SIZE_KEY = re.compile(r"^Page\s+\d+ size$")
+PDF_PAGE_SIZE_VALUE = re.compile(r"^([\d.]+) x ([\d.]+) pts")
+PDF_PAGE_NUMBER = re.compile(r"-(\d+)\.\w+$")
+PAGE_RANGE_ITEM = re.compile(r"^(\d+)(?:\s*-\s*(\d*))?$")
+
+def get_pdf_page_count(pdf_path):
+    return pdfinfo_from_path(pdf_path)["Pages"]
+
+def get_pdf_page_info(pdf_path, last_page=None):
+    """
+    返回 (页数, 最大页面面积（平方磅）, 最长边（磅）)
+    last_page 不为空时只统计前 last_page 页的尺寸
+    """
+    page_count = get_pdf_page_count(pdf_path)
+    info = pdfinfo_from_path(
+        pdf_path, first_page=1, last_page=min(page_count, last_page or page_count)
+    )
+    max_area = max_side = 0
+    for key, value in info.items():
+        match = PDF_PAGE_SIZE_VALUE.match(value) if PDF_PAGE_SIZE_KEY.match(key) else None
+        if match:
+            width, height = float(match.group(1)), float(match.group(2))
+            max_area = max(max_area, width * height)
+            max_side = max(max_side, width, height)
+    # 读不到页面尺寸时按 A4 估算
+    return page_count, max_area or 595 * 842, max_side or 842
+
+def parse_page_ranges(spec):
+    """解析 "1-3,5,8-" 形式的页码范围，返回 [(起始页, 结束页)]，结束页为 None 表示到最后一页；空表示全部页面"""
+    ranges = []
+    for item in (spec or "").replace("，", ",").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        match = PAGE_RANGE_ITEM.match(item)
+        if not match:
+            raise ValueError(f"无效的页码范围: {item}")
+        first = int(match.group(1))
+        if match.group(2) is None:
+            last = first
+        else:
+            last = int(match.group(2)) if match.group(2) else None
+        if first < 1 or (last is not None and last < first):
+            raise ValueError(f"无效的页码范围: {item}")
+        ranges.append((first, last))
+    return ranges
+
+def get_raster_options(options):
+    """从转换选项中取出 (页码范围, DPI, 最大边长)，参数无效时抛出 ValueError"""
+    try:
+        dpi = int(options.get("dpi") or Const.PDF_RASTER_DPI)
+        max_dimension = int(options.get("maxDimension") or 0) or None
+    except (TypeError, ValueError):
+        raise ValueError("无效的分辨率参数")
+    dpi = min(max(dpi, Const.PDF_RASTER_MIN_DPI), Const.PDF_RASTER_MAX_DPI)
+    if max_dimension is not None:
+        max_dimension = max(max_dimension, Const.PDF_RASTER_MIN_DIMENSION)
+    return parse_page_ranges(options.get("pageRange")), dpi, max_dimension
+
+def select_pdf_pages(ranges, page_count):
+    """按页码范围选出存在的页，按连续区间分批，返回 [(起始页, 结束页)]"""
+    if ranges:
+        pages = sorted(
+            {
+                page
+                for first, last in ranges
+                for page in range(first, min(last or page_count, page_count) + 1)
+            }
+        )
+    else:
+        pages = list(range(1, page_count + 1))
+    chunks = []
+    for page in pages:
+        if (
+            chunks
+            and chunks[-1][1] == page - 1
+            and page - chunks[-1][0] < Const.PDF_RASTER_CHUNK_PAGES
+        ):
+            chunks[-1] = (chunks[-1][0], page)
+        else:
+            chunks.append((page, page))
+    return chunks
+
+def plan_pdf_raster(page_area, max_side, dpi, max_dimension, threads, max_memory):
+    """
+    按最大边长和内存上限确定 (DPI, 并行 pdftoppm 数)，位图按每像素 3 字节估算
+    同一份 PDF 统一使用按最大页面算出的 DPI
+    """
+    if max_dimension:
+        dpi = min(dpi, max(1, int(max_dimension * 72 / max_side)))
+    page_bytes = page_area / 72 / 72 * dpi * dpi * 3
+    if page_bytes > max_memory:
+        dpi = max(1, int(dpi * math.sqrt(max_memory / page_bytes)))
+        page_bytes = page_area / 72 / 72 * dpi * dpi * 3
+    return dpi, max(1, min(threads, int(max_memory // page_bytes)))
+
+def render_pdf_pages(pdf_path, work_dir, first_page, last_page, fmt, quality, dpi, threads):
+    """把连续的若干页渲染到 work_dir，返回按页码排序的 [(页码, 文件路径)]"""
+    paths = convert_from_path(
+        pdf_path,
+        dpi=dpi,
+        output_folder=work_dir,
+        first_page=first_page,
+        last_page=last_page,
+        fmt=fmt,
+        jpegopt={"quality": quality} if fmt == "jpeg" else None,
+        thread_count=threads,
+        paths_only=True,
+    )
+    if len(paths) != last_page - first_page + 1:
+        raise ValueError(f"渲染PDF第 {first_page}-{last_page} 页失败")
+    return sorted((int(PDF_PAGE_NUMBER.search(path).group(1)), path) for path in paths)
+
+def pdf_to_images(pdf_path, pages_dir, base_name, target_format, options, progress_key=None):
+    """把 PDF 中选定的页渲染为图片，返回生成的文件列表，每完成一页上报一次进度"""
+    t_start = time.perf_counter()
+    quality = int(options.get("imageQuality", 90))
+    ranges, requested_dpi, max_dimension = get_raster_options(options)
+    page_count, page_area, max_side = get_pdf_page_info(pdf_path)
+    chunks = select_pdf_pages(ranges, page_count)
+    if not chunks:
+        raise ValueError(f"页码范围超出PDF页数（共 {page_count} 页）")
+    total_pages = sum(last - first + 1 for first, last in chunks)
+
+    dpi, threads = plan_pdf_raster(
+        page_area,
+        max_side,
+        requested_dpi,
+        max_dimension,
+        Const.PDF_RASTER_THREADS,
+        Const.PDF_RASTER_MAX_MEMORY,
+    )
+    if dpi < requested_dpi and not max_dimension:
+        logger.warning(f"PDF 页面过大，DPI 从 {requested_dpi} 降至 {dpi}: {pdf_path}")
+
+    # pdftoppm 能直接输出的格式不再经过 PIL，其余格式先输出 PNG 再逐页转换
+    native_format = PDF_NATIVE_FORMATS.get(target_format)
+    outputs = []
+    for first_page, last_page in chunks:
+        chunk_dir = tempfile.mkdtemp(dir=pages_dir)
+        try:
+            pages = render_pdf_pages(
+                pdf_path,
+                chunk_dir,
+                first_page,
+                last_page,
+                native_format or "png",
+                quality,
+                dpi,
+                threads,
+            )
+            for page, path in pages:
+                page_filename = f"{base_name}_page{page}.{target_format}"
+                page_path = os.path.join(pages_dir, page_filename)
+                if native_format:
+                    os.replace(path, page_path)
+                else:
+                    with Image.open(path) as img:
+                        img.save(page_path, format=target_format.upper(), quality=quality)
+                outputs.append(
+                    {
+                        "filename": page_filename,
+                        "file_size": os.path.getsize(page_path),
+                        "path": page_path,
+                    }
+                )
+                report_progress(progress_key, len(outputs), total_pages)
+        finally:
+            shutil.rmtree(chunk_dir, ignore_errors=True)
+
+    logger.info(
+        f"PDF转图片: {total_pages}/{page_count} 页，DPI {dpi}，{threads} 个 pdftoppm 进程，"
+        f"耗时 {time.perf_counter() - t_start:.2f}s"
+    )
+    return outputs
+
+def render_pdf_preview(pdf_path, page_paths, size, quality):
+    """
+    以低分辨率渲染预览图，page_paths 为 {页码: 输出路径}，只渲染其中的页
+    按前几页中最大的页面算出 DPI，使每页都不超过 size×size
+    """
+    last_page = max(page_paths)
+    _, page_area, max_side = get_pdf_page_info(pdf_path, last_page)
+    dpi, _ = plan_pdf_raster(
+        page_area, max_side, Const.PDF_RASTER_DPI, size, 1, Const.PDF_RASTER_MAX_MEMORY
+    )
+    work_dir = tempfile.mkdtemp(dir=os.path.dirname(page_paths[last_page]))
+    try:
+        pages = render_pdf_pages(
+            pdf_path, work_dir, min(page_paths), last_page, "jpeg", quality, dpi, 1
+        )
+        for page, path in pages:
+            if page in page_paths:
+                os.replace(path, page_paths[page])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+# ---------------- 内存估算 ----------------
+def get_decoded_size(img, target_size):
+    """解码后的尺寸：需要缩小的 JPEG 按 draft 选择的 1/2、1/4、1/8 计算"""
+    if target_size and img.format == "JPEG":
+        for scale in (8, 4, 2):
+            width, height = -(-img.width // scale), -(-img.height // scale)
+            if width >= target_size[0] and height >= target_size[1]:
+                return width, height
+    return img.size
+
+def estimate_conversion_pixels(original_path, original_ext, target_format, options):
+    """
+    只读文件头估算转换时同时在内存中的像素数，用于准入控制
+    图片按解码后的尺寸计算，原样嵌入 PDF 的图片不解码；PDF 转图片按同时渲染的页数乘每页像素计算
+    """
+    if original_ext == "pdf":
+        if target_format not in IMAGE_EXTENSIONS:
+            return 0
+        _, requested_dpi, max_dimension = get_raster_options(options)
+        _, page_area, max_side = get_pdf_page_info(original_path)
+        dpi, threads = plan_pdf_raster(
+            page_area,
+            max_side,
+            requested_dpi,
+            max_dimension,
+            Const.PDF_RASTER_THREADS,
+            Const.PDF_RASTER_MAX_MEMORY,
+        )
+        return int(page_area / 72 / 72 * dpi * dpi) * threads
+
+    with Image.open(original_path) as img:
+        if target_format == "pdf":
+            return 0 if is_pdf_passthrough_image(img) else img.width * img.height
+        box = get_resize_box(options)
+        width, height = get_decoded_size(img, get_fit_size(img.size, box) if box else None)
+        return width * height
+
+# ---------------- 单个文件转换 ----------------
+def is_supported_conversion(original_ext, target_format):
+    if original_ext == "pdf":
+        return target_format in IMAGE_EXTENSIONS or target_format == "pdf"
+    return original_ext in IMAGE_EXTENSIONS and (
+        target_format in IMAGE_EXTENSIONS or target_format == "pdf"
+    )
+
+def convert_file(
+    original_path, original_ext, target_format, target_path, options, progress_key=None
+):
+    """
+    转换单个文件，返回生成的文件列表 [{"filename", "file_size", "path"}]
+    在转换进程池的子进程中执行，失败时直接抛出异常，由调用方记录
+    """
+    target_filename = os.path.basename(target_path)
+    quality = int(options.get("imageQuality", 90))
+
+    # PDF转图片 - 逐批渲染选定的页面
+    if original_ext == "pdf" and target_format in IMAGE_EXTENSIONS:
+        # 创建文件夹存放所有页面
+        pdf_pages_dir = os.path.join(
+            os.path.dirname(target_path), f"{uuid.uuid4().hex}_pages"
+        )
+        os.makedirs(pdf_pages_dir, exist_ok=True)
+        return pdf_to_images(
+            original_path,
+            pdf_pages_dir,
+            os.path.splitext(target_filename)[0],
+            target_format,
+            options,
+            progress_key,
+        )
+
+    # 图片转PDF（合并PDF时不走这里，由 images_to_pdf 统一处理）
+    if original_ext in IMAGE_EXTENSIONS and target_format == "pdf":
+        if not images_to_pdf([original_path], target_path, quality):
+            raise ValueError("无法读取图片")
+
+    # 图片格式转换
+    elif original_ext in IMAGE_EXTENSIONS and target_format in IMAGE_EXTENSIONS:
+        img, target_size = open_image_for_box(original_path, get_resize_box(options))
+
+        # 调色板和二值图不能直接插值，先转换模式再缩放；其余模式先缩小，后面处理的像素更少
+        if img.mode in ("P", "PA", "1"):
+            img = handle_special_image_modes(img)
+            img = resize_image(img, target_size)
+        else:
+            img = resize_image(img, target_size)
+            img = handle_special_image_modes(img)
+
+        # 确保目标格式兼容
+        if target_format in ["jpg", "jpeg"] and img.mode != "RGB":
+            img = img.convert("RGB")
+
+        # 保存为目标格式
+        if target_format in ["jpg", "jpeg"]:
+            img.save(target_path, "JPEG", quality=quality)
+        else:
+            img.save(target_path, format=target_format.upper(), quality=quality)
+
+    # PDF转PDF（不需要转换）
+    elif original_ext == "pdf" and target_format == "pdf":
+        shutil.copy(original_path, target_path)
+
+    else:
+        raise ValueError(f"不支持从 {original_ext} 到 {target_format} 的转换")
+
+    return [
+        {
+            "filename": target_filename,
+            "file_size": os.path.getsize(target_path),
+            "path": target_path,
+        }
+    ]
@@ -13,11 +13,19 @@ document.addEventListener('DOMContentLoaded', function () {
     const imageOptions = document.getElementById('imageOptions');
     const imageQuality = document.getElementById('imageQuality');
     const qualityValue = document.getElementById('qualityValue');
+    const resizeOption = document.getElementById('resizeOption');
+    const customSizeOption = document.getElementById('customSizeOption');
     const filePreviews = document.getElementById('filePreviews');
 
     let uploadedFiles = [];
     let socket = io.connect(); // 初始化Socket.IO连接
     let currentConversionId = null; // 当前转换任务的唯一ID
+    let currentConversionJobId = null; // 服务器返回的后台转换任务ID
+    const uploadIds = new WeakMap(); // 已上传或正在上传的文件 -> 上传ID 的 Promise，预览和转换共用同一次上传
+
+    const TUS_VERSION = '1.0.0';
+    const UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024; // 每个 PATCH 请求发送的字节数
+    const UPLOAD_MAX_RETRIES = 5; // 连续出错多少次后放弃上传
 
     pdfOptions.style.display = 'block';
 
@@ -45,6 +53,11 @@ document.addEventListener('DOMContentLoaded', function () {
         qualityValue.textContent = `${this.value}%`;
     });
 
+    // 选择自定义尺寸时显示最大宽高输入框
+    resizeOption.addEventListener('change', function () {
+        customSizeOption.style.display = this.value === 'custom' ? 'block' : 'none';
+    });
+
     // 切换目标格式时更新选项
     targetFormat.addEventListener('change', function () {
         if (this.value === 'pdf') {
@@ -185,6 +198,7 @@ document.addEventListener('DOMContentLoaded', function () {
                 </div>
             `;
             preview.appendChild(previewContent);
+            loadPdfPreview(file, previewContent);
         } else {
             // 图片文件 - 显示缩略图
             const reader = new FileReader();
@@ -202,6 +216,28 @@ document.addEventListener('DOMContentLoaded', function () {
         filePreviews.appendChild(preview);
     }
 
+    // 用服务器生成的第一页预览图替换PDF图标，失败时保留图标
+    // 先分块上传再按上传ID预览，提交转换时复用这次上传，不再重复上传
+    function loadPdfPreview(file, previewContent) {
+        uploadFile(file, () => {})
+            .then(uploadId => fetch(`/convert_preview?upload_id=${encodeURIComponent(uploadId)}&pages=1`))
+            .then(response => response.json())
+            .then(data => {
+                if (!data.success || data.pages.length === 0) return;
+                const img = document.createElement('img');
+                img.src = data.pages[0].url;
+                img.alt = `${file.name}（共 ${data.page_count} 页）`;
+                img.title = img.alt;
+                img.onload = function () {
+                    previewContent.innerHTML = '';
+                    previewContent.appendChild(img);
+                };
+            })
+            .catch(error => {
+                console.error('PDF预览失败:', error);
+            });
+    }
+
     // 移除单个文件
     function removeFile(fileName) {
         uploadedFiles = uploadedFiles.filter(file => file.name !== fileName);
@@ -230,15 +266,9 @@ document.addEventListener('DOMContentLoaded', function () {
 
     // 转换文件（多文件）
     function convertFiles() {
-        // 记录开始时间
-        conversionStartTime = Date.now();
-
         // 清除之前的进度间隔
         if (progressInterval) clearInterval(progressInterval);
 
-        // 初始化进度更新间隔
-        progressInterval = setInterval(updateEstimatedProgress, 1000);
-
         // 生成唯一转换ID
         currentConversionId = 'conversion_' + Date.now() + '_' + Math.random().toString(36).substr(2, 9);
 
@@ -253,7 +283,7 @@ document.addEventListener('DOMContentLoaded', function () {
           </div>
           
           <div class="progress-info">
-            <span id="progressStatus">准备中...</span>
+            <span id="progressStatus">上传中...</span>
             <span id="progressTime">剩余时间: --:--</span>
           </div>
         </div>
@@ -269,22 +299,27 @@ document.addEventListener('DOMContentLoaded', function () {
             imageQuality: imageQuality.value,
             mergePages: document.getElementById('mergePages').checked,
             mergePdf: document.getElementById('mergePdf').checked,
-            resizeOption: document.getElementById('resizeOption').value,
+            resizeOption: resizeOption.value,
+            maxWidth: document.getElementById('maxWidth').value,
+            maxHeight: document.getElementById('maxHeight').value,
+            pageRange: document.getElementById('pageRange').value,
+            dpi: document.getElementById('pdfDpi').value,
             task_id: currentConversionId
         };
 
-        // 创建FormData
-        const formData = new FormData();
-        uploadedFiles.forEach(file => {
-            formData.append('files', file);
-        });
-        formData.append('options', JSON.stringify(options));
-
-        // 发送转换请求
-        fetch('/convert_files', {
-            method: 'POST',
-            body: formData
-        })
+        // 先分块上传所有文件，再用上传ID提交转换
+        uploadFiles(uploadedFiles)
+            .then(uploadIds => {
+                // 记录开始时间并初始化进度更新间隔
+                conversionStartTime = Date.now();
+                progressInterval = setInterval(updateEstimatedProgress, 1000);
+
+                return fetch('/convert_files', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ upload_ids: uploadIds, options: options })
+                });
+            })
             .then(response => {
                 if (!response.ok) {
                     return response.json().then(errData => {
@@ -295,21 +330,175 @@ document.addEventListener('DOMContentLoaded', function () {
             })
             .then(data => {
                 if (data.success) {
-                    showConversionResult(data);
+                    // 任务已提交，上传的文件已被取走
+                    uploadedFiles.forEach(file => uploadIds.delete(file));
+                    // 轮询任务状态直到完成（断开连接不影响服务器端的转换）
+                    currentConversionJobId = data.job_id;
+                    pollConversionStatus(data.job_id);
                 } else {
-                    showError(data.error || '文件转换失败');
+                    throw new Error(data.error || '文件转换失败');
                 }
             })
             .catch(error => {
                 console.error('转换错误:', error);
+                finishConversion();
                 showError(error.message || '转换过程中发生错误');
+            });
+    }
+
+    // 依次上传所有文件，返回上传ID列表，同时显示整体上传进度
+    async function uploadFiles(files) {
+        const totalBytes = files.reduce((sum, file) => sum + file.size, 0) || 1;
+        let finishedBytes = 0;
+        const ids = [];
+        for (const file of files) {
+            ids.push(await uploadFile(file, offset => {
+                updateProgress({
+                    percent: Math.floor((finishedBytes + offset) / totalBytes * 100),
+                    message: `上传中: ${file.name}`,
+                    eta: '--:--'
+                });
+            }));
+            finishedBytes += file.size;
+        }
+        return ids;
+    }
+
+    // 可续传的分块上传（tus 协议）：创建上传后逐块发送，出错时查询服务器已收到的字节数后继续
+    function uploadFile(file, onProgress) {
+        // 已上传（或正在为预览上传）的文件直接复用，上传失败时下次重新上传
+        if (!uploadIds.has(file)) {
+            const upload = sendFile(file, onProgress);
+            uploadIds.set(file, upload);
+            upload.catch(() => uploadIds.delete(file));
+        }
+        return uploadIds.get(file);
+    }
+
+    async function sendFile(file, onProgress) {
+        const createResponse = await fetch('/uploads', {
+            method: 'POST',
+            headers: {
+                'Tus-Resumable': TUS_VERSION,
+                'Upload-Length': file.size,
+                'Upload-Metadata': 'filename ' + encodeMetadataValue(file.name)
+            }
+        });
+        const created = await createResponse.json();
+        if (!created.success) {
+            throw new Error(created.error || '创建上传失败');
+        }
+
+        const uploadId = created.upload_id;
+        let offset = 0;
+        let retries = 0;
+        while (offset < file.size) {
+            try {
+                const response = await fetch(`/uploads/${uploadId}`, {
+                    method: 'PATCH',
+                    headers: {
+                        'Tus-Resumable': TUS_VERSION,
+                        'Upload-Offset': offset,
+                        'Content-Type': 'application/offset+octet-stream'
+                    },
+                    body: file.slice(offset, offset + UPLOAD_CHUNK_SIZE)
+                });
+                if (!response.ok) {
+                    throw new Error(`上传失败 (${response.status})`);
+                }
+                offset = parseInt(response.headers.get('Upload-Offset'), 10);
+                retries = 0;
+                onProgress(offset);
+            } catch (error) {
+                if (++retries > UPLOAD_MAX_RETRIES) throw error;
+                console.warn(`上传 ${file.name} 出错，${retries} 秒后续传:`, error);
+                await new Promise(resolve => setTimeout(resolve, retries * 1000));
+                offset = await queryUploadOffset(uploadId, offset);
+            }
+        }
+        return uploadId;
+    }
+
+    // 查询服务器已收到的字节数，网络出错时沿用原来的偏移量
+    async function queryUploadOffset(uploadId, fallback) {
+        let response;
+        try {
+            response = await fetch(`/uploads/${uploadId}`, {
+                method: 'HEAD',
+                headers: { 'Tus-Resumable': TUS_VERSION }
+            });
+        } catch (error) {
+            return fallback;
+        }
+        if (response.status === 404) {
+            throw new Error('上传已过期，请重新选择文件');
+        }
+        return response.ok ? parseInt(response.headers.get('Upload-Offset'), 10) : fallback;
+    }
+
+    // Upload-Metadata 的值为 UTF-8 编码后的 base64
+    function encodeMetadataValue(value) {
+        let binary = '';
+        new TextEncoder().encode(value).forEach(byte => {
+            binary += String.fromCharCode(byte);
+        });
+        return btoa(binary);
+    }
+
+    // 轮询转换任务状态
+    function pollConversionStatus(jobId) {
+        if (jobId !== currentConversionJobId) return;
+
+        fetch(`/convert_status/${jobId}`)
+            .then(response => response.json())
+            .then(data => {
+                if (jobId !== currentConversionJobId) return;
+                if (!data.success) {
+                    throw new Error(data.error || '查询转换状态失败');
+                }
+
+                if (data.state === 'finished') {
+                    fetchConversionResult(jobId);
+                    return;
+                } else if (data.state === 'failed') {
+                    throw new Error(data.error || '文件转换失败');
+                }
+
+                setTimeout(() => pollConversionStatus(jobId), 1000);
             })
-            .finally(() => {
-                // 启用转换按钮
-                convertBtn.disabled = uploadedFiles.length > 0;
+            .catch(error => {
+                console.error('转换错误:', error);
+                finishConversion();
+                showError(error.message || '查询转换状态失败');
             });
     }
 
+    // 获取转换结果
+    function fetchConversionResult(jobId) {
+        fetch(`/convert_result/${jobId}`)
+            .then(response => response.json())
+            .then(data => {
+                if (data.success) {
+                    showConversionResult(data);
+                } else {
+                    showError(data.error || '获取转换结果失败');
+                }
+            })
+            .catch(error => {
+                console.error('转换错误:', error);
+                showError(error.message || '获取转换结果失败');
+            })
+            .finally(finishConversion);
+    }
+
+    // 转换结束（成功或失败）后恢复界面状态
+    function finishConversion() {
+        currentConversionJobId = null;
+        if (progressInterval) clearInterval(progressInterval);
+        // 启用转换按钮
+        convertBtn.disabled = uploadedFiles.length > 0;
+    }
+
     function updateEstimatedProgress() {
         if (!conversionStartTime) return;
 
@@ -9,11 +9,15 @@ document.addEventListener('DOMContentLoaded', function () {
   // 初始化解析按钮
   parseBtn.addEventListener('click', parseVideo);
 
+  // 当前下载任务ID
+  let currentJobId = null;
+
   // 初始化Socket.IO连接
   const socket = io.connect();
 
   // 监听下载进度事件
   socket.on('download_progress', function (data) {
+    if (data.job_id && data.job_id !== currentJobId) return;
     updateProgressBar(data);
   });
 
@@ -143,7 +147,7 @@ document.addEventListener('DOMContentLoaded', function () {
     parseResult.innerHTML = `
       <div class="video-info">
         <div class="video-thumbnail">
-          <img src="${videoInfo.thumbnail}" alt="${videoInfo.title}" onerror="this.src='https://via.placeholder.com/400x225?text=缩略图加载失败'">
+          <img src="${videoInfo.thumbnail}" alt="${videoInfo.title}" data-source="${videoInfo.thumbnail_source || ''}" onerror="handleThumbnailError(this)">
         </div>
         <div class="video-details">
           <h3 class="video-title">${videoInfo.title || '未知标题'}</h3>
@@ -194,6 +198,10 @@ document.addEventListener('DOMContentLoaded', function () {
                 <input type="checkbox" id="mergeAudio" checked>
                 <label for="mergeAudio">自动合并音视频（推荐）</label>
               </div>
+              <div class="option">
+                <input type="checkbox" id="streamDownload">
+                <label for="streamDownload">边下边传（立即开始下载，不在服务器保存）</label>
+              </div>
               <button id="downloadBtn" class="download-btn">
                 <i class="fas fa-download"></i> 下载视频
               </button>
@@ -208,6 +216,7 @@ document.addEventListener('DOMContentLoaded', function () {
       const videoFormatId = document.getElementById('videoFormatSelect').value;
       const audioFormatId = document.getElementById('audioFormatSelect').value;
       const mergeAudio = document.getElementById('mergeAudio').checked;
+      const streamDownload = document.getElementById('streamDownload').checked;
 
       if (!videoFormatId) {
         showError('请选择视频格式');
@@ -225,13 +234,14 @@ document.addEventListener('DOMContentLoaded', function () {
         videoFormatId,
         audioFormatId,
         mergeAudio,
-        videoInfo.title
+        videoInfo.title,
+        streamDownload
       );
     });
   }
 
   // 下载视频
-  function downloadVideo(url, videoFormatId, audioFormatId, mergeAudio, title) {
+  function downloadVideo(url, videoFormatId, audioFormatId, mergeAudio, title, streamDownload) {
     // 显示下载进度界面
     showDownloadProgress();
 
@@ -249,7 +259,8 @@ document.addEventListener('DOMContentLoaded', function () {
       body: JSON.stringify({
         url: url,
         format_id: formatId,
-        merge_audio: mergeAudio
+        merge_audio: mergeAudio,
+        stream: streamDownload
       })
     })
       .then(response => {
@@ -261,6 +272,75 @@ document.addEventListener('DOMContentLoaded', function () {
         return response.json();
       })
       .then(data => {
+        if (data.success && data.stream_url) {
+          // 边下边传：直接由浏览器下载数据流
+          const downloadLink = document.createElement('a');
+          downloadLink.href = data.stream_url;
+          downloadLink.style.display = 'none';
+          document.body.appendChild(downloadLink);
+          downloadLink.click();
+          document.body.removeChild(downloadLink);
+
+          showDownloadSuccess(data.stream_url, `${title || 'video'}.mp4`);
+        } else if (data.success) {
+          // 任务已提交，轮询任务状态直到完成
+          currentJobId = data.job_id;
+          // 订阅该任务的进度推送
+          socket.emit('join_download', { job_id: data.job_id });
+          updateQueuePosition(data.queue_position);
+          pollDownloadStatus(data.job_id);
+        } else {
+          showError(data.error || '下载失败，请稍后重试');
+        }
+      })
+      .catch(error => {
+        console.error('Error:', error);
+        showError(error.message || '下载请求失败，请检查网络连接');
+      });
+  }
+
+  // 轮询下载任务状态
+  function pollDownloadStatus(jobId) {
+    if (jobId !== currentJobId) return;
+
+    fetch(`/download_status/${jobId}`)
+      .then(response => response.json())
+      .then(data => {
+        if (jobId !== currentJobId) return;
+        if (!data.success) {
+          throw new Error(data.error || '查询下载状态失败');
+        }
+
+        if (data.state === 'queued') {
+          updateQueuePosition(data.queue_position);
+        } else if (data.state === 'running') {
+          updateProgressBar({
+            percent: data.percent,
+            speed: data.speed || 'N/A',
+            eta: data.eta || '--:--'
+          });
+        } else if (data.state === 'finished') {
+          fetchDownloadResult(jobId);
+          return;
+        } else if (data.state === 'failed' || data.state === 'cancelled') {
+          throw new Error(data.error || '下载失败，请稍后重试');
+        }
+
+        setTimeout(() => pollDownloadStatus(jobId), 1000);
+      })
+      .catch(error => {
+        console.error('Error:', error);
+        currentJobId = null;
+        showError(error.message || '查询下载状态失败');
+      });
+  }
+
+  // 获取下载结果并触发浏览器下载
+  function fetchDownloadResult(jobId) {
+    fetch(`/download_result/${jobId}`)
+      .then(response => response.json())
+      .then(data => {
+        currentJobId = null;
         if (data.success) {
           // 创建下载链接
           const downloadLink = document.createElement('a');
@@ -279,10 +359,19 @@ document.addEventListener('DOMContentLoaded', function () {
       })
       .catch(error => {
         console.error('Error:', error);
-        showError(error.message || '下载请求失败，请检查网络连接');
+        currentJobId = null;
+        showError(error.message || '获取下载结果失败');
       });
   }
 
+  // 显示排队位置
+  function updateQueuePosition(position) {
+    const etaElement = document.getElementById('eta');
+    if (etaElement && position) {
+      etaElement.textContent = `排队中: 第 ${position} 位`;
+    }
+  }
+
   // 显示下载进度界面
   function showDownloadProgress() {
     parseResult.innerHTML = `
@@ -334,7 +423,17 @@ document.addEventListener('DOMContentLoaded', function () {
     // 添加取消按钮事件
     document.getElementById('cancelBtn').addEventListener('click', function () {
       // 发送取消下载请求
-      fetch('/cancel_download', { method: 'POST' });
+      const jobId = currentJobId;
+      currentJobId = null;
+      if (jobId) {
+        fetch('/cancel_download', {
+          method: 'POST',
+          headers: {
+            'Content-Type': 'application/json',
+          },
+          body: JSON.stringify({ job_id: jobId })
+        });
+      }
       showError('下载已取消');
     });
   }
@@ -804,6 +903,16 @@ document.addEventListener('DOMContentLoaded', function () {
   });
 });
 
+// 缩略图加载失败：代理失败时先尝试原始地址，再显示占位图
+function handleThumbnailError(img) {
+  if (img.dataset.source && img.src !== img.dataset.source) {
+    img.src = img.dataset.source;
+    return;
+  }
+  img.onerror = null;
+  img.src = 'https://via.placeholder.com/400x225?text=缩略图加载失败';
+}
+
 // 添加项目logo点击事件
 document.getElementById('projectLogo').addEventListener('click', function () {
   window.location.href = '/dashboard';
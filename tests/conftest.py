@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    """在临时目录中导入 app，上传目录和状态数据库都建在临时目录下；不运行 initialize()，不安装依赖、不启动后台任务"""
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("app"))
+    os.environ["ZZH_TOOL_SKIP_INIT"] = "1"
+    try:
+        import app
+
+        app.init_state_db()
+        yield app
+    finally:
+        os.chdir(cwd)
@@ -0,0 +1,65 @@
+import pytest
+
+class FakeRegistry:
+    """模拟共享数据库中的活动任务登记，多个调度器共用时相当于多个 worker"""
+
+    def __init__(self):
+        self.jobs = set()
+
+    def add(self, job_id):
+        self.jobs.add(job_id)
+
+    def remove(self, job_id):
+        self.jobs.discard(job_id)
+
+    def count(self):
+        return len(self.jobs)
+
+class BrokenRegistry(FakeRegistry):
+    def count(self):
+        raise RuntimeError("database is locked")
+
+@pytest.fixture
+def scheduler_class(app_module):
+    return app_module.BandwidthScheduler
+
+def test_unlimited_never_waits(scheduler_class):
+    scheduler = scheduler_class(0)
+    scheduler.register("a")
+    assert scheduler.consume("a", "video", 10**9) == 0.0
+
+def test_single_job_gets_whole_budget(scheduler_class):
+    scheduler = scheduler_class(1000)
+    scheduler.register("a")
+    assert scheduler.consume("a", "video", 500) == pytest.approx(0.5, abs=0.05)
+
+def test_budget_is_split_across_workers(scheduler_class):
+    # 两个 worker 各有一个任务，每个任务只能用一半预算
+    registry = FakeRegistry()
+    worker1 = scheduler_class(1000, registry)
+    worker2 = scheduler_class(1000, registry)
+    worker1.register("a")
+    worker2.register("b")
+    assert worker1.consume("a", "video", 500) == pytest.approx(1.0, abs=0.05)
+    assert worker1.stats()["share"] == 500
+
+    # 另一个 worker 的任务结束后，刷新计数时收回份额
+    worker2.unregister("b")
+    worker1.REFRESH_INTERVAL = 0
+    assert worker1.stats()["share"] == 1000
+
+def test_registry_failure_keeps_last_count(scheduler_class):
+    registry = BrokenRegistry()
+    scheduler = scheduler_class(1000, registry)
+    scheduler.register("a")
+    scheduler.register("b")
+    assert scheduler.consume("a", "video", 500) == pytest.approx(1.0, abs=0.05)
+
+def test_consume_counts_each_file_separately(scheduler_class):
+    # 音视频分开下载时第二个文件的已下载字节数从 0 重新计数
+    scheduler = scheduler_class(0)
+    scheduler.register("a")
+    scheduler.consume("a", "video", 300)
+    scheduler.consume("a", "video", 500)
+    scheduler.consume("a", "audio", 100)
+    assert scheduler.stats()["jobs"][0]["bytes"] == 600
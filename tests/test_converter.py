@@ -0,0 +1,129 @@
+import io
+
+import pytest
+from PIL import Image
+
+from config.const import Const
+from converter import (
+    RESIZE_PRESETS,
+    get_fit_size,
+    get_raster_options,
+    get_resize_box,
+    open_image_for_box,
+    parse_page_ranges,
+)
+
+def make_jpeg(size):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (120, 80, 40)).save(buffer, "JPEG")
+    buffer.seek(0)
+    return buffer
+
+def test_open_image_for_box_decodes_jpeg_at_reduced_size():
+    # 缩略图只限制宽度：4000 宽的 JPEG 缩到 640 宽时应按 1/4 解码，而不是全尺寸解码
+    img, target_size = open_image_for_box(make_jpeg((4000, 3000)), (640, None))
+    assert target_size == (640, 480)
+    assert img.size == (1000, 750)
+    img.load()
+    assert img.size == (1000, 750)
+
+def test_open_image_for_box_keeps_small_image():
+    img, target_size = open_image_for_box(make_jpeg((320, 240)), (640, None))
+    assert target_size is None
+    assert img.size == (320, 240)
+
+@pytest.mark.parametrize(
+    "spec, expected",
+    [
+        ("1-3,5,8-", [(1, 3), (5, 5), (8, None)]),
+        (" 2 - 4 ， 7 ", [(2, 4), (7, 7)]),
+        ("3-3", [(3, 3)]),
+        ("1,,2,", [(1, 1), (2, 2)]),
+        ("", []),
+        ("  ", []),
+        (None, []),
+    ],
+)
+def test_parse_page_ranges(spec, expected):
+    assert parse_page_ranges(spec) == expected
+
+@pytest.mark.parametrize("spec", ["3-1", "0", "0-2", "-3", "a", "1-2-3", "1.5"])
+def test_parse_page_ranges_rejects_invalid(spec):
+    with pytest.raises(ValueError):
+        parse_page_ranges(spec)
+
+def test_get_raster_options_defaults():
+    assert get_raster_options({}) == ([], Const.PDF_RASTER_DPI, None)
+    assert get_raster_options({"dpi": "", "maxDimension": "", "pageRange": " "}) == (
+        [],
+        Const.PDF_RASTER_DPI,
+        None,
+    )
+
+def test_get_raster_options_clamps_values():
+    _, dpi, max_dimension = get_raster_options({"dpi": 1, "maxDimension": 10})
+    assert dpi == Const.PDF_RASTER_MIN_DPI
+    assert max_dimension == Const.PDF_RASTER_MIN_DIMENSION
+    _, dpi, _ = get_raster_options({"dpi": "100000"})
+    assert dpi == Const.PDF_RASTER_MAX_DPI
+    assert get_raster_options({"dpi": "150", "maxDimension": "2000", "pageRange": "2-"}) == (
+        [(2, None)],
+        150,
+        2000,
+    )
+
+@pytest.mark.parametrize(
+    "options",
+    [{"dpi": "abc"}, {"maxDimension": "big"}, {"dpi": [300]}, {"pageRange": "3-1"}],
+)
+def test_get_raster_options_rejects_invalid(options):
+    with pytest.raises(ValueError):
+        get_raster_options(options)
+
+@pytest.mark.parametrize(
+    "size, box, expected",
+    [
+        # 宽高比不变，按限制更严的一边缩放并四舍五入
+        ((6000, 4000), (1920, 1080), (1620, 1080)),
+        ((4000, 6000), (1920, 1080), (720, 1080)),
+        ((1001, 667), (500, None), (500, 333)),
+        ((999, 667), (500, None), (500, 334)),
+        ((1000, 3), (100, 100), (100, 1)),
+        # 极端宽高比时短边至少为 1 像素
+        ((10000, 1), (100, None), (100, 1)),
+        ((3000, 2000), (None, 999), (1498, 999)),
+    ],
+)
+def test_get_fit_size(size, box, expected):
+    assert get_fit_size(size, box) == expected
+
+@pytest.mark.parametrize(
+    "size, box",
+    [((1920, 1080), (1920, 1080)), ((800, 600), (1920, None)), ((800, 600), (None, 600))],
+)
+def test_get_fit_size_returns_none_when_it_fits(size, box):
+    assert get_fit_size(size, box) is None
+
+def test_get_resize_box():
+    assert get_resize_box({}) is None
+    assert get_resize_box({"resizeOption": "original"}) is None
+    assert get_resize_box({"resizeOption": "hd"}) == RESIZE_PRESETS["hd"]
+    assert get_resize_box({"resizeOption": "custom", "maxWidth": "800"}) == (800, None)
+    assert get_resize_box(
+        {"resizeOption": "custom", "maxWidth": "", "maxHeight": 600}
+    ) == (None, 600)
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {"resizeOption": "huge"},
+        {"resizeOption": "custom"},
+        {"resizeOption": "custom", "maxWidth": "abc"},
+        {"resizeOption": "custom", "maxWidth": "12.5"},
+        {"resizeOption": "custom", "maxWidth": 0},
+        {"resizeOption": "custom", "maxHeight": Const.RESIZE_MAX_DIMENSION + 1},
+    ],
+)
+def test_get_resize_box_rejects_invalid(options):
+    with pytest.raises(ValueError):
+        get_resize_box(options)
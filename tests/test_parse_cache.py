@@ -0,0 +1,62 @@
+import pytest
+
+from config.const import Const
+
+@pytest.fixture
+def parse_cache(app_module):
+    with app_module.state_db() as db:
+        db.execute("DELETE FROM parse_cache")
+    return app_module
+
+def test_normalize_video_url_expands_youtu_be(app_module):
+    assert (
+        app_module.normalize_video_url("https://youtu.be/dQw4w9WgXcQ?si=abc")
+        == "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+    )
+
+def test_normalize_video_url_same_key_for_watch_variants(app_module):
+    expected = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+    for url in (
+        "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+        "http://youtube.com/watch?v=dQw4w9WgXcQ",
+        "https://m.youtube.com/watch/?feature=share&v=dQw4w9WgXcQ",
+        "  HTTPS://WWW.YOUTUBE.COM/watch?v=dQw4w9WgXcQ&utm_source=x  ",
+    ):
+        assert app_module.normalize_video_url(url) == expected
+
+def test_normalize_video_url_drops_tracking_params(app_module):
+    assert (
+        app_module.normalize_video_url(
+            "https://m.bilibili.com/video/BV1xx411c7mD/?spm_id_from=333.1007"
+            "&vd_source=abc&p=2&utm_medium=share"
+        )
+        == "https://www.bilibili.com/video/BV1xx411c7mD?p=2"
+    )
+
+def test_normalize_video_url_keeps_content_params(app_module):
+    # 播放列表和分P参数决定内容，不能被去掉；参数按名称排序
+    assert (
+        app_module.normalize_video_url("https://www.youtube.com/watch?v=abc&list=PL1&t=30")
+        == "https://www.youtube.com/watch?list=PL1&t=30&v=abc"
+    )
+
+def test_parse_cache_roundtrip(parse_cache):
+    assert parse_cache.parse_cache_get("k") is None
+    parse_cache.parse_cache_put("k", {"title": "视频", "formats": [1, 2]})
+    assert parse_cache.parse_cache_get("k") == {"title": "视频", "formats": [1, 2]}
+
+def test_parse_cache_expires(parse_cache, monkeypatch):
+    parse_cache.parse_cache_put("k", {"title": "a"})
+    monkeypatch.setattr(Const, "PARSE_CACHE_TTL", 0)
+    assert parse_cache.parse_cache_get("k") is None
+
+def test_parse_cache_evicts_least_recently_used(parse_cache, monkeypatch):
+    monkeypatch.setattr(Const, "PARSE_CACHE_MAX_BYTES", 2 * len('{"title": "xxxxxxxx"}'))
+    parse_cache.parse_cache_put("a", {"title": "aaaaaaaa"})
+    parse_cache.parse_cache_put("b", {"title": "bbbbbbbb"})
+    # 读取 a 后 b 成为最久未访问的条目
+    assert parse_cache.parse_cache_get("a") is not None
+    parse_cache.parse_cache_put("c", {"title": "cccccccc"})
+    assert parse_cache.parse_cache_get("b") is None
+    assert parse_cache.parse_cache_get("a") is not None
+    assert parse_cache.parse_cache_get("c") is not None